@@ -0,0 +1,163 @@
+#!/usr/bin/python
+# Times the core commands against synthetic wikis.
+#
+# Each repeat generates a fresh wiki in a temporary directory and runs
+# add, diff, diff --cached, write_tree, commit -a, log, log of a single
+# page, branch switching and merge through the DiskDatabase/Interface
+# APIs. Results are written as JSON, and --baseline compares them
+# against an earlier run.
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import darkwiki
+from synthetic_wiki import SyntheticWiki
+
+OPERATIONS = ('add', 'diff', 'diff --cached', 'write_tree', 'commit -a',
+              'log', 'log -- page', 'branch', 'merge')
+
+def timed(timings, name, function, *args):
+    # Commands like merge print progress, keep it out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = function(*args)
+        timings[name] = time.perf_counter() - start
+    return result
+
+def add_files(db, filenames):
+    for filename in filenames:
+        db.add_file(filename)
+
+def page_history(interface, filename):
+    return list(interface.iter_path_commits([filename]))
+
+def commit_all(db, interface):
+    interface.add_changed_files()
+    return db.commit()
+
+def run_once(root_path, params):
+    wiki = SyntheticWiki(root_path, **params)
+    db = wiki.generate()
+    interface = darkwiki.Interface(db)
+    timings = {}
+
+    edited = wiki.edit_pages()
+    timed(timings, 'diff', interface.diff_noncached, None)
+    timed(timings, 'add', add_files, db, edited)
+    timed(timings, 'diff --cached', interface.diff_cached, None)
+    timed(timings, 'write_tree', db.write_tree)
+
+    wiki.edit_pages()
+    timed(timings, 'commit -a', commit_all, db, interface)
+    timed(timings, 'log', interface.fetch_commits)
+    timed(timings, 'log -- page', page_history, interface, edited[0])
+
+    # Diverge a feature branch from master, then switch back to master
+    db.create_branch('feature', db.last_commit_ident())
+    db.switch_branch('feature')
+    half = len(wiki.filenames) // 2
+    wiki.edit_pages(filenames=wiki.filenames[:half])
+    commit_all(db, interface)
+    timed(timings, 'branch', db.switch_branch, 'master')
+
+    wiki.edit_pages(filenames=wiki.filenames[half:])
+    commit_all(db, interface)
+    timed(timings, 'merge', interface.merge, 'master', 'feature')
+
+    return timings
+
+def summarize(runs):
+    results = {}
+    for name in OPERATIONS:
+        timings = [run[name] for run in runs]
+        results[name] = {
+            'min': min(timings),
+            'median': statistics.median(timings),
+            'runs': timings
+        }
+    return results
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name in OPERATIONS:
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['min']
+        after = results[name]['min']
+        ratio = after / before if before else float('inf')
+        print('%-14s %9.2f ms -> %9.2f ms  x%.2f' % (
+            name, before * 1000, after * 1000, ratio))
+        if ratio > tolerance:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(prog='core_commands')
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--page-size', type=int, default=2048)
+    parser.add_argument('--commits', type=int, default=20)
+    parser.add_argument('--edit-rate', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='core_commands.json')
+    parser.add_argument('--baseline', help='earlier results to compare with')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='slowdown ratio counted as a regression')
+    args = parser.parse_args()
+
+    params = {
+        'files': args.files,
+        'depth': args.depth,
+        'page_size': args.page_size,
+        'commits': args.commits,
+        'edit_rate': args.edit_rate,
+        'seed': args.seed
+    }
+
+    runs = []
+    for _ in range(args.repeat):
+        with tempfile.TemporaryDirectory() as root_path:
+            runs.append(run_once(root_path, params))
+    results = summarize(runs)
+
+    for name in OPERATIONS:
+        print('%-14s min %9.2f ms  median %9.2f ms' % (
+            name, results[name]['min'] * 1000,
+            results[name]['median'] * 1000))
+
+    report = {
+        'benchmark': 'core_commands',
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': params,
+        'repeat': args.repeat,
+        'results': results
+    }
+    with open(args.output, 'w') as file_handle:
+        json.dump(report, file_handle, indent=2)
+    print('Wrote', args.output)
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as file_handle:
+        baseline = json.load(file_handle)
+    if baseline.get('params') != params:
+        print('warning: baseline was run with different parameters')
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print('Regressions:', ', '.join(regressions))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
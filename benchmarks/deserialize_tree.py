@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# Times decoding of tree objects and tip lists as received over micronet.
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import darkwiki
+from darkwiki.micronet import ObjectMessage, SyncMessage
+
+def make_tree(size):
+    tree = []
+    for index in range(size):
+        ident = hashlib.sha256(b'%d' % index).hexdigest()
+        tree.append(('644', darkwiki.DataType.BLOB, ident,
+                     'page_%06d.md' % index))
+    return tree
+
+def make_tips(size):
+    return dict(('branch_%06d' % index,
+                 hashlib.sha256(b'%d' % index).hexdigest())
+                for index in range(size))
+
+def best_time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(prog='deserialize_tree')
+    parser.add_argument('--entries', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    tree = make_tree(args.entries)
+    data = ObjectMessage('00' * 32, darkwiki.DataType.TREE, tree).to_data()
+    assert ObjectMessage.from_data(data).object == tree
+    elapsed = best_time(lambda: ObjectMessage.from_data(data), args.repeat)
+    print('tree   %6d entries %8d bytes: %8.2f ms' % (
+        args.entries, len(data), elapsed * 1000))
+
+    tips = make_tips(args.entries)
+    data = SyncMessage(tips).to_data()
+    assert SyncMessage.from_data(data).tips == tips
+    elapsed = best_time(lambda: SyncMessage.from_data(data), args.repeat)
+    print('tips   %6d entries %8d bytes: %8.2f ms' % (
+        args.entries, len(data), elapsed * 1000))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
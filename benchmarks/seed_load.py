@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# Load test for the seed node.
+#
+# Simulates thousands of nodes registering with a seed node on loopback.
+# Registrations are spread over a pool of DEALER sockets which behave
+# like the REQ socket each node uses, one request in flight per socket.
+import aiozmq
+import argparse
+import asyncio
+import os
+import sys
+import time
+import zmq
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import darkwiki
+import seed
+
+def registration(index):
+    serial = darkwiki.Serializer()
+    serial.write_string('127.0.0.1:%d' % (20000 + index))
+    # Any 32 bytes will do, the seed node never checks them
+    serial.write_data(os.urandom(32))
+    return serial.result()
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+async def client(seed_address, requests, latencies, reply_sizes):
+    stream = await aiozmq.create_zmq_stream(
+        zmq_type=zmq.DEALER,
+        connect='tcp://%s' % seed_address)
+
+    while requests:
+        data = requests.pop()
+        start = time.perf_counter()
+        stream.write([b'', data])
+        frames = await stream.read()
+        latencies.append(time.perf_counter() - start)
+
+        deserial = darkwiki.Deserializer(frames[-1])
+        reply_sizes.append(deserial.read_2_bytes())
+
+    stream.close()
+
+async def run(args):
+    seed_node = None
+    if args.seed is None:
+        seed_node = seed.SeedNode(port=args.port, sample_size=args.sample_size)
+        seed_task = asyncio.ensure_future(seed_node.start())
+        seed_address = '127.0.0.1:%d' % args.port
+        await asyncio.sleep(0.1)
+    else:
+        seed_address = args.seed
+
+    # Every node registers `rounds` times, as if refreshing its entry
+    requests = [registration(index) for index in range(args.nodes)]
+    requests = requests * args.rounds
+    requests.reverse()
+
+    latencies = []
+    reply_sizes = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(seed_address, requests, latencies,
+                                  reply_sizes)
+                           for _ in range(args.clients)])
+    elapsed = time.perf_counter() - start
+
+    print('requests:        %d' % len(latencies))
+    print('clients:         %d' % args.clients)
+    print('elapsed:         %.2f s' % elapsed)
+    print('throughput:      %.0f req/s' % (len(latencies) / elapsed))
+    print('latency p50:     %.2f ms' % (percentile(latencies, 0.5) * 1000))
+    print('latency p99:     %.2f ms' % (percentile(latencies, 0.99) * 1000))
+    print('max reply peers: %d' % max(reply_sizes))
+    if seed_node is not None:
+        print('known peers:     %d' % len(seed_node))
+        seed_task.cancel()
+
+def main():
+    parser = argparse.ArgumentParser(prog='seed_load')
+    parser.add_argument('--nodes', type=int, default=5000)
+    parser.add_argument('--rounds', type=int, default=2)
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--port', type=int, default=15577)
+    parser.add_argument('--sample-size', type=int, default=seed.SAMPLE_SIZE)
+    parser.add_argument('--seed', help='address of an already running seed '
+                                       'node, e.g. 127.0.0.1:5577')
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(run(args))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
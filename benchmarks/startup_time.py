@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# Guards CLI startup time against import regressions.
+#
+# Runs `python -X importtime` over `import darkwiki` and the CLI module,
+# reports the cumulative import time and fails when a heavy dependency
+# is imported eagerly or the time exceeds the budget.
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Only the commands that need them may import these
+HEAVY_MODULES = ('aiozmq', 'zmq', 'asyncio', 'pickle', 'nacl',
+                 'diff_match_patch', 'termcolor')
+
+TARGETS = {
+    'import darkwiki': 'import darkwiki',
+    'darkwiki.py': 'import runpy, sys; sys.argv = ["darkwiki.py"]; '
+                   'runpy.run_path("darkwiki.py", run_name="darkwiki_cli")'
+}
+
+def import_times(code):
+    environment = dict(os.environ, PYTHONPATH=ROOT)
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                             cwd=ROOT, env=environment,
+                             stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE, text=True)
+
+    # import time: self [us] | cumulative | imported package
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        # Keep the indentation, which shows what imported the module
+        times[module[1:].rstrip()] = int(cumulative)
+    return times
+
+def measure(code, repeat):
+    # Leave out whatever the interpreter imports on its own
+    startup = set(import_times('pass'))
+
+    runs = [import_times(code) for _ in range(repeat)]
+    total = min(sum(cumulative for module, cumulative in times.items()
+                    if not module.startswith(' ') and module not in startup)
+                for times in runs)
+    return total, runs[0]
+
+def main():
+    parser = argparse.ArgumentParser(prog='startup_time')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=60.0,
+                        help='maximum cumulative import time per target')
+    args = parser.parse_args()
+
+    failed = False
+    for name, code in TARGETS.items():
+        total, times = measure(code, args.repeat)
+        print('%-16s %7.1f ms' % (name, total / 1000))
+
+        packages = set(module.strip().split('.')[0] for module in times)
+        heavy = sorted(packages.intersection(HEAVY_MODULES))
+        if heavy:
+            print('  error: eagerly imports %s' % ', '.join(heavy))
+            failed = True
+        if total / 1000 > args.budget_ms:
+            print('  error: over the %.0f ms budget' % args.budget_ms)
+            failed = True
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+#!/usr/bin/python
+# Syncs N micronet nodes with each other over 127.0.0.1.
+#
+# Starts a seed node and N nodes in one event loop, each with its own
+# temporary wiki and synthetic history, then waits until every node
+# holds every other node's tip and all the objects behind it. Reports
+# time to convergence, bytes on the wire, messages per second and
+# decrypt failures.
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import darkwiki
+import darkwiki.micronet
+import seed
+from synthetic_wiki import SyntheticWiki
+
+# How often the seed list is refreshed, so that nodes which
+# registered early learn about the ones which came after them
+SEED_REFRESH_INTERVAL = 0.5
+POLL_INTERVAL = 0.05
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def reachable_objects(db, commit_ident):
+    idents = set()
+    pending = [commit_ident]
+    while pending:
+        ident = pending.pop()
+        if ident is None or ident in idents:
+            continue
+        idents.add(ident)
+        type_, object_ = db.fetch(ident)
+        if type_ == darkwiki.DataType.COMMIT:
+            pending.append(object_['previous_commit'])
+            pending.append(object_['tree'])
+        elif type_ == darkwiki.DataType.TREE:
+            pending.extend(row[2] for row in object_)
+    return idents
+
+class LoopbackNode:
+
+    def __init__(self, root_path, seed_address, params, index,
+                 target_outbound=darkwiki.micronet.DEFAULT_TARGET_OUTBOUND):
+        wiki = SyntheticWiki(root_path, seed=index, **params)
+        self.db = wiki.generate()
+        self.interface = darkwiki.Interface(self.db)
+
+        self.secret = darkwiki.random_secret()
+        self.public_key = darkwiki.secret_to_public(self.secret)
+        self.tip = self.db.last_commit_ident()
+        self.objects = reachable_objects(self.db, self.tip)
+
+        node_id = darkwiki.micronet.public_to_node_id(self.public_key)
+        self.node = darkwiki.micronet.Node(
+            self.db, self.interface, node_id, free_port(), self.secret,
+            seed_address=seed_address, target_outbound=target_outbound)
+        self.node.connections.refresh_interval = SEED_REFRESH_INTERVAL
+
+    def has_synced(self, other):
+        remote_tip = self.db.branch_remote_last_commit_ident(
+            other.public_key.hex(), 'master')
+        if remote_tip != other.tip:
+            return False
+        return other.objects.issubset(self.db.list())
+
+async def wait_for_convergence(nodes, timeout):
+    start = time.perf_counter()
+    pending = [(node, other) for node in nodes for other in nodes
+               if node is not other]
+    while pending:
+        if time.perf_counter() - start > timeout:
+            return None
+        pending = [(node, other) for node, other in pending
+                   if not node.has_synced(other)]
+        await asyncio.sleep(POLL_INTERVAL)
+    return time.perf_counter() - start
+
+async def run(nodes, seed_node, timeout):
+    tasks = [asyncio.ensure_future(seed_node.start())]
+    tasks += [asyncio.ensure_future(node.node.start()) for node in nodes]
+    try:
+        return await wait_for_convergence(nodes, timeout)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+def main():
+    parser = argparse.ArgumentParser(prog='sync_loopback')
+    parser.add_argument('--nodes', type=int, default=4)
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--page-size', type=int, default=1024)
+    parser.add_argument('--commits', type=int, default=5)
+    parser.add_argument('--edit-rate', type=float, default=0.2)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--target-outbound', type=int,
+                        default=darkwiki.micronet.DEFAULT_TARGET_OUTBOUND,
+                        help='peers each node connects to by itself')
+    parser.add_argument('--output', default='sync_loopback.json')
+    parser.add_argument('--verbose', action='store_true',
+                        help='log the protocol messages of the nodes')
+    args = parser.parse_args()
+
+    params = {
+        'files': args.files,
+        'depth': args.depth,
+        'page_size': args.page_size,
+        'commits': args.commits,
+        'edit_rate': args.edit_rate
+    }
+
+    seed_port = free_port()
+    seed_node = seed.SeedNode(seed_port)
+    seed_address = '127.0.0.1:%d' % seed_port
+
+    with tempfile.TemporaryDirectory() as temp_path:
+        nodes = [LoopbackNode(os.path.join(temp_path, 'node_%d' % index),
+                              seed_address, params, index,
+                              args.target_outbound)
+                 for index in range(args.nodes)]
+
+        if args.verbose:
+            logging.basicConfig(level=logging.DEBUG)
+        elapsed = asyncio.run(run(nodes, seed_node, args.timeout))
+        # Remote branches are only learned from the peer itself, so
+        # below a full mesh of channels some pairs never sync
+        synced = [(nodes.index(node), nodes.index(other))
+                  for node in nodes for other in nodes
+                  if node is not other and node.has_synced(other)]
+
+    counters = collections.Counter()
+    for node in nodes:
+        counters.update(node.node.metrics.counters)
+
+    if elapsed is None:
+        print('Did not converge within %.1f seconds' % args.timeout)
+        print('  %d of %d peer pairs synced' % (
+            len(synced), args.nodes * (args.nodes - 1)))
+    else:
+        print('Converged %d nodes in %.2f s' % (args.nodes, elapsed))
+        print('  %d bytes sent, %d bytes received' % (
+            counters['bytes_sent'], counters['bytes_received']))
+        print('  %d messages in %d envelopes, %.0f messages/s' % (
+            counters['messages_received'], counters['envelopes_received'],
+            counters['messages_received'] / elapsed))
+        print('  %d decrypt failures' % counters['decrypt_failures'])
+        for node in nodes:
+            latency = node.node.metrics.histograms.get('fetch_latency')
+            if latency is not None:
+                print('  node %d fetch latency p50 %.1f ms p99 %.1f ms' % (
+                    nodes.index(node), latency.quantile(0.5) * 1000,
+                    latency.quantile(0.99) * 1000))
+
+    report = {
+        'benchmark': 'sync_loopback',
+        'timestamp': int(time.time()),
+        'nodes': args.nodes,
+        'params': params,
+        'converged': elapsed is not None,
+        'seconds': elapsed,
+        'synced_pairs': synced,
+        'counters': dict(counters),
+        'node_metrics': [node.node.metrics.to_dict() for node in nodes],
+        'messages_per_second': (counters['messages_received'] / elapsed
+                                if elapsed else None),
+        'messages_per_envelope': (counters['messages_received'] /
+                                  counters['envelopes_received']
+                                  if counters['envelopes_received'] else None)
+    }
+    with open(args.output, 'w') as file_handle:
+        json.dump(report, file_handle, indent=2)
+    print('Wrote', args.output)
+
+    return 0 if elapsed is not None else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
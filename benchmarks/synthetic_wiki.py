@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# Generates synthetic wikis for the benchmarks.
+#
+#   synthetic_wiki.py PATH --files 500 --depth 3 --commits 20
+#
+# creates PATH/.darkwiki with a history of `commits` commits, each
+# editing `edit_rate` of the pages.
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import darkwiki
+
+WORDS = ('wiki', 'page', 'node', 'peer', 'branch', 'merge', 'commit',
+         'tree', 'blob', 'index', 'secret', 'public', 'key', 'sync',
+         'object', 'remote', 'darkwiki', 'the', 'a', 'of', 'and', 'to')
+# Subdirectories per directory level
+FANOUT = 4
+
+class SyntheticWiki:
+
+    def __init__(self, root_path, files=500, depth=3, page_size=2048,
+                 commits=20, edit_rate=0.1, seed=0):
+        self.root_path = root_path
+        self.files = files
+        self.depth = depth
+        self.page_size = page_size
+        self.commits = commits
+        self.edit_rate = edit_rate
+
+        self._random = random.Random(seed)
+        self.db = None
+        self.filenames = []
+
+    def generate(self):
+        os.makedirs(os.path.join(self.root_path, '.darkwiki'))
+        self.db = darkwiki.DiskDatabase(self.root_path)
+        self.db.initialize()
+
+        for index in range(self.files):
+            filename = self._page_filename(index)
+            self.write_page(filename, self._page_text())
+            self.db.add_file(filename)
+            self.filenames.append(filename)
+        self.db.commit()
+
+        for _ in range(self.commits - 1):
+            for filename in self.edit_pages():
+                self.db.add_file(filename)
+            self.db.commit()
+        return self.db
+
+    def _page_filename(self, index):
+        directories = ['section_%d' % self._random.randrange(FANOUT)
+                       for _ in range(self.depth)]
+        return os.path.join(*directories, 'page_%06d.md' % index)
+
+    def _line(self):
+        words = self._random.choices(WORDS, k=self._random.randint(4, 12))
+        return ' '.join(words) + '\n'
+
+    def _page_text(self):
+        lines = ['# %s\n' % self._line().strip()]
+        size = len(lines[0])
+        while size < self.page_size:
+            lines.append(self._line())
+            size += len(lines[-1])
+        return ''.join(lines)
+
+    def write_page(self, filename, text):
+        path = self.db.transform_root_path(filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file_handle:
+            file_handle.write(text)
+
+    def read_page(self, filename):
+        with open(self.db.transform_root_path(filename)) as file_handle:
+            return file_handle.read()
+
+    def edit_pages(self, rate=None, filenames=None):
+        # Rewrites one line and appends another on a random
+        # selection of pages, returns the edited filenames
+        if rate is None:
+            rate = self.edit_rate
+        if filenames is None:
+            filenames = self.filenames
+        count = max(1, int(len(filenames) * rate))
+        edited = self._random.sample(filenames, min(count, len(filenames)))
+
+        for filename in edited:
+            lines = self.read_page(filename).splitlines(True)
+            lines[self._random.randrange(len(lines))] = self._line()
+            lines.append(self._line())
+            self.write_page(filename, ''.join(lines))
+        return edited
+
+def main():
+    parser = argparse.ArgumentParser(prog='synthetic_wiki')
+    parser.add_argument('path')
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--page-size', type=int, default=2048)
+    parser.add_argument('--commits', type=int, default=20)
+    parser.add_argument('--edit-rate', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    wiki = SyntheticWiki(args.path, args.files, args.depth, args.page_size,
+                         args.commits, args.edit_rate, args.seed)
+    wiki.generate()
+    print('Generated %d pages and %d commits in %s' % (
+        args.files, args.commits, args.path))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
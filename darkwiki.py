@@ -1,14 +1,39 @@
 #!/usr/bin/python
 import argparse
 import darkwiki
+import datetime
 import json
 import os
 import sys
-from termcolor import colored
 
-def main():
+# Commands which always run in the calling process
+LOCAL_COMMANDS = ('init', 'sync', 'daemon')
+
+# Set while serving as a daemon so every command shares its caches
+shared_database = None
+
+def open_database():
+    if shared_database is not None:
+        return shared_database
+    return darkwiki.DiskDatabase()
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+        profile_filename = os.environ.get('DARKWIKI_PROFILE')
+        if profile_filename:
+            argv = ['--profile', profile_filename] + argv
+        code = forward_to_daemon(argv)
+        if code is not None:
+            return code
+
     parser = argparse.ArgumentParser(prog='darkwiki')
     parser.set_defaults(func=None)
+    parser.add_argument('--profile', metavar='FILENAME',
+                        help='write cProfile stats, or collapsed stacks '
+                             'when FILENAME ends in .folded')
+    parser.add_argument('--timings', action='store_true',
+                        help='print time spent in the main operations')
     subparsers = parser.add_subparsers()
 
     # init
@@ -63,8 +88,23 @@ def main():
     parser_commit.add_argument('-a', '--all', action='store_true')
     parser_commit.set_defaults(func=commit)
 
+    # status
+    parser_status = subparsers.add_parser('status')
+    parser_status.set_defaults(func=status)
+
     # log
     parser_log = subparsers.add_parser('log')
+    parser_log.add_argument('-n', '--max-count', type=int, default=None,
+                            help='show at most this many commits')
+    parser_log.add_argument('--since', type=parse_date, default=None,
+                            help='only commits at or after this date')
+    parser_log.add_argument('--until', type=parse_date, default=None,
+                            help='only commits at or before this date')
+    parser_log.add_argument('revision', nargs='?', default=None,
+                            help='commit or branch to start from, or a '
+                                 'range FROM..TO')
+    parser_log.add_argument('paths', nargs='*',
+                            help='only commits which changed these paths')
     parser_log.set_defaults(func=log)
 
     # diff
@@ -92,6 +132,14 @@ def main():
     parser_sync = subparsers.add_parser('sync')
     parser_sync.add_argument('listen_port', type=int)
     parser_sync.add_argument('secret')
+    parser_sync.add_argument('--stats', metavar='FILENAME',
+                             help='where to write node statistics, '
+                                  'default .darkwiki/stats.json')
+    parser_sync.add_argument('--stats-interval', type=float, default=10.0)
+    parser_sync.add_argument('--watch', action='store_true',
+                             help='track changed files with inotify')
+    parser_sync.add_argument('--log-level', default='info',
+                             choices=('debug', 'info', 'warning', 'error'))
     parser_sync.set_defaults(func=sync)
 
     # authorize
@@ -104,13 +152,54 @@ def main():
     parser_merge.add_argument('branch')
     parser_merge.set_defaults(func=merge)
 
-    args = parser.parse_args()
+    # gc
+    parser_gc = subparsers.add_parser('gc')
+    parser_gc.add_argument('--dry-run', action='store_true',
+                           help='only report what would be removed')
+    parser_gc.add_argument('--grace-period', type=float,
+                           default=None, metavar='SECONDS',
+                           help='keep unreachable objects younger than '
+                                'this, default two weeks')
+    parser_gc.set_defaults(func=collect_garbage)
+
+    # daemon
+    parser_daemon = subparsers.add_parser('daemon')
+    parser_daemon.add_argument('--watch', action='store_true',
+                               help='track changed files with inotify')
+    parser_daemon.set_defaults(func=run_daemon)
+
+    args = parser.parse_args(argv)
+    if args.func is log and '--' in argv:
+        # argparse drops the --, so a page named like a branch would
+        # be taken as the revision. Only what comes before it can be.
+        index = argv.index('--')
+        args = parser.parse_args(argv[:index])
+        args.paths += argv[index + 1:]
 
     if args.func is None:
         parser.print_usage()
         return -1
 
-    return args.func(args)
+    if args.timings:
+        darkwiki.timing.reset()
+        darkwiki.timing.enable()
+    try:
+        if args.profile is not None:
+            with darkwiki.timing.profile(args.profile):
+                return args.func(args)
+        return args.func(args)
+    finally:
+        if args.timings:
+            darkwiki.timing.disable()
+            darkwiki.timing.print_summary()
+
+def forward_to_daemon(argv):
+    if os.environ.get('DARKWIKI_NO_DAEMON'):
+        return None
+    # Options may come before the command
+    if any(arg in LOCAL_COMMANDS for arg in argv):
+        return None
+    return darkwiki.daemon.run_client(argv)
 
 def initialize(parser):
     os.mkdir('.darkwiki')
@@ -121,28 +210,28 @@ def initialize(parser):
 def add_object(parser):
     data = open(parser.filename, 'rb').read()
 
-    db = darkwiki.DiskDatabase()
+    db = open_database()
     ident = db.add_blob(data)
     print(ident)
 
     return 0
 
 def simple_add(parser):
-    db = darkwiki.DiskDatabase()
+    db = open_database()
     # filename relative to root
     filename = db.transform_relative_path(parser.filename)
     db.add_file(filename)
     return 0
 
 def simple_rm(parser):
-    db = darkwiki.DiskDatabase()
+    db = open_database()
     # filename relative to root
     filename = db.transform_relative_path(parser.filename)
     db.remove_from_index(filename)
     return 0
 
 def list_objects(parser):
-    db = darkwiki.DiskDatabase()
+    db = open_database()
 
     for ident in db.list():
         print(ident)
@@ -150,7 +239,7 @@ def list_objects(parser):
     return 0
 
 def update_index(parser):
-    db = darkwiki.DiskDatabase()
+    db = open_database()
 
     if parser.clear:
         db.clear_index()
@@ -163,20 +252,20 @@ def update_index(parser):
     return 0
 
 def read_index(parser):
-    db = darkwiki.DiskDatabase()
+    db = open_database()
     current_index = db.read_index()
     for mode, ident, filename in current_index:
         print(mode, ident, filename)
     return 0
 
 def write_tree(parser):
-    db = darkwiki.DiskDatabase()
+    db = open_database()
     ident = db.write_tree()
     print(ident)
     return 0
 
 def show_file(parser):
-    db = darkwiki.DiskDatabase()
+    db = open_database()
 
     ident = db.fuzzy_match(parser.ident)
     if not ident:
@@ -195,7 +284,7 @@ def show_file(parser):
     return 0
 
 def show_type(parser):
-    db = darkwiki.DiskDatabase()
+    db = open_database()
 
     ident = db.fuzzy_match(parser.ident)
     if not ident:
@@ -208,42 +297,137 @@ def show_type(parser):
     return 0
 
 def commit(parser):
-    db = darkwiki.DiskDatabase()
+    db = open_database()
     if parser.all:
         interface = darkwiki.Interface(db)
-        interface.add_changed_files()
+        dirty_paths = darkwiki.watcher.dirty_paths(db)
+        interface.add_changed_files(dirty_paths)
     ident = db.commit()
     print(ident)
     return 0
 
-def log(parser):
-    db = darkwiki.DiskDatabase()
+def status(parser):
+    db = open_database()
     interface = darkwiki.Interface(db)
-    log = interface.fetch_commits()
-    previous = None
-    for commit in log:
-        if previous is not None:
-            assert commit['ident'] == previous
-        print(commit['ident'])
-        print(commit['timestamp'], '+%s' % commit['utc_offset'])
-        previous = commit['previous_commit']
+    dirty_paths = darkwiki.watcher.dirty_paths(db)
+    staged, unstaged, untracked = interface.status(dirty_paths)
+
+    print('On branch', db.active_branch())
+    if staged:
+        print()
+        print('Changes to be committed:')
+        for change, filename in staged:
+            print('\t%-12s%s' % (change + ':', filename))
+    if unstaged:
         print()
+        print('Changes not staged for commit:')
+        for change, filename in unstaged:
+            print('\t%-12s%s' % (change + ':', filename))
+    if untracked:
+        print()
+        print('Untracked files:')
+        for filename in untracked:
+            print('\t%s' % filename)
+    if not staged and not unstaged and not untracked:
+        print('nothing to commit, working tree clean')
+    return 0
+
+def parse_date(value):
+    # Unix time or an ISO 8601 date, local time unless it has an offset
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return int(datetime.datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid date: %s' % value)
+
+def resolve_revision(db, revision):
+    if revision == 'HEAD':
+        return db.last_commit_ident()
+    try:
+        ident = db.branch_last_commit_ident(revision)
+    except OSError:
+        # Such as foo/bar when there is a branch foo
+        ident = None
+    if ident is not None:
+        return ident
+    if len(revision) == 64 and db.exists(revision):
+        ident = revision
+    elif revision:
+        ident = db.fuzzy_match(revision)
+    if ident is None or db.object_type(ident) != darkwiki.DataType.COMMIT:
+        return None
+    return ident
+
+def log(parser):
+    db = open_database()
+    interface = darkwiki.Interface(db)
+
+    revision = parser.revision
+    paths = parser.paths
+    start_ident = stop_ident = None
+    if revision is not None and '..' in revision:
+        stop_revision, start_revision = revision.split('..', 1)
+        stop_ident = resolve_revision(db, stop_revision or 'HEAD')
+        start_ident = resolve_revision(db, start_revision or 'HEAD')
+        if stop_ident is None or start_ident is None:
+            print('darkwiki: unknown revision range', revision,
+                  file=sys.stderr)
+            return -1
+    elif revision is not None:
+        start_ident = resolve_revision(db, revision)
+        if start_ident is None:
+            print('darkwiki: unknown revision %s, use -- to separate '
+                  'paths from revisions' % revision, file=sys.stderr)
+            return -1
+
+    if paths:
+        commits = interface.iter_path_commits(paths, start_ident, stop_ident)
+    else:
+        commits = interface.iter_commits(start_ident, stop_ident)
+
+    count = 0
+    try:
+        for commit in commits:
+            if parser.max_count is not None and count >= parser.max_count:
+                break
+            # History is newest first, nothing older can match
+            if parser.since is not None and \
+                    commit['timestamp'] < parser.since:
+                break
+            if parser.until is not None and \
+                    commit['timestamp'] > parser.until:
+                continue
+            print(commit['ident'])
+            print(commit['timestamp'], '+%s' % commit['utc_offset'])
+            print()
+            count += 1
+            # Stop before reading another commit
+            if parser.max_count is not None and count >= parser.max_count:
+                break
+    except ValueError as error:
+        print('darkwiki:', error, file=sys.stderr)
+        return -1
     return 0
 
 def diff(parser):
-    db = darkwiki.DiskDatabase()
+    db = open_database()
     interface = darkwiki.Interface(db)
     if parser.cached:
         diff_result = interface.diff_cached(parser.commit_ident)
     else:
-        diff_result = interface.diff_noncached(parser.commit_ident)
+        dirty_paths = darkwiki.watcher.dirty_paths(db)
+        diff_result = interface.diff_noncached(parser.commit_ident,
+                                               dirty_paths)
     for filename, diffs in diff_result:
         print('---', filename)
         darkwiki.print_diff(diffs)
     return 0
 
 def branch(parser):
-    db = darkwiki.DiskDatabase()
+    db = open_database()
 
     if parser.branch_name is None:
         display_branches(db)
@@ -263,6 +447,8 @@ def branch(parser):
     return 0
 
 def display_branches(db):
+    from termcolor import colored
+
     branches = db.fetch_local_branches()
     current_branch = db.active_branch()
     for branch in branches:
@@ -284,10 +470,19 @@ def to_public(parser):
 
 def sync(parser):
     import asyncio
+    import logging
+    import signal
 
-    db = darkwiki.DiskDatabase()
+    logging.basicConfig(level=parser.log_level.upper(),
+                        format='%(asctime)s %(levelname)s %(message)s')
+
+    db = open_database()
     interface = darkwiki.Interface(db)
 
+    stats_filename = parser.stats
+    if stats_filename is None:
+        stats_filename = os.path.join(db.dot_path, 'stats.json')
+
     listen_port = parser.listen_port
     secret = bytes.fromhex(parser.secret)
 
@@ -296,19 +491,39 @@ def sync(parser):
     print('Using node ID:', node_id)
     print('  public_key =', public_key.hex())
     print('  secret =', secret.hex())
-
-    node = darkwiki.micronet.Node(db, interface, node_id, listen_port, secret)
-    asyncio.get_event_loop().run_until_complete(node.start())
+    print('  stats =', stats_filename)
+
+    node = darkwiki.micronet.Node(db, interface, node_id, listen_port, secret,
+                                  stats_filename=stats_filename,
+                                  stats_interval=parser.stats_interval)
+
+    if parser.watch:
+        watcher = darkwiki.watcher.Watcher(db)
+        watcher.start()
+
+    loop = asyncio.get_event_loop()
+    task = loop.create_task(node.start())
+    # Shut down cleanly on kill as well as ^C so the stats get written
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, task.cancel)
+    try:
+        loop.run_until_complete(task)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        if parser.watch:
+            watcher.stop()
+    return 0
 
 def authorize(parser):
-    db = darkwiki.DiskDatabase()
+    db = open_database()
     keyring = darkwiki.micronet.Keyring(db)
     public_key = bytes.fromhex(parser.public_key)
     keyring.add_public_key(public_key)
     return 0
 
 def merge(parser):
-    db = darkwiki.DiskDatabase()
+    db = open_database()
     interface = darkwiki.Interface(db)
 
     current_branch = db.active_branch()
@@ -323,6 +538,53 @@ def merge(parser):
 
     return 0
 
+def collect_garbage(parser):
+    db = open_database()
+    grace_period = parser.grace_period
+    if grace_period is None:
+        grace_period = darkwiki.gc.DEFAULT_GRACE_PERIOD
+
+    result = darkwiki.gc.collect(db, grace_period, parser.dry_run)
+
+    action = 'Would remove' if parser.dry_run else 'Removed'
+    print('%d reachable objects' % result.live)
+    if result.kept:
+        print('%d unreachable objects kept within the grace period' %
+              result.kept)
+    print('%s %d unreachable objects, %d bytes' % (
+        action, len(result.pruned), result.pruned_bytes))
+    print('%s %d stale partial transfers, %d bytes' % (
+        action, len(result.partials), result.partial_bytes))
+    return 0
+
+def run_daemon(parser):
+    import signal
+    global shared_database
+
+    shared_database = darkwiki.DiskDatabase(
+        object_cache_bytes=darkwiki.daemon.DEFAULT_CACHE_BYTES)
+    daemon = darkwiki.daemon.Daemon(shared_database, main)
+    print('Listening on', daemon.path)
+    if parser.watch:
+        watcher = darkwiki.watcher.Watcher(shared_database)
+        watcher.start()
+    # Stop cleanly on kill as well as ^C, removing the socket
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if parser.watch:
+            watcher.stop()
+    return 0
+
 if __name__ == '__main__':
-    sys.exit(main())
+    try:
+        sys.exit(main())
+    except BrokenPipeError:
+        # Output piped into head and friends which stopped reading
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(1)
 
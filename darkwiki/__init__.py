@@ -1,6 +1,5 @@
-import darkwiki.micronet
-from darkwiki.crypto import *
-from darkwiki.diff import difference, three_way_merge, print_diff
+import importlib
+
 from darkwiki.difference_engine import DifferenceInterfaceDisk, \
     DifferenceInterfaceIndex, DifferenceInterfaceCommit, DifferenceEngine
 from darkwiki.disk_database import DataType, DiskDatabase
@@ -8,5 +7,34 @@ from darkwiki.directory_tree import DirectoryTree, build_tree, \
                                     read_tree, all_files, walk_tree
 from darkwiki.interface import Interface
 from darkwiki.merge_engine import MergeInterface, MergeEngine
-from darkwiki.serialize import DeserialError, Deserializer, Serializer
+from darkwiki.path_index import PathIndex
+from darkwiki.reachability import Reachability
+from darkwiki.serialize import DeserialError, Deserializer, Layout, \
+                               Serializer
+
+# These pull in nacl, diff_match_patch, termcolor, zmq and asyncio,
+# so they are only imported the first time they are used.
+_lazy_names = {
+    'random_secret':    'darkwiki.crypto',
+    'secret_to_public': 'darkwiki.crypto',
+    'encrypt_sign':     'darkwiki.crypto',
+    'decrypt_verify':   'darkwiki.crypto',
+    'Session':          'darkwiki.crypto',
+    'difference':       'darkwiki.diff',
+    'three_way_merge':  'darkwiki.diff',
+    'print_diff':       'darkwiki.diff'
+}
+_lazy_modules = ('crypto', 'daemon', 'diff', 'gc', 'micronet', 'watcher')
+
+def __getattr__(name):
+    if name in _lazy_names:
+        module = importlib.import_module(_lazy_names[name])
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    if name in _lazy_modules:
+        return importlib.import_module('darkwiki.%s' % name)
+    raise AttributeError("module 'darkwiki' has no attribute %r" % name)
 
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_names) | set(_lazy_modules))
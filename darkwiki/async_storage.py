@@ -0,0 +1,101 @@
+import asyncio
+import concurrent.futures
+
+# Ciphertexts at least this large are decrypted off the event loop
+CRYPTO_OFFLOAD_SIZE = 16 * 1024
+
+class AsyncStorage:
+
+    def __init__(self, db, interface, max_workers=4):
+        self.db = db
+        self.interface = interface
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        # Callers beyond the limit wait on the loop rather than
+        # piling up in the executor queue
+        self._limit = asyncio.Semaphore(max_workers)
+        # Partial files are appended to by whichever channel
+        # happens to deliver the next chunk
+        self._partial_lock = asyncio.Lock()
+
+    async def run(self, function, *args):
+        async with self._limit:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, function, *args)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    # Database
+
+    async def exists(self, ident):
+        return await self.run(self.db.exists, ident)
+
+    async def fetch(self, ident):
+        return await self.run(self.db.fetch, ident)
+
+    async def object_type(self, ident):
+        return await self.run(self.db.object_type, ident)
+
+    async def object_size(self, ident):
+        return await self.run(self.db.object_size, ident)
+
+    async def read_object_range(self, ident, offset, size):
+        return await self.run(self.db.read_object_range, ident, offset, size)
+
+    async def add_object(self, object_, type_):
+        return await self.run(self.db.add_object, object_, type_)
+
+    async def write_remote_ref(self, remote_public_key, branch, commit_ident):
+        return await self.run(self.db.write_remote_ref, remote_public_key,
+                              branch, commit_ident)
+
+    async def fetch_remote_branches(self, remote):
+        return await self.run(self.db.fetch_remote_branches, remote)
+
+    async def branch_remote_last_commit_ident(self, remote, branch):
+        return await self.run(self.db.branch_remote_last_commit_ident,
+                              remote, branch)
+
+    async def partial_size(self, ident):
+        return await self.run(self.db.partial_size, ident)
+
+    async def partial_sizes(self, idents):
+        return await self.run(
+            lambda: [self.db.partial_size(ident) for ident in idents])
+
+    async def append_partial(self, ident, offset, data):
+        # Returns the new partial size, or None when the chunk
+        # is a duplicate or belongs to a stale transfer
+        async with self._partial_lock:
+            received_size = await self.partial_size(ident) or 0
+            if offset != received_size:
+                return None
+            await self.run(self.db.write_partial, ident, offset, data)
+            return received_size + len(data)
+
+    async def finish_partial(self, ident):
+        async with self._partial_lock:
+            if await self.exists(ident):
+                return True
+            return await self.run(self.db.finish_partial, ident)
+
+    # Interface
+
+    async def branches_tips(self):
+        return await self.run(self.interface.branches_tips)
+
+    async def resolve_missing_objects(self, ident):
+        return await self.run(self.interface.resolve_missing_objects, ident)
+
+    # Crypto
+
+    async def encrypt(self, session, message):
+        if len(message) < CRYPTO_OFFLOAD_SIZE:
+            return session.encrypt(message)
+        return await self.run(session.encrypt, message)
+
+    async def decrypt(self, session, ciphertext):
+        if len(ciphertext) < CRYPTO_OFFLOAD_SIZE:
+            return session.decrypt(ciphertext)
+        return await self.run(session.decrypt, ciphertext)
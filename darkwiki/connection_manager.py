@@ -0,0 +1,210 @@
+import asyncio
+import darkwiki
+import logging
+import random
+import time
+
+# Latency in seconds that costs as much score as one useful object
+LATENCY_WEIGHT = 10.0
+
+class PeerInfo:
+
+    def __init__(self, address, public_key):
+        self.address = address
+        self.public_key = public_key
+        self.node_id = darkwiki.micronet.public_to_node_id(public_key)
+
+        self.failures = 0
+        self.next_attempt = 0
+        # Smoothed round trip time of hello -> sync
+        self.latency = None
+        self.objects_received = 0
+
+    def record_latency(self, seconds):
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency = 0.8 * self.latency + 0.2 * seconds
+
+    def score(self):
+        # Peers that send us objects quickly are preferred, peers we
+        # know nothing about yet sit in the middle
+        score = float(self.objects_received)
+        if self.latency is not None:
+            score -= self.latency * LATENCY_WEIGHT
+        score -= self.failures
+        return score
+
+class ConnectionManager:
+
+    def __init__(self, node, target_outbound=8, target_inbound=8,
+                 base_backoff=1.0, max_backoff=300.0, rotate_interval=120.0,
+                 refresh_interval=60.0, tick=1.0):
+        self._node = node
+
+        self.target_outbound = target_outbound
+        self.target_inbound = target_inbound
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.rotate_interval = rotate_interval
+        self.refresh_interval = refresh_interval
+        self.tick = tick
+
+        # address -> PeerInfo
+        self._peers = {}
+        # address -> (channel, task)
+        self._connected = {}
+        # A peer only hears us once it subscribes to our publish
+        # socket, which it does when it opens a channel to us. These
+        # are the node ids currently subscribed.
+        self._subscribers = set()
+        # Addresses of channels we opened back to such peers
+        self._inbound = set()
+
+    @property
+    def peers(self):
+        return list(self._peers.values())
+
+    @property
+    def connected(self):
+        return [self._peers[address] for address in self._connected]
+
+    @property
+    def outbound(self):
+        return [self._peers[address] for address in self._connected
+                if address not in self._inbound]
+
+    def subscribed(self, node_id):
+        self._subscribers.add(node_id)
+        self.fill()
+
+    def unsubscribed(self, node_id):
+        self._subscribers.discard(node_id)
+        # The peer has gone, or it rotated us out
+        for address in list(self._inbound):
+            if self._peers[address].node_id == node_id:
+                self.disconnect(address)
+
+    def add_peers(self, connect_list):
+        for address, public_key in connect_list.items():
+            peer = self._peers.get(address)
+            if peer is None or peer.public_key != public_key:
+                self._peers[address] = PeerInfo(address, public_key)
+
+    async def run(self):
+        last_rotate = last_refresh = time.monotonic()
+        try:
+            while True:
+                self.fill()
+                await asyncio.sleep(self.tick)
+
+                now = time.monotonic()
+                if now - last_refresh >= self.refresh_interval:
+                    last_refresh = now
+                    await self._node.sync_seeds()
+                    self.add_peers(self._node.connect_list)
+                if now - last_rotate >= self.rotate_interval:
+                    last_rotate = now
+                    self.rotate()
+        finally:
+            for channel, task in list(self._connected.values()):
+                task.cancel()
+
+    def fill(self, now=None):
+        if now is None:
+            now = time.monotonic()
+
+        # Peers which opened a channel to us can only hear us back
+        # once we open one to them
+        for peer in self._peers.values():
+            if len(self._inbound) >= self.target_inbound:
+                break
+            if peer.node_id in self._subscribers and \
+                    peer.address not in self._connected:
+                self._inbound.add(peer.address)
+                self._connect(peer)
+
+        free_slots = self.target_outbound - len(self.outbound)
+        candidates = [peer for peer in self._peers.values()
+                      if peer.address not in self._connected and
+                      peer.next_attempt <= now]
+        candidates.sort(key=lambda peer: peer.score(), reverse=True)
+
+        for peer in candidates[:max(free_slots, 0)]:
+            self._connect(peer)
+
+        self._node.metrics.set_gauge('connected_peers', len(self._connected))
+        self._node.metrics.set_gauge('inbound_peers', len(self._inbound))
+        self._node.metrics.set_gauge('known_peers', len(self._peers))
+
+    def rotate(self, now=None):
+        # Swap the worst connected peer for someone new, so we
+        # keep exploring the network instead of settling forever
+        if now is None:
+            now = time.monotonic()
+
+        outbound = self.outbound
+        if len(outbound) < self.target_outbound:
+            return
+        idle = [peer for peer in self._peers.values()
+                if peer.address not in self._connected and
+                peer.next_attempt <= now]
+        if not idle:
+            return
+
+        # Inbound channels stay for as long as the peer wants them
+        worst = min(outbound, key=lambda peer: peer.score())
+        logging.info('rotating out peer %s', worst.address)
+        # Give the others a chance before reconnecting to it
+        worst.next_attempt = now + self.rotate_interval
+        self.disconnect(worst.address)
+
+    def disconnect(self, address):
+        if address not in self._connected:
+            return
+        channel, task = self._connected[address]
+        task.cancel()
+
+    def _connect(self, peer):
+        channel = self._node.create_channel(peer)
+        task = asyncio.ensure_future(channel.start())
+        self._connected[peer.address] = (channel, task)
+        task.add_done_callback(
+            lambda task: self._channel_finished(peer, channel, task))
+
+    def _channel_finished(self, peer, channel, task):
+        if self._connected.get(peer.address, (None, None))[1] is task:
+            del self._connected[peer.address]
+            self._inbound.discard(peer.address)
+        channel.close()
+
+        if task.cancelled():
+            return
+
+        error = task.exception()
+        if error is None:
+            # The channel ended without an error, nothing to hold
+            # against the peer. fill() connects again on its next tick.
+            logging.info('channel %s closed', peer.address)
+            self._node.metrics.increment('channel_closed', peer=peer.address)
+            return
+        if isinstance(error, asyncio.TimeoutError) and \
+                peer.node_id not in self._subscribers:
+            # It never opened a channel to us, so it could not hear
+            # our hellos. That is not the peer's fault, just try it
+            # again later.
+            logging.info('peer %s did not connect back', peer.address)
+            self._node.metrics.increment('channel_unanswered',
+                                         peer=peer.address)
+            peer.next_attempt = time.monotonic() + self.rotate_interval
+            return
+
+        logging.warning('channel %s failed: %r', peer.address, error)
+        self._node.metrics.increment('channel_failures', peer=peer.address)
+
+        peer.failures += 1
+        backoff = min(self.max_backoff,
+                      self.base_backoff * 2 ** (peer.failures - 1))
+        # Jitter so that peers which failed together don't all
+        # come back at the same moment
+        peer.next_attempt = time.monotonic() + backoff * random.uniform(1, 1.5)
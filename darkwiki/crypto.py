@@ -9,20 +9,51 @@ def secret_to_public(secret):
     private = PrivateKey(secret)
     return bytes(private.public_key)
 
+class Session:
+
+    def __init__(self, secret, public_peer):
+        # Box precomputes the shared key, so the Curve25519
+        # scalar multiplication only happens once per peer
+        self._box = Box(PrivateKey(secret), PublicKey(public_peer))
+
+    def encrypt(self, message):
+        return self._box.encrypt(message)
+
+    def decrypt(self, cipher):
+        try:
+            return self._box.decrypt(cipher)
+        except nacl.exceptions.CryptoError:
+            return None
+
 def encrypt_sign(message, secret_origin, public_destination):
-    public = PublicKey(public_destination)
-    private = PrivateKey(secret_origin)
-    box = Box(private, public)
-    return box.encrypt(message)
+    return Session(secret_origin, public_destination).encrypt(message)
 
 def decrypt_verify(cipher, public_origin, private_destination):
-    public = PublicKey(public_origin)
-    private = PrivateKey(private_destination)
-    box = Box(private, public)
-    try:
-        return box.decrypt(cipher)
-    except nacl.exceptions.CryptoError:
-        return None
+    return Session(private_destination, public_origin).decrypt(cipher)
+
+def _benchmark(message, count=5000):
+    import time
+
+    secret, peer_secret = random_secret(), random_secret()
+    public = secret_to_public(secret)
+    peer_public = secret_to_public(peer_secret)
+
+    start = time.perf_counter()
+    for _ in range(count):
+        cipher = encrypt_sign(message, secret, peer_public)
+        decrypt_verify(cipher, public, peer_secret)
+    per_message = count / (time.perf_counter() - start)
+
+    session = Session(secret, peer_public)
+    peer_session = Session(peer_secret, public)
+    start = time.perf_counter()
+    for _ in range(count):
+        cipher = session.encrypt(message)
+        peer_session.decrypt(cipher)
+    per_session = count / (time.perf_counter() - start)
+
+    print('%6d byte messages: %8.0f msg/s per-message keys, '
+          '%8.0f msg/s session' % (len(message), per_message, per_session))
 
 if __name__ == '__main__':
     secret = random_secret()
@@ -35,3 +66,10 @@ if __name__ == '__main__':
     assert type(message_2) == bytes
     assert message == message_2
 
+    session = Session(secret, public)
+    assert session.decrypt(cipher) == message
+    assert session.decrypt(cipher[:-1]) is None
+
+    # Round trips (encrypt + decrypt) per second
+    for size in (64, 1024, 32 * 1024):
+        _benchmark(b'x' * size)
@@ -0,0 +1,157 @@
+import contextlib
+import io
+import json
+import os
+import socket
+import struct
+import sys
+import traceback
+
+SOCKET_NAME = 'daemon.sock'
+# Parsed objects the daemon keeps in memory
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+_length = struct.Struct('!I')
+
+def socket_path(dot_path):
+    return os.path.join(dot_path, SOCKET_NAME)
+
+def find_socket_path(path=None):
+    # Same search as find_root_path(), but gives up at / instead
+    # of failing, since most commands run without a daemon
+    if path is None:
+        path = os.getcwd()
+    while True:
+        dot_path = os.path.join(path, '.darkwiki')
+        if os.path.isdir(dot_path):
+            # A wiki nested in another must not use the outer daemon
+            candidate = socket_path(dot_path)
+            if os.path.exists(candidate):
+                return candidate
+            return None
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+def _receive_exactly(connection, size):
+    data = bytearray()
+    while len(data) < size:
+        block = connection.recv(size - len(data))
+        if not block:
+            raise ConnectionError('daemon connection closed')
+        data += block
+    return bytes(data)
+
+def send_message(connection, message):
+    data = json.dumps(message).encode()
+    connection.sendall(_length.pack(len(data)) + data)
+
+def receive_message(connection):
+    size, = _length.unpack(_receive_exactly(connection, _length.size))
+    return json.loads(_receive_exactly(connection, size).decode())
+
+def run_client(argv, path=None):
+    # Returns the exit code of the command run by the daemon,
+    # or None when there is no daemon to run it
+    path = find_socket_path(path)
+    if path is None:
+        return None
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            connection.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # Left behind by a daemon which did not exit cleanly
+            return None
+        send_message(connection, {
+            'argv': argv,
+            'cwd': os.getcwd(),
+            'color': os.isatty(1)
+        })
+        reply = receive_message(connection)
+    finally:
+        connection.close()
+
+    sys.stdout.write(reply['stdout'])
+    sys.stderr.write(reply['stderr'])
+    return reply['code']
+
+class Daemon:
+
+    # Runs commands for CLI clients one at a time, sharing a single
+    # database so its caches stay warm between commands.
+
+    def __init__(self, db, handler):
+        self.db = db
+        # handler(argv) -> exit code
+        self._handler = handler
+
+    @property
+    def path(self):
+        return socket_path(self.db.dot_path)
+
+    def serve_forever(self):
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        listener.bind(self.path)
+        listener.listen()
+
+        try:
+            while True:
+                connection, _ = listener.accept()
+                with connection:
+                    self._serve(connection)
+        finally:
+            listener.close()
+            os.remove(self.path)
+
+    def _serve(self, connection):
+        try:
+            request = receive_message(connection)
+        except (ConnectionError, ValueError):
+            return
+
+        code, stdout, stderr = self.run(request['argv'], request['cwd'],
+                                        request.get('color', False))
+        try:
+            send_message(connection, {
+                'code': code,
+                'stdout': stdout,
+                'stderr': stderr
+            })
+        except OSError:
+            # Client went away
+            pass
+
+    def run(self, argv, cwd, color=False):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        previous_cwd = os.getcwd()
+        # termcolor looks at these, our stdout is never a tty
+        color_variable = 'FORCE_COLOR' if color else 'NO_COLOR'
+        previous_color = os.environ.get(color_variable)
+        os.environ[color_variable] = '1'
+        try:
+            os.chdir(cwd)
+            with contextlib.redirect_stdout(stdout), \
+                 contextlib.redirect_stderr(stderr):
+                code = self._handler(argv)
+        except SystemExit as error:
+            # argparse exits on bad arguments and --help
+            code = error.code
+        except Exception:
+            stderr.write(traceback.format_exc())
+            code = 1
+        finally:
+            if previous_color is None:
+                del os.environ[color_variable]
+            else:
+                os.environ[color_variable] = previous_color
+            os.chdir(previous_cwd)
+        if code is None:
+            code = 0
+        return code, stdout.getvalue(), stderr.getvalue()
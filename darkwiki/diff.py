@@ -1,5 +1,6 @@
 import diff_match_patch as dmp_module
 from termcolor import colored
+from darkwiki.timing import timed
 
 dmp = dmp_module.diff_match_patch()
 
@@ -74,6 +75,7 @@ def print_diff(diffs):
             text = colored(diff, 'green')
         print(text, end='')
 
+@timed
 def three_way_merge(base_text_1, text_2, text_3):
     diffs_2 = dmp.diff_main(base_text_1, text_2)
     diffs_3 = dmp.diff_main(base_text_1, text_3)
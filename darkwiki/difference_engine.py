@@ -1,5 +1,6 @@
 import darkwiki
 import os
+from darkwiki.timing import timed
 
 def filter_one(vector, predicate):
     match = [x for x in vector if predicate(x)]
@@ -9,18 +10,21 @@ def filter_one(vector, predicate):
 
 class DifferenceInterfaceDisk:
 
-    def __init__(self, db):
+    def __init__(self, db, dirty_paths=None):
         self._db = db
+        # Paths which may differ from the index, None means all of them
+        self._dirty_paths = dirty_paths
         self._ident_map = {}
         self._files = self._files_list()
 
     def _files_list(self):
         # Use filenames from index as list of files
-        filenames = [filename for _, _, filename in self._db.read_index()]
-
         files = []
-        for filename in filenames:
-            ident = self._db.hash_file(filename)
+        for _, index_ident, filename in self._db.read_index():
+            if self._dirty_paths is None or filename in self._dirty_paths:
+                ident = self._db.hash_file(filename)
+            else:
+                ident = index_ident
             files.append(('644', ident, filename))
 
             self._ident_map[ident] = filename
@@ -89,6 +93,7 @@ class DifferenceEngine:
         self._interface_1 = interface_1
         self._interface_2 = interface_2
 
+    @timed
     def results(self):
         results = []
 
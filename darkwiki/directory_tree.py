@@ -1,5 +1,6 @@
 import darkwiki
 import os
+from darkwiki.timing import timed
 
 class DirectoryTree:
 
@@ -99,6 +100,7 @@ def build_tree(index):
         subdir.add_file(mode, ident, filename)
     return root
 
+@timed
 def read_tree(db, tree_ident, tree_name=None):
     object_type, tree_contents = db.fetch(tree_ident)
     assert object_type == darkwiki.DataType.TREE
@@ -1,8 +1,12 @@
+import collections
 import darkwiki
+import fnmatch
 import hashlib
 import json
 import os
+import threading
 import time
+from darkwiki.timing import timed
 from enum import Enum
 
 def move_up(path):
@@ -22,6 +26,28 @@ def touch_file(filename):
 def remove_if(vector, predicate):
     return [x for x in vector if not predicate(x)]
 
+def is_ignored(filename, name, is_dir, patterns):
+    # Patterns match either the name or the path from the root.
+    # A leading / only matches the path, a trailing / only directories.
+    for pattern in patterns:
+        if pattern.endswith('/'):
+            if not is_dir:
+                continue
+            pattern = pattern[:-1]
+        if pattern.startswith('/'):
+            if fnmatch.fnmatchcase(filename, pattern[1:]):
+                return True
+        elif fnmatch.fnmatchcase(name, pattern) or \
+             fnmatch.fnmatchcase(filename, pattern):
+            return True
+    return False
+
+# Block size used when streaming large objects through hashlib
+COPY_BLOCK_SIZE = 64 * 1024
+
+# Patterns for untracked files to leave out of status, one per line
+IGNORE_FILENAME = '.darkwikiignore'
+
 class DataType(Enum):
     BLOB   = 1
     TREE   = 2
@@ -29,8 +55,21 @@ class DataType(Enum):
 
 class DiskDatabase:
 
-    def __init__(self):
-        self._root_path = find_root_path()
+    def __init__(self, root_path=None, object_cache_bytes=0):
+        if root_path is None:
+            root_path = find_root_path()
+        self._root_path = os.path.abspath(root_path)
+
+        # Parsed objects kept in memory by long running processes.
+        # Objects never change once written, so only gc needs to
+        # evict them. ident -> (data_type, data, size)
+        self.object_cache_bytes = object_cache_bytes
+        self._object_cache = collections.OrderedDict()
+        self._object_cache_size = 0
+        # (mtime, size) of the index file -> parsed index
+        self._index_cache = None
+        self._path_index = None
+        self._reachability = None
 
     @property
     def dot_path(self):
@@ -44,6 +83,23 @@ class DiskDatabase:
     @property
     def _index_filename(self):
         return os.path.join(self.dot_path, 'index')
+    @property
+    def _incoming_path(self):
+        return os.path.join(self.dot_path, 'incoming')
+
+    @property
+    def path_index(self):
+        # Loaded on first use and kept, later loads only read what
+        # was appended since
+        if self._path_index is None:
+            self._path_index = darkwiki.PathIndex(self)
+        return self._path_index
+
+    @property
+    def reachability(self):
+        if self._reachability is None:
+            self._reachability = darkwiki.Reachability(self)
+        return self._reachability
 
     def _ref_path(self, ref):
         return os.path.join(self.dot_path, ref)
@@ -54,6 +110,9 @@ class DiskDatabase:
     def _open_object(self, ident, flag):
         return open(self._object_path(ident), flag + 'b')
 
+    def _partial_path(self, ident):
+        return os.path.join(self._incoming_path, ident)
+
     def exists(self, ident):
         return os.path.isfile(self._object_path(ident))
 
@@ -66,6 +125,35 @@ class DiskDatabase:
     def remove_file(self, filename):
         os.remove(self.transform_root_path(filename))
 
+    def read_ignore_patterns(self):
+        filename = self.transform_root_path(IGNORE_FILENAME)
+        try:
+            with open(filename) as file_handle:
+                lines = [line.strip() for line in file_handle]
+        except FileNotFoundError:
+            return []
+        return [line for line in lines if line and not line.startswith('#')]
+
+    def walk_files(self, ignore_patterns=()):
+        # Yields filenames relative to the root, without entering
+        # .darkwiki or any ignored directory
+        pending = ['']
+        while pending:
+            directory = pending.pop()
+            with os.scandir(self.transform_root_path(directory)) as entries:
+                for entry in entries:
+                    filename = os.path.join(directory, entry.name)
+                    if filename == '.darkwiki':
+                        continue
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if is_ignored(filename, entry.name, is_dir,
+                                  ignore_patterns):
+                        continue
+                    if is_dir:
+                        pending.append(filename)
+                    else:
+                        yield filename
+
     def transform_relative_path(self, filename):
         filename = os.path.abspath(filename)
         return os.path.relpath(filename, self._root_path)
@@ -79,15 +167,26 @@ class DiskDatabase:
 
     def _add_data(self, data, data_type):
         ident = hashlib.sha256(data).hexdigest()
-        with self._open_object(ident, 'w') as file_handle:
+        # Written aside and moved into place, so exists() never sees
+        # half an object. The name is unique to this thread since the
+        # same object can be added by several at once.
+        try:
+            os.makedirs(self._incoming_path)
+        except FileExistsError:
+            pass
+        tmp_path = '%s.%d.%d.object' % (self._partial_path(ident),
+                                        os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as file_handle:
             header = '%s:' % data_type.name
             file_handle.write(header.encode())
             file_handle.write(data)
+        os.replace(tmp_path, self._object_path(ident))
         return ident
 
     def add_blob(self, data):
         return self._add_data(data, DataType.BLOB)
 
+    @timed
     def hash_file(self, filename):
         data = self.open_file(filename, 'r').read()
         ident = hashlib.sha256(data).hexdigest()
@@ -124,17 +223,118 @@ class DiskDatabase:
 
         return self._add_data(data, type_)
 
+    @timed
     def fetch(self, ident):
+        if ident in self._object_cache:
+            self._object_cache.move_to_end(ident)
+            data_type, data, _ = self._object_cache[ident]
+            return data_type, self._copy_object(data_type, data)
+
         data = self._open_object(ident, 'r').read()
         header = data.split(b':')[0]
         data_type = DataType[header.decode()]
+        size = len(data)
         data = data[len(header) + 1:]
         if data_type == DataType.TREE:
             data = self._deserialize_tree(data)
         elif data_type == DataType.COMMIT:
             data = self._deserialize_commit(data)
+
+        if size <= self.object_cache_bytes:
+            self._cache_object(ident, data_type, data, size)
+            data = self._copy_object(data_type, data)
         return data_type, data
 
+    def _copy_object(self, data_type, data):
+        # Callers are free to modify commits and trees they fetch
+        if data_type == DataType.TREE:
+            return list(data)
+        elif data_type == DataType.COMMIT:
+            return dict(data)
+        return data
+
+    def _cache_object(self, ident, data_type, data, size):
+        self._object_cache[ident] = (data_type, data, size)
+        self._object_cache_size += size
+        while self._object_cache_size > self.object_cache_bytes:
+            _, (_, _, evicted_size) = self._object_cache.popitem(last=False)
+            self._object_cache_size -= evicted_size
+
+    def forget_object(self, ident):
+        if ident in self._object_cache:
+            _, _, size = self._object_cache.pop(ident)
+            self._object_cache_size -= size
+
+    def remove_object(self, ident):
+        os.remove(self._object_path(ident))
+        self.forget_object(ident)
+
+    def _read_header(self, file_handle):
+        # Longest header is 'COMMIT:'
+        prefix = file_handle.read(len('COMMIT:'))
+        header = prefix.split(b':')[0]
+        file_handle.seek(len(header) + 1)
+        return DataType[header.decode()]
+
+    def object_size(self, ident):
+        with self._open_object(ident, 'r') as file_handle:
+            self._read_header(file_handle)
+            header_size = file_handle.tell()
+        return os.path.getsize(self._object_path(ident)) - header_size
+
+    def read_object_range(self, ident, offset, size):
+        with self._open_object(ident, 'r') as file_handle:
+            self._read_header(file_handle)
+            file_handle.seek(offset, os.SEEK_CUR)
+            return file_handle.read(size)
+
+    def partial_size(self, ident):
+        try:
+            return os.path.getsize(self._partial_path(ident))
+        except FileNotFoundError:
+            return None
+
+    def write_partial(self, ident, offset, data):
+        try:
+            os.makedirs(self._incoming_path)
+        except FileExistsError:
+            pass
+
+        # Chunks are only ever appended in order
+        assert offset == (self.partial_size(ident) or 0)
+        with open(self._partial_path(ident), 'ab') as file_handle:
+            file_handle.write(data)
+
+    def remove_partial(self, ident):
+        try:
+            os.remove(self._partial_path(ident))
+        except FileNotFoundError:
+            pass
+
+    def finish_partial(self, ident):
+        partial_path = self._partial_path(ident)
+
+        hasher = hashlib.sha256()
+        with open(partial_path, 'rb') as file_handle:
+            for block in iter(lambda: file_handle.read(COPY_BLOCK_SIZE), b''):
+                hasher.update(block)
+
+        if hasher.hexdigest() != ident:
+            self.remove_partial(ident)
+            return False
+
+        # Write the object beside the partial, then move it into place
+        object_tmp_path = partial_path + '.object'
+        with open(object_tmp_path, 'wb') as object_handle, \
+             open(partial_path, 'rb') as file_handle:
+            object_handle.write(b'BLOB:')
+            for block in iter(lambda: file_handle.read(COPY_BLOCK_SIZE), b''):
+                object_handle.write(block)
+        os.replace(object_tmp_path, self._object_path(ident))
+
+        self.remove_partial(ident)
+        return True
+
     def _deserialize_tree(self, data):
         # Remove trailing newline
         data = data[:-1]
@@ -152,7 +352,8 @@ class DiskDatabase:
         return json.loads(data.decode())
 
     def object_type(self, ident):
-        return self.fetch(ident)[0]
+        with self._open_object(ident, 'r') as file_handle:
+            return self._read_header(file_handle)
 
     def update_index(self, mode, ident, filename):
         index = self.read_index()
@@ -171,14 +372,32 @@ class DiskDatabase:
         with open(self._index_filename, 'w') as file_handle:
             for mode, ident, filename in index:
                 file_handle.write('%s %s %s\n' % (mode, ident, filename))
+        self._index_cache = None
 
     def clear_index(self):
         open(self._index_filename, 'w').truncate(0)
+        self._index_cache = None
+
+    def _index_stat(self):
+        stat = os.stat(self._index_filename)
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
 
     def read_index(self):
+        # Only processes with an object cache keep the index around,
+        # and other processes writing the index change its stat
+        if self.object_cache_bytes:
+            index_stat = self._index_stat()
+            if self._index_cache is not None and \
+               self._index_cache[0] == index_stat:
+                return list(self._index_cache[1])
+
         index = []
         for line in open(self._index_filename, 'r'):
             index.append(self._read_index_line(line))
+
+        if self.object_cache_bytes:
+            self._index_cache = (index_stat, index)
+            return list(index)
         return index
 
     def _read_index_line(self, line):
@@ -192,6 +411,7 @@ class DiskDatabase:
         root = darkwiki.build_tree(index)
         return self.write_dirtree(root)
 
+    @timed
     def write_dirtree(self, root):
         for directory in darkwiki.walk_tree(root):
             assert not [subdir for subdir in directory.subdirs
@@ -310,9 +530,23 @@ class DiskDatabase:
 
     def fetch_remote_branches(self, remote):
         remote_path = os.path.join(self._ref_path('refs/remotes/'), remote)
-        remote_branches = os.listdir(remote_path)
+        try:
+            remote_branches = os.listdir(remote_path)
+        except FileNotFoundError:
+            # Remote has not announced any branches yet
+            return []
         return remote_branches
 
+    def all_ref_commit_idents(self):
+        # Tips of every local and remote branch
+        commit_idents = [self.branch_last_commit_ident(branch)
+                         for branch in self.fetch_local_branches()]
+        for remote in self.fetch_remotes():
+            commit_idents += [
+                self.branch_remote_last_commit_ident(remote, branch)
+                for branch in self.fetch_remote_branches(remote)]
+        return [ident for ident in commit_idents if ident is not None]
+
     def active_branch(self):
         reference = self._get_current_ref()
         assert reference.startswith('refs/heads/')
@@ -375,7 +609,7 @@ class DiskDatabase:
     def _write_file(self, blob, contents):
         try:
             if blob.dirname is not None:
-                os.makedirs(blob.dirname)
+                os.makedirs(self.transform_root_path(blob.dirname))
         except FileExistsError:
             pass
         self.open_file(blob.full_filename, 'w').write(contents)
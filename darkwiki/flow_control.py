@@ -0,0 +1,130 @@
+import collections
+import time
+
+class FetchWindow:
+
+    # Limits how many fetches we have outstanding with a peer.
+    # Fetches beyond the window wait in a queue, and fetches
+    # that go unanswered are handed back for retransmission.
+
+    def __init__(self, max_in_flight=32, timeout=5.0, max_retries=5):
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+        self._queue = collections.deque()
+        self._queued = set()
+        # ident -> (send time, retries)
+        self._in_flight = {}
+
+    def __len__(self):
+        return len(self._queue) + len(self._in_flight)
+
+    @property
+    def in_flight(self):
+        return len(self._in_flight)
+
+    def queue(self, ident):
+        if ident in self._queued or ident in self._in_flight:
+            return
+        self._queue.append(ident)
+        self._queued.add(ident)
+
+    def ready(self, now=None):
+        if now is None:
+            now = time.monotonic()
+
+        idents = []
+        while self._queue and len(self._in_flight) < self.max_in_flight:
+            ident = self._queue.popleft()
+            self._queued.remove(ident)
+            self._in_flight[ident] = (now, 0)
+            idents.append(ident)
+        return idents
+
+    def touch(self, ident, now=None):
+        # Progress was made (e.g. a chunk arrived) so restart the timer
+        if ident not in self._in_flight:
+            return
+        if now is None:
+            now = time.monotonic()
+        self._in_flight[ident] = (now, 0)
+
+    def complete(self, ident):
+        self._in_flight.pop(ident, None)
+
+    def expired(self, now=None):
+        if now is None:
+            now = time.monotonic()
+
+        idents = []
+        for ident, (sent_time, retries) in list(self._in_flight.items()):
+            if now - sent_time < self.timeout:
+                continue
+            if retries >= self.max_retries:
+                # Give up, the object will be requested again
+                # the next time the remote tips are resolved
+                del self._in_flight[ident]
+                continue
+            self._in_flight[ident] = (now, retries + 1)
+            idents.append(ident)
+        return idents
+
+class SendWindow:
+
+    # Byte and message credit for replies sent to a peer.
+    # Credit is returned when the peer acks a reply, or when
+    # the ack is overdue and we assume it was lost.
+
+    def __init__(self, max_bytes=1024 * 1024, max_messages=64, timeout=5.0):
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.timeout = timeout
+
+        self.unacked_bytes = 0
+        # key -> (size, send time)
+        self._unacked = collections.OrderedDict()
+        self._pending = collections.deque()
+
+    def has_credit(self, size):
+        if not self._unacked:
+            # Always let one reply through, however large
+            return True
+        return (len(self._unacked) < self.max_messages and
+                self.unacked_bytes + size <= self.max_bytes)
+
+    def sent(self, key, size, now=None):
+        if now is None:
+            now = time.monotonic()
+        self.acked(key)
+        self._unacked[key] = (size, now)
+        self.unacked_bytes += size
+
+    def acked(self, key):
+        if key not in self._unacked:
+            return
+        size, _ = self._unacked.pop(key)
+        self.unacked_bytes -= size
+
+    def expire(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        for key, (size, sent_time) in list(self._unacked.items()):
+            if now - sent_time >= self.timeout:
+                self.acked(key)
+
+    def defer(self, reply, size):
+        self._pending.append((reply, size))
+
+    def pending(self):
+        return len(self._pending)
+
+    def next_ready(self):
+        # Next deferred reply, if we have the credit to send it now
+        if not self._pending:
+            return None
+        reply, size = self._pending[0]
+        if not self.has_credit(size):
+            return None
+        self._pending.popleft()
+        return reply
@@ -0,0 +1,105 @@
+import darkwiki
+import os
+import time
+
+# Unreachable objects younger than this are kept, they may belong to
+# a commit or a sync which is still in progress
+DEFAULT_GRACE_PERIOD = 14 * 24 * 3600
+
+class Collection:
+
+    def __init__(self):
+        self.live = 0
+        self.pruned = []
+        self.pruned_bytes = 0
+        self.kept = 0
+        self.partials = []
+        self.partial_bytes = 0
+
+def reachable_objects(db):
+    # Everything reachable from a local or remote branch, and the
+    # blobs in the index. Missing objects are skipped, a remote
+    # history may still be arriving.
+    reachability = db.reachability
+    reachability.refresh()
+
+    live = set()
+    pending = db.all_ref_commit_idents()
+    pending += [ident for _, ident, _ in db.read_index()]
+    while pending:
+        ident = pending.pop()
+        if ident is None or ident in live:
+            continue
+        covered = reachability.commit_objects(ident)
+        if covered is not None:
+            live.update(covered)
+            continue
+        live.add(ident)
+        if not db.exists(ident):
+            continue
+
+        type_ = db.object_type(ident)
+        if type_ == darkwiki.DataType.TREE:
+            _, tree = db.fetch(ident)
+            pending.extend(row[2] for row in tree)
+        elif type_ == darkwiki.DataType.COMMIT:
+            _, commit = db.fetch(ident)
+            pending.append(commit['tree'])
+            pending.append(commit['previous_commit'])
+    return live
+
+def _older_than(path, cutoff):
+    try:
+        return os.path.getmtime(path) < cutoff
+    except FileNotFoundError:
+        return False
+
+def collect(db, grace_period=DEFAULT_GRACE_PERIOD, dry_run=False):
+    result = Collection()
+    cutoff = time.time() - grace_period
+
+    live = reachable_objects(db)
+    for ident in db.list():
+        if ident in live:
+            result.live += 1
+            continue
+        path = db._object_path(ident)
+        if not _older_than(path, cutoff):
+            result.kept += 1
+            continue
+        result.pruned.append(ident)
+        result.pruned_bytes += os.path.getsize(path)
+
+    # Abandoned chunked transfers, and temporary files left
+    # behind by an interrupted finish_partial() or _add_data()
+    try:
+        filenames = os.listdir(db._incoming_path)
+    except FileNotFoundError:
+        filenames = []
+    for filename in filenames:
+        path = os.path.join(db._incoming_path, filename)
+        if _older_than(path, cutoff):
+            result.partials.append(filename)
+            result.partial_bytes += os.path.getsize(path)
+
+    if dry_run:
+        return result
+
+    for ident in result.pruned:
+        db.remove_object(ident)
+    for filename in result.partials:
+        try:
+            os.remove(os.path.join(db._incoming_path, filename))
+        except FileNotFoundError:
+            pass
+
+    # Bitmap positions of pruned objects would only be wasted bits,
+    # so give out positions again for the objects that are left.
+    # Nobody else may write bitmaps against either order meanwhile.
+    interface = darkwiki.Interface(db)
+    with db.reachability.locked():
+        db.reachability.clear()
+        for commit_ident in db.all_ref_commit_idents():
+            interface.resolve_missing_objects(commit_ident)
+
+    return result
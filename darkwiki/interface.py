@@ -1,4 +1,5 @@
 import darkwiki
+import os
 from darkwiki.difference_engine import *
 
 class Interface:
@@ -13,13 +14,31 @@ class Interface:
         current_commit_ident = commit['previous_commit']
         return current_commit_ident, commit
 
-    def fetch_commits(self):
-        results = []
-        commit_ident = self._db.last_commit_ident()
-        while commit_ident is not None:
+    def iter_commits(self, commit_ident=None, stop_ident=None):
+        # Newest first, and lazily so callers which stop early
+        # only read the commits they used
+        if commit_ident is None:
+            commit_ident = self._db.last_commit_ident()
+        while commit_ident != stop_ident:
+            if commit_ident is None:
+                raise ValueError('%s is not an ancestor' % stop_ident)
             commit_ident, commit = self.fetch_commit(commit_ident)
-            results.append(commit)
-        return results
+            yield commit
+
+    def fetch_commits(self):
+        return list(self.iter_commits())
+
+    def iter_path_commits(self, paths, commit_ident=None, stop_ident=None):
+        # Like iter_commits but only commits which changed paths,
+        # found through the path index so no trees are read
+        if commit_ident is None:
+            commit_ident = self._db.last_commit_ident()
+        if commit_ident is None:
+            return
+        path_index = self._db.path_index
+        for ident in path_index.walk(commit_ident, paths, stop_ident):
+            _, commit = self.fetch_commit(ident)
+            yield commit
 
     def diff_cached(self, commit_ident):
         interface_commit = DifferenceInterfaceCommit(self._db, commit_ident)
@@ -29,21 +48,25 @@ class Interface:
 
         return differentiator.results()
 
-    def diff_noncached(self, commit_ident):
+    def diff_noncached(self, commit_ident, dirty_paths=None):
         if commit_ident is not None:
             interface_previous = \
                 DifferenceInterfaceCommit(self._db, commit_ident)
         else:
             interface_previous = DifferenceInterfaceIndex(self._db)
 
-        interface_disk = DifferenceInterfaceDisk(self._db)
+        interface_disk = DifferenceInterfaceDisk(self._db, dirty_paths)
 
         differentiator = DifferenceEngine(interface_previous, interface_disk)
         return differentiator.results()
 
-    def add_changed_files(self):
+    def add_changed_files(self, dirty_paths=None):
         # Loop through files in index
         for mode, ident, filename in self._db.read_index():
+            # Files the watcher saw no change to match the index
+            if dirty_paths is not None and filename not in dirty_paths:
+                continue
+
             file_ident = self._db.hash_file(filename)
 
             # Skip unchanged files
@@ -53,6 +76,62 @@ class Interface:
             # Add changed file
             self._db.add_file(filename)
 
+    def status(self, dirty_paths=None):
+        # Compares idents only, blob objects are never read.
+        # Returns (staged, unstaged, untracked), where the first two
+        # are lists of (change, filename).
+        head_files = self._head_files()
+        index = dict((filename, ident)
+                     for _, ident, filename in self._db.read_index())
+
+        staged = []
+        for filename in sorted(set(head_files) | set(index)):
+            if filename not in head_files:
+                staged.append(('new file', filename))
+            elif filename not in index:
+                staged.append(('deleted', filename))
+            elif head_files[filename] != index[filename]:
+                staged.append(('modified', filename))
+
+        unstaged = []
+        for filename, ident in sorted(index.items()):
+            if dirty_paths is not None and filename not in dirty_paths:
+                continue
+            try:
+                file_ident = self._db.hash_file(filename)
+            except OSError:
+                unstaged.append(('deleted', filename))
+                continue
+            if file_ident != ident:
+                unstaged.append(('modified', filename))
+
+        ignore_patterns = self._db.read_ignore_patterns()
+        untracked = sorted(filename for filename
+                           in self._db.walk_files(ignore_patterns)
+                           if filename not in index)
+
+        return staged, unstaged, untracked
+
+    def _head_files(self):
+        # filename -> ident for every file in the last commit
+        commit_ident = self._db.last_commit_ident()
+        if commit_ident is None:
+            return {}
+        _, commit = self._db.fetch(commit_ident)
+
+        files = {}
+        pending = [(commit['tree'], '')]
+        while pending:
+            tree_ident, directory = pending.pop()
+            _, tree = self._db.fetch(tree_ident)
+            for mode, type_, ident, filename in tree:
+                filename = os.path.join(directory, filename)
+                if type_ == darkwiki.DataType.TREE:
+                    pending.append((ident, filename))
+                else:
+                    files[filename] = ident
+        return files
+
     def branches_tips(self):
         branches = self._db.fetch_local_branches()
         tips = {}
@@ -62,25 +141,45 @@ class Interface:
         return tips
 
     def resolve_missing_objects(self, ident):
-        missing = []
+        # Objects reachable from ident which we do not have yet.
+        # Anything in a reachability bitmap is known to be complete
+        # and is not walked again.
+        reachability = self._db.reachability
+        reachability.refresh()
 
-        if not self._db.exists(ident):
-            return [ident]
+        missing = []
+        visited = set()
+        pending = [(ident, None)]
+        while pending:
+            object_ident, type_ = pending.pop()
+            if object_ident in visited or \
+                    reachability.is_complete(object_ident):
+                continue
+            visited.add(object_ident)
 
-        type_, object_ = self._db.fetch(ident)
-        if type_ == darkwiki.DataType.BLOB:
-            return []
-        elif type_ == darkwiki.DataType.TREE:
-            for mode, type_, ident, filename in object_:
-                assert type_ != darkwiki.DataType.COMMIT
-                missing += self.resolve_missing_objects(ident)
-        else:
-            previous_commit_ident = object_['previous_commit']
-            if previous_commit_ident is not None:
-                missing += self.resolve_missing_objects(previous_commit_ident)
+            if not self._db.exists(object_ident):
+                missing.append(object_ident)
+                continue
+            # Blobs have nothing below them, no need to read them
+            if type_ == darkwiki.DataType.BLOB:
+                continue
 
-            tree_root_ident = object_['tree']
-            missing += self.resolve_missing_objects(tree_root_ident)
+            type_, object_ = self._db.fetch(object_ident)
+            if type_ == darkwiki.DataType.TREE:
+                for mode, subtype, subident, filename in reversed(object_):
+                    assert subtype != darkwiki.DataType.COMMIT
+                    pending.append((subident, subtype))
+            elif type_ == darkwiki.DataType.COMMIT:
+                pending.append((object_['tree'], darkwiki.DataType.TREE))
+                previous_commit_ident = object_['previous_commit']
+                if previous_commit_ident is not None:
+                    pending.append((previous_commit_ident,
+                                    darkwiki.DataType.COMMIT))
+
+        # The whole history is here, remember that for next time
+        if not missing and self._db.object_type(ident) == \
+                darkwiki.DataType.COMMIT:
+            reachability.update(ident)
 
         return missing
 
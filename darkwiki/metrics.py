@@ -0,0 +1,130 @@
+import asyncio
+import bisect
+import collections
+import json
+import logging
+import os
+import time
+
+# Upper bounds of the histogram buckets, in seconds for latencies.
+# Values above the last bound land in an overflow bucket.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, fraction):
+        # Upper bound of the bucket holding the quantile
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([str(bound) for bound in self.buckets] +
+                                ['inf'], self.counts))
+        }
+
+class Metrics:
+
+    # Counters, gauges and histograms for a node. Anything recorded
+    # against a peer also adds to the node wide totals.
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.counters = collections.Counter()
+        self.gauges = {}
+        self.histograms = {}
+        # peer -> Metrics for that peer alone
+        self.peers = {}
+
+    def peer(self, peer):
+        if peer not in self.peers:
+            self.peers[peer] = Metrics()
+        return self.peers[peer]
+
+    def increment(self, name, value=1, peer=None):
+        self.counters[name] += value
+        if peer is not None:
+            self.peer(peer).counters[name] += value
+
+    def set_gauge(self, name, value, peer=None):
+        if peer is None:
+            self.gauges[name] = value
+        else:
+            self.peer(peer).gauges[name] = value
+
+    def observe(self, name, value, peer=None):
+        self._histogram(name).observe(value)
+        if peer is not None:
+            self.peer(peer)._histogram(name).observe(value)
+
+    def _histogram(self, name):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram()
+        return self.histograms[name]
+
+    def to_dict(self):
+        result = {
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'histograms': dict((name, histogram.to_dict())
+                               for name, histogram in self.histograms.items())
+        }
+        if self.peers:
+            result['peers'] = dict((peer, metrics.to_dict())
+                                   for peer, metrics in self.peers.items())
+        return result
+
+    def snapshot(self):
+        result = self.to_dict()
+        now = time.time()
+        result['time'] = now
+        result['uptime'] = now - self.start_time
+        return result
+
+    def write(self, filename):
+        # Readers never see a half written file
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'w') as file_handle:
+            json.dump(self.snapshot(), file_handle, indent=2)
+        os.replace(temp_filename, filename)
+
+    async def write_periodically(self, filename, interval):
+        while True:
+            try:
+                self.write(filename)
+            except OSError as error:
+                logging.warning('writing stats to %s failed: %s',
+                                filename, error)
+            await asyncio.sleep(interval)
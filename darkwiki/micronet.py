@@ -7,14 +7,79 @@ import logging
 import os
 import pickle
 import struct
-import sys
+import time
 import traceback
+import zlib
 import zmq
+from darkwiki.async_storage import AsyncStorage
+from darkwiki.connection_manager import ConnectionManager
+from darkwiki.flow_control import FetchWindow, SendWindow
+from darkwiki.metrics import Metrics
+from darkwiki.serialize import Layout
+
+# Blobs larger than this are streamed in chunks of this size.
+# Must stay well below the 2 byte length prefix used by write_data().
+CHUNK_SIZE = 32 * 1024
+
+# Upper bound on the memory held by objects waiting in a Pool
+POOL_MAX_BYTES = 16 * 1024 * 1024
+
+# zmq queue limits, messages beyond these are silently dropped
+DEFAULT_HWM = 1000
+
+DEFAULT_SEED_ADDRESS = '127.0.0.1:5577'
+# How long to wait for the seed node before carrying on without it
+SEED_TIMEOUT = 5.0
+
+# Number of peers we keep SUB connections open to
+DEFAULT_TARGET_OUTBOUND = 8
+# Number of peers which connected to us that we connect back to
+DEFAULT_TARGET_INBOUND = 8
+
+# A channel sends hello every KEEPALIVE_INTERVAL seconds and is
+# dropped when nothing has been heard for IDLE_TIMEOUT seconds
+KEEPALIVE_INTERVAL = 30.0
+IDLE_TIMEOUT = 3 * KEEPALIVE_INTERVAL
+
+# Capabilities advertised in hello
+CAPABILITY_ZLIB = 0x01
+CAPABILITIES = CAPABILITY_ZLIB
+
+# MessageHeader flags
+FLAG_COMPRESSED = 0x01
+
+# Messages queued on a channel are coalesced into one encrypted
+# envelope of up to DEFAULT_BATCH_MAX_BYTES. They wait at most
+# DEFAULT_BATCH_MAX_DELAY seconds, 0 meaning until the next loop tick,
+# or until the protocol has handled every message of the envelope it
+# is working through.
+DEFAULT_BATCH_MAX_BYTES = 64 * 1024
+DEFAULT_BATCH_MAX_DELAY = 0.0
+# The message count of an envelope is 2 bytes, however many small
+# messages fit in batch_max_bytes
+ENVELOPE_MAX_MESSAGES = 0xffff
+
+# Payloads smaller than this are not worth compressing
+COMPRESS_THRESHOLD = 256
+COMPRESS_LEVEL = 6
+# Compressed payloads may not inflate beyond this. Well above any
+# object sent whole, since larger blobs are chunked.
+MAX_DECOMPRESSED_SIZE = 16 * 1024 * 1024
+
+# Seconds between writes of the stats file
+DEFAULT_STATS_INTERVAL = 10.0
+# Seconds between updates of the per peer queue gauges
+GAUGE_INTERVAL = 2.5
 
 def public_to_node_id(public_key):
     hash_data = hashlib.sha256(public_key).digest()[:4]
     return struct.unpack('<I', hash_data)[0]
 
+def node_topic(node_id):
+    # Frames are published under the recipient's topic so that
+    # peers only receive what is addressed to them
+    return struct.pack('!I', node_id)
+
 class Keyring:
 
     def __init__(self, db):
@@ -44,7 +109,15 @@ class Keyring:
 
 class Node:
 
-    def __init__(self, db, interface, id, port, secret):
+    def __init__(self, db, interface, id, port, secret,
+                 sndhwm=DEFAULT_HWM, rcvhwm=DEFAULT_HWM,
+                 seed_address=DEFAULT_SEED_ADDRESS,
+                 target_outbound=DEFAULT_TARGET_OUTBOUND,
+                 target_inbound=DEFAULT_TARGET_INBOUND,
+                 batch_max_bytes=DEFAULT_BATCH_MAX_BYTES,
+                 batch_max_delay=DEFAULT_BATCH_MAX_DELAY,
+                 stats_filename=None,
+                 stats_interval=DEFAULT_STATS_INTERVAL):
         self.db = db
         self.interface = interface
 
@@ -53,14 +126,35 @@ class Node:
         self.port = port
         self._connect_list = None
 
+        self.sndhwm = sndhwm
+        self.rcvhwm = rcvhwm
+        self.seed_address = seed_address
+        self.batch_max_bytes = batch_max_bytes
+        self.batch_max_delay = batch_max_delay
+        self.stats_filename = stats_filename
+        self.stats_interval = stats_interval
+
+        self.storage = AsyncStorage(db, interface)
+        self.connections = ConnectionManager(self, target_outbound,
+                                             target_inbound)
+
+        # Totals for the node and broken down by peer address
+        self.metrics = Metrics()
+
     @property
     def seeds_filename(self):
         return os.path.join(self.db.dot_path, 'seeds')
 
+    @property
+    def connect_list(self):
+        return self._connect_list
+
     def schedule(self, coroutine):
         async def report_error(coroutine):
             try:
                 return await coroutine
+            except asyncio.CancelledError:
+                raise
             except:
                 logging.error(traceback.format_exc())
 
@@ -79,7 +173,7 @@ class Node:
     async def _fetch_from_seed_node(self):
         stream = await aiozmq.create_zmq_stream(
             zmq_type=zmq.REQ,
-            connect='tcp://127.0.0.1:5577')
+            connect='tcp://%s' % self.seed_address)
 
         our_address = '127.0.0.1:%d' % self.port
         public_key = darkwiki.secret_to_public(self.secret)
@@ -93,23 +187,28 @@ class Node:
 
         connect_list = {}
 
-        data = await stream.read()
+        try:
+            data = await asyncio.wait_for(stream.read(), SEED_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning('error updating seeds: seed node timed out')
+            data = []
+        stream.close()
         if len(data) != 1:
-            return
+            return connect_list
         deserial = darkwiki.Deserializer(data[0])
         try:
             size = deserial.read_2_bytes()
             for _ in range(size):
                 address = deserial.read_string()
-                public_key = deserial.read_data()
+                public_key = bytes(deserial.read_data())
 
                 connect_list[address] = public_key
         except darkwiki.DeserialError:
-            print('error updating seeds: bad stream', file=sys.stderr)
-            return
+            logging.warning('error updating seeds: bad stream')
+            return {}
 
-        # Skip ourselves
-        del connect_list[our_address]
+        # Skip ourselves, the seed node normally leaves us out already
+        connect_list.pop(our_address, None)
 
         return connect_list
 
@@ -129,35 +228,94 @@ class Node:
     async def start(self):
         await self.sync_seeds()
 
-        self._publish = await aiozmq.create_zmq_stream(
-            zmq_type=zmq.PUB,
-            bind='tcp://*:%d' % self.port)
+        # XPUB also tells us who subscribes, see _read_subscriptions()
+        self._publish = await aiozmq.create_zmq_stream(zmq_type=zmq.XPUB)
+        # Must be set before binding to apply to all subscribers
+        self._publish.transport.setsockopt(zmq.SNDHWM, self.sndhwm)
+        self._publish.transport.setsockopt(zmq.XPUB_VERBOSE, 1)
+        await self._publish.transport.bind('tcp://*:%d' % self.port)
+        subscriptions_task = self.schedule(self._read_subscriptions())
 
-        tasks = []
-        for address, public_key in self._connect_list.items():
-            channel = Channel(self, address, public_key)
-            task = self.schedule(channel.start())
-            tasks.append(task)
+        stats_task = None
+        if self.stats_filename is not None:
+            stats_task = self.schedule(self.metrics.write_periodically(
+                self.stats_filename, self.stats_interval))
+
+        self.connections.add_peers(self._connect_list)
+        try:
+            await self.connections.run()
+        finally:
+            subscriptions_task.cancel()
+            if stats_task is not None:
+                stats_task.cancel()
+                self.metrics.write(self.stats_filename)
+            self._publish.close()
+            self.storage.shutdown()
+
+    async def _read_subscriptions(self):
+        # A peer opening a channel to us subscribes to its own topic
+        # on our socket, and unsubscribes when it closes the channel
+        while True:
+            frames = await self._publish.read()
+            event = frames[0]
+            if len(event) != 5:
+                continue
+            node_id = struct.unpack('!I', event[1:])[0]
+            if event[0] == 1:
+                self.connections.subscribed(node_id)
+            elif event[0] == 0:
+                self.connections.unsubscribed(node_id)
 
-        await asyncio.gather(*tasks)
+    def create_channel(self, peer):
+        return Channel(self, peer.address, peer.public_key, peer)
 
-    def send(self, message):
-        self._publish.write(message)
+    def send(self, topic, ciphertext):
+        self._publish.write([topic, ciphertext])
 
 class Channel:
 
-    def __init__(self, parent, address, public_key):
+    def __init__(self, parent, address, public_key, peer=None):
         self._parent = parent
         self._address = address
         self.public_key = public_key
+        # Connection statistics kept by the ConnectionManager
+        self.peer = peer
+        self._stream = None
+
+        # Messages waiting to go out in the next envelope
+        self._outbound = []
+        self._outbound_size = 0
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+        # While set, queued messages wait for an explicit flush()
+        self.holding = False
+        # Messages unpacked from an envelope but not yet received
+        self._inbound = collections.deque()
+        self._session = darkwiki.Session(parent.secret, public_key)
+
+        self._local_topic = node_topic(parent.id)
+        self._remote_topic = node_topic(public_to_node_id(public_key))
 
         self.identity = '%d:%s' % (parent.id, public_key.hex())
 
+    @property
+    def address(self):
+        return self._address
+
+    @property
+    def metrics(self):
+        return self._parent.metrics
+
+    @property
+    def pending(self):
+        # Messages received in an envelope and not yet handed out
+        return len(self._inbound)
+
     async def _initialize(self):
-        self._stream = await aiozmq.create_zmq_stream(
-            zmq_type=zmq.SUB,
-            connect='tcp://%s' % self._address)
-        self._stream.transport.subscribe(b'')
+        self._stream = await aiozmq.create_zmq_stream(zmq_type=zmq.SUB)
+        self._stream.transport.setsockopt(zmq.RCVHWM, self._parent.rcvhwm)
+        self._stream.transport.subscribe(self._local_topic)
+        await self._stream.transport.connect('tcp://%s' % self._address)
 
     async def start(self):
         await self._initialize()
@@ -165,44 +323,179 @@ class Channel:
         await asyncio.sleep(0.4)
 
         protocol = Protocol(self)
-        await protocol.start()
+        try:
+            await protocol.start()
+        finally:
+            self.close()
+
+    def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
 
     async def receive(self):
-        while True:
-            ciphertext = await self._stream.read()
-            if len(ciphertext) != 1:
+        while not self._inbound:
+            frames = await self._stream.read()
+            if len(frames) != 2 or frames[0] != self._local_topic:
+                continue
+            ciphertext = frames[1]
+            self.metrics.increment('envelopes_received', peer=self._address)
+            self.metrics.increment('bytes_received', len(ciphertext),
+                                   peer=self._address)
+
+            envelope = await self._parent.storage.decrypt(
+                self._session, ciphertext)
+            if envelope is None:
+                logging.warning('undecryptable envelope from %s',
+                                self._address)
+                self.metrics.increment('decrypt_failures', peer=self._address)
                 continue
-            ciphertext = ciphertext[0]
-
-            message = darkwiki.decrypt_verify(
-                ciphertext, self.public_key, self._parent.secret)
 
-            if message is not None:
-                return message
+            messages = Envelope.from_data(envelope)
+            if messages is None:
+                self.metrics.increment('bad_envelopes', peer=self._address)
+                continue
+            self.metrics.increment('messages_received', len(messages),
+                                   peer=self._address)
+            self._inbound.extend(messages)
+
+        return self._inbound.popleft()
+
+    async def send(self, message):
+        max_bytes = self._parent.batch_max_bytes
+        if self._outbound and self._outbound_size + len(message) > max_bytes:
+            await self.flush()
+
+        self._outbound.append(message)
+        self._outbound_size += len(message)
+
+        if self._outbound_size >= max_bytes or \
+                len(self._outbound) >= ENVELOPE_MAX_MESSAGES:
+            await self.flush()
+        elif self._flush_task is None and not self.holding:
+            self._flush_task = self._parent.schedule(self._flush_later())
+
+    async def _flush_later(self):
+        # Even a zero delay lets everything else queued during
+        # this loop iteration join the envelope
+        await asyncio.sleep(self._parent.batch_max_delay)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        # Envelopes must leave in the order their messages were queued
+        async with self._flush_lock:
+            if not self._outbound:
+                return
+            messages = self._outbound
+            self._outbound = []
+            self._outbound_size = 0
+
+            envelope = Envelope.to_data(messages)
+            ciphertext = await self._parent.storage.encrypt(
+                self._session, envelope)
+
+            self._parent.send(self._remote_topic, ciphertext)
+
+            self.metrics.increment('envelopes_sent', peer=self._address)
+            self.metrics.increment('messages_sent', len(messages),
+                                   peer=self._address)
+            self.metrics.increment('bytes_sent', len(ciphertext),
+                                   peer=self._address)
+
+class Envelope:
+    # count:2
+    # for each message:
+    #   size:4
+    #   message
 
-    def send(self, message):
-        ciphertext = darkwiki.encrypt_sign(
-            message, self._parent.secret, self.public_key)
+    @staticmethod
+    def to_data(messages):
+        assert len(messages) <= ENVELOPE_MAX_MESSAGES
+        serial = darkwiki.Serializer()
+        serial.write_2_bytes(len(messages))
+        for message in messages:
+            serial.write_4_bytes(len(message))
+            serial.append(message)
+        return serial.result()
 
-        self._parent.send([ciphertext])
+    @staticmethod
+    def from_data(data):
+        deserial = darkwiki.Deserializer(data)
+        messages = []
+        try:
+            count = deserial.read_2_bytes()
+            for _ in range(count):
+                size = deserial.read_4_bytes()
+                messages.append(deserial.read_fixed_data(size))
+        except darkwiki.DeserialError:
+            return None
+        return messages
+
+def pool_object_size(object_type, object_):
+    # Approximate memory held by an object, used for pool accounting
+    if object_type == darkwiki.DataType.BLOB:
+        return len(object_)
+    elif object_type == darkwiki.DataType.TREE:
+        return sum(len(mode) + 1 + len(ident) + len(filename)
+                   for mode, type_, ident, filename in object_)
+    else:
+        return sum(len(str(value)) for value in object_.values())
 
 class Pool:
 
-    def __init__(self, db, interface):
-        self.pool = collections.deque(maxlen=1000)
+    def __init__(self, db, interface, max_bytes=POOL_MAX_BYTES):
         self._db = db
         self._interface = interface
-        self._object_map = {}
+
+        self.max_bytes = max_bytes
+        self.size = 0
+
+        # Kept in insertion order so the oldest objects are evicted first
+        self._object_map = collections.OrderedDict()
+        self._sizes = {}
+        self._commits_map = {}
+
+    def __len__(self):
+        return len(self._object_map)
 
     def exists(self, ident):
         return ident in self._object_map
 
     def add(self, ident, object_type, object_):
-        self.pool.append((ident, (object_type, object_)))
-        self._object_map = dict(self.pool)
+        size = pool_object_size(object_type, object_)
+        if size > self.max_bytes:
+            return False
+
+        self.remove(ident)
+
+        self._object_map[ident] = (object_type, object_)
+        self._sizes[ident] = size
+        self.size += size
+        if object_type == darkwiki.DataType.COMMIT:
+            self._commits_map[ident] = object_
+
+        while self.size > self.max_bytes:
+            oldest_ident = next(iter(self._object_map))
+            self.remove(oldest_ident)
+
+        return True
+
+    def remove(self, ident):
+        if ident not in self._object_map:
+            return
+
+        del self._object_map[ident]
+        self.size -= self._sizes.pop(ident)
+        self._commits_map.pop(ident, None)
 
     def resolve(self):
         chain = self._resolve_commit_chain()
+        if chain is None:
+            return []
 
         missing_objects = []
         for commit in chain:
@@ -211,6 +504,8 @@ class Pool:
         return missing_objects
 
     def _verify_tree(self, tree_ident):
+        if self._db.reachability.is_complete(tree_ident):
+            return []
         tree = self._fetch_tree(tree_ident)
         if tree is None:
             return [tree_ident]
@@ -252,16 +547,19 @@ class Pool:
     def _resolve_commit_chain(self):
         commits_map = self._filter_commits()
 
-        valid_chain = None
+        # Chain length back to a root commit for every commit visited,
+        # or None when the chain is broken by a missing commit
+        depths = {}
+        commits = {}
+
+        valid_tip = None
         longest_chain = 0
         # Construct valid chain from origin that we share
-        for ident, commit in commits_map.items():
-            commit['ident'] = ident
-            chain = self._follow(commit, commits_map)
-            if chain is None:
-                continue
-            if len(chain) > longest_chain:
-                valid_chain = chain
+        for ident in commits_map:
+            depth = self._chain_depth(ident, commits_map, depths, commits)
+            if depth is not None and depth > longest_chain:
+                valid_tip = ident
+                longest_chain = depth
 
         # TODO: Currently we have no system to resolve missing
         #       commits in the chain back to the shared origin.
@@ -269,41 +567,65 @@ class Pool:
         #       sends all commits in a batch, but we shouldn't
         #       rely on this behaviour.
 
-        return valid_chain
+        if valid_tip is None:
+            return None
 
-    def _follow(self, commit, commits_map):
-        if commit['previous_commit'] is None:
-            return [commit]
+        return self._follow(valid_tip, commits)
+
+    def _chain_depth(self, ident, commits_map, depths, commits):
+        # Walk back until we reach a root, a missing commit or
+        # a commit whose depth was already computed
+        path = []
+        on_path = set()
+        while ident is not None and ident not in depths:
+            if ident in on_path:
+                # A peer sent commits which lead back to themselves,
+                # the chain is as broken as with a missing commit
+                depths[ident] = None
+                break
+            commit = self._get_commit(ident, commits_map)
+            if commit is None:
+                depths[ident] = None
+                break
+            commit['ident'] = ident
+            commits[ident] = commit
+            path.append(ident)
+            on_path.add(ident)
+            ident = commit['previous_commit']
+
+        depth = 0 if ident is None else depths[ident]
+        # Then assign depths on the way back up
+        for path_ident in reversed(path):
+            if depth is not None:
+                depth += 1
+            depths[path_ident] = depth
+
+        return depth
+
+    def _follow(self, ident, commits):
+        chain = []
+        while ident is not None:
+            commit = commits[ident]
+            chain.append(commit)
+            ident = commit['previous_commit']
+        return chain
 
-        previous_commit_ident = commit['previous_commit']
-        previous_commit = self._get_commit(previous_commit_ident, commits_map)
-        if previous_commit is None:
-            return None
-        previous_commit['ident'] = previous_commit_ident
+    def _get_commit(self, commit_ident, commits_map):
+        if commit_ident in commits_map:
+            return commits_map[commit_ident]
 
-        chain = self._follow(previous_commit, commits_map)
-        if chain is None:
+        # Not found in our pool, lookup in database
+        if not self._db.exists(commit_ident):
             return None
 
-        return [commit] + chain
-
-    def _get_commit(self, commit_ident, commits_map):
         type_, commit = self._db.fetch(commit_ident)
         if type_ != darkwiki.DataType.COMMIT:
             return None
 
-        if commit is not None:
-            return commit
-
-        # Not found in database, lookup in our pool
-        if commit_ident not in commits_map:
-            return None
-
-        return commits_map[commit_ident]
+        return commit
 
     def _filter_commits(self):
-        return dict((ident, object_) for ident, (object_type, object_)
-                    in self.pool if object_type == darkwiki.DataType.COMMIT)
+        return self._commits_map
 
     def rebase(self):
         # Build against branch
@@ -317,75 +639,305 @@ class Protocol:
 
         self._pool = Pool(self.db, self.interface)
 
+        # Fetches we have outstanding with the remote
+        self._fetch_window = FetchWindow()
+        # Replies we sent which the remote has not acked yet
+        self._send_window = SendWindow()
+
+        self._hello_time = None
+        self._synced = False
+        # Set when objects arrived and missing objects need resolving
+        self._objects_arrived = False
+        # Set once the remote tells us it can decompress
+        self._compress = False
+        # ident -> time of the first fetch, for the fetch latency
+        self._fetch_started = {}
+
     @property
     def db(self):
         return self._channel._parent.db
     @property
     def interface(self):
         return self._channel._parent.interface
+    @property
+    def storage(self):
+        return self._channel._parent.storage
 
     @property
     def remote_public_key(self):
         return self._channel.public_key
 
+    @property
+    def peer(self):
+        return self._channel.peer
+
+    @property
+    def metrics(self):
+        return self._channel.metrics
+    @property
+    def address(self):
+        return self._channel.address
+
     async def start(self):
-        self.send('hello')
+        await self._send_hello()
+
+        logging.info('connected to %s', self._channel.identity)
 
-        print('connect', self._channel.identity)
+        schedule = self._channel._parent.schedule
+        background = [schedule(self._retransmit()),
+                      schedule(self._keepalive()),
+                      schedule(self._update_gauges())]
+        try:
+            while True:
+                # Raises TimeoutError when the remote has gone quiet
+                message = await asyncio.wait_for(self.receive(),
+                                                 IDLE_TIMEOUT)
+                logging.debug('got %s from %s', message.command,
+                              self.address)
+                self.metrics.increment('received_%s' % message.command,
+                                       peer=self.address)
+
+                # Everything we send while working through an envelope
+                # goes out together once the envelope is done, rather
+                # than whenever an executor call lets the loop run
+                self._channel.holding = True
+                try:
+                    await self._process(message)
+
+                    # Resolve once for all the objects in the envelope
+                    if self._objects_arrived and not self._channel.pending:
+                        self._objects_arrived = False
+                        await self._request_missing_objects()
+                finally:
+                    self._channel.holding = False
+                if not self._channel.pending:
+                    await self._channel.flush()
+        finally:
+            [task.cancel() for task in background]
+
+    async def _send_hello(self):
+        self._hello_time = time.monotonic()
+        await self.send('hello', CAPABILITIES)
+
+    async def _keepalive(self):
+        # Also picks up any new commits on the remote
+        while True:
+            await asyncio.sleep(KEEPALIVE_INTERVAL)
+            await self._send_hello()
 
+    async def _retransmit(self):
+        interval = self._fetch_window.timeout / 2
         while True:
-            message = await self.receive()
-            print('got:', message.command, self._channel.identity)
+            await asyncio.sleep(interval)
+
+            # Fetches that were dropped or never answered
+            await self._fetch(self._fetch_window.expired())
 
-            self._process(message)
+            # Replies whose acks were lost
+            self._send_window.expire()
+            await self._send_deferred_replies()
 
-    def _process(self, message):
+    async def _update_gauges(self):
+        while True:
+            gauges = {
+                # How far behind the remote we are
+                'fetch_queue': len(self._fetch_window),
+                'fetch_in_flight': self._fetch_window.in_flight,
+                'send_pending': self._send_window.pending(),
+                'send_unacked_bytes': self._send_window.unacked_bytes,
+                'pool_objects': len(self._pool),
+                'pool_bytes': self._pool.size
+            }
+            for name, value in gauges.items():
+                self.metrics.set_gauge(name, value, peer=self.address)
+            await asyncio.sleep(GAUGE_INTERVAL)
+
+    async def _process(self, message):
         if message.command == 'hello':
-            tips = self.interface.branches_tips()
-            self.send('sync', tips)
+            self._compress = bool(message.capabilities & CAPABILITY_ZLIB)
+
+            # Our own hello may have been sent before the remote
+            # was listening, so say hello again until we get a sync
+            if not self._synced:
+                await self._send_hello()
+
+            tips = await self.storage.branches_tips()
+            await self.send('sync', tips)
 
         elif message.command == 'sync':
+            self._synced = True
+            if self.peer is not None:
+                self.peer.failures = 0
+            if self._hello_time is not None:
+                latency = time.monotonic() - self._hello_time
+                self._hello_time = None
+                self.metrics.observe('sync_latency', latency,
+                                     peer=self.address)
+                if self.peer is not None:
+                    self.peer.record_latency(latency)
+
             remote_tips = message.tips
 
             # First write remote tips
             for branch, commit_ident in remote_tips.items():
-                self.db.write_remote_ref(self.remote_public_key.hex(),
-                                         branch, commit_ident)
+                await self.storage.write_remote_ref(
+                    self.remote_public_key.hex(), branch, commit_ident)
 
-            self._request_missing_objects()
+            await self._request_missing_objects()
 
         elif message.command == 'fetch':
             ident = message.object_ident
-            object_type, object_ = self.db.fetch(ident)
-            print('fetch:', ident)
+            if not await self.storage.exists(ident):
+                return
+            logging.debug('%s fetched %s', self.address, ident)
 
-            self.send('object', ident, object_type, object_)
+            await self._reply(ident, None)
+
+        elif message.command == 'fetch_chunk':
+            if not await self.storage.exists(message.object_ident):
+                return
+            await self._reply(message.object_ident, message.offset)
 
         elif message.command == 'object':
-            print('object:', message.ident)
-            self.db.add_object(message.object, message.object_type)
+            logging.debug('received object %s', message.ident)
+            await self.storage.add_object(message.object, message.object_type)
+            await self.send('ack', message.ident, 0)
+
+            self._fetch_window.complete(message.ident)
+            self._object_received(message.ident)
+            self._objects_arrived = True
+
+        elif message.command == 'chunk':
+            await self._receive_chunk(message)
+
+        elif message.command == 'ack':
+            self._send_window.acked((message.object_ident, message.offset))
+            await self._send_deferred_replies()
+
+    def _object_received(self, ident):
+        if self.peer is not None:
+            self.peer.objects_received += 1
+
+        self.metrics.increment('objects_written', peer=self.address)
+        started = self._fetch_started.pop(ident, None)
+        if started is not None:
+            self.metrics.observe('fetch_latency', time.monotonic() - started,
+                                 peer=self.address)
+
+    async def _reply(self, ident, offset):
+        # offset is None for a plain fetch, which we answer with either
+        # the whole object or the first chunk of a large blob
+        object_size = await self.storage.object_size(ident)
+        if offset is None:
+            object_type = await self.storage.object_type(ident)
+            if (object_type == darkwiki.DataType.BLOB and
+                object_size > CHUNK_SIZE):
+                offset = 0
+
+        if offset is None:
+            size = object_size
+        else:
+            size = min(CHUNK_SIZE, max(object_size - offset, 0))
 
-            self._request_missing_objects()
+        if not self._send_window.has_credit(size):
+            self._send_window.defer((ident, offset, size), size)
+            return
+
+        await self._send_reply(ident, offset, size)
+
+    async def _send_deferred_replies(self):
+        while True:
+            reply = self._send_window.next_ready()
+            if reply is None:
+                return
+            await self._send_reply(*reply)
+
+    async def _send_reply(self, ident, offset, size):
+        if offset is None:
+            self._send_window.sent((ident, 0), size)
+            object_type, object_ = await self.storage.fetch(ident)
+            await self.send('object', ident, object_type, object_)
+        else:
+            await self._send_chunk(ident, offset, size)
 
-    def _request_missing_objects(self):
-        local_tips = self.interface.branches_tips()
+    async def _send_chunk(self, ident, offset, size):
+        total_size = await self.storage.object_size(ident)
+        if offset > total_size:
+            return
+        self._send_window.sent((ident, offset), size)
+        data = await self.storage.read_object_range(ident, offset, CHUNK_SIZE)
+        await self.send('chunk', ident, total_size, offset, data)
+
+    async def _receive_chunk(self, message):
+        ident = message.ident
+        if await self.storage.exists(ident):
+            return
+
+        # Drop duplicates and chunks from a stale transfer,
+        # but still ack them so the sender regains its credit
+        received_size = await self.storage.append_partial(
+            ident, message.offset, message.data)
+        await self.send('ack', ident, message.offset)
+        if received_size is None:
+            return
+
+        if received_size < message.total_size:
+            self._fetch_window.touch(ident)
+            await self.send('fetch_chunk', ident, received_size)
+            return
+
+        logging.debug('received chunked object %s', ident)
+        self._fetch_window.complete(ident)
+        if not await self.storage.finish_partial(ident):
+            logging.error('chunked object %s from %s failed verification',
+                          ident, self.address)
+            self.metrics.increment('verification_failures',
+                                   peer=self.address)
+            self._fetch_started.pop(ident, None)
+        else:
+            self._object_received(ident)
+
+        self._objects_arrived = True
+
+    async def _request_missing_objects(self):
+        local_tips = await self.storage.branches_tips()
 
         remote = self.remote_public_key.hex()
-        for branch in self.db.fetch_remote_branches(remote):
-            commit_ident = self.db.branch_remote_last_commit_ident(
+        for branch in await self.storage.fetch_remote_branches(remote):
+            commit_ident = await self.storage.branch_remote_last_commit_ident(
                 remote, branch)
 
-            missing = self.interface.resolve_missing_objects(commit_ident)
+            missing = await self.storage.resolve_missing_objects(commit_ident)
 
-            [self.send('fetch', ident) for ident in missing]
+            for ident in missing:
+                self._fetch_window.queue(ident)
 
             if not missing and branch in local_tips:
                 local_last = local_tips[branch]
                 if local_last != commit_ident:
                     self._attempt_merge(branch)
 
+        await self._fetch(self._fetch_window.ready())
+
+    async def _fetch(self, idents):
+        if not idents:
+            return
+        # Resume interrupted chunked transfers where they stopped.
+        # The sizes are all looked up first so that no executor call
+        # separates the sends and the fetches share one envelope.
+        received_sizes = await self.storage.partial_sizes(idents)
+
+        now = time.monotonic()
+        for ident, received_size in zip(idents, received_sizes):
+            self._fetch_started.setdefault(ident, now)
+            if received_size:
+                await self.send('fetch_chunk', ident, received_size)
+            else:
+                await self.send('fetch', ident)
+
     def _attempt_merge(self, branch):
-        print('Attempting merge:', branch, self.remote_public_key.hex())
+        logging.info('attempting merge of %s from %s', branch,
+                     self.remote_public_key.hex())
 
     def _commit_idents(self):
         commits = self.interface.fetch_commits()
@@ -400,25 +952,38 @@ class Protocol:
             if message is not None:
                 return message
 
-    def send(self, command, *args):
-        message_data = MessageFactory.serialize(command, *args)
-        self._channel.send(message_data)
+    async def send(self, command, *args):
+        message_data = MessageFactory.serialize(command, *args,
+                                                compress=self._compress)
+        await self._channel.send(message_data)
 
 class HelloMessage:
 
     command = 'hello'
 
+    layout = Layout(('capabilities', 'B'))
+
+    def __init__(self, capabilities=0):
+        self.capabilities = capabilities
+
     @classmethod
     def from_data(cls, data):
-        return cls()
+        deserial = darkwiki.Deserializer(data)
+        try:
+            capabilities, = deserial.read_layout(cls.layout)
+        except darkwiki.DeserialError:
+            return None
+        return cls(capabilities)
 
     def to_data(self):
-        return b''
+        return self.layout.pack(self.capabilities)
 
 class SyncMessage:
 
     command = 'sync'
 
+    tip_layout = Layout(('commit_ident', '32s'))
+
     def __init__(self, tips):
         self.tips = tips
 
@@ -432,9 +997,9 @@ class SyncMessage:
             tips = {}
             for _ in range(tips_size):
                 branch = deserial.read_string()
-                commit_ident = deserial.read_data().hex()
+                commit_ident, = deserial.read_layout(cls.tip_layout)
 
-                tips[branch] = commit_ident
+                tips[branch] = commit_ident.hex()
 
         except darkwiki.DeserialError:
             return None
@@ -446,8 +1011,7 @@ class SyncMessage:
         serial.write_4_bytes(len(self.tips))
         for branch, commit_ident in self.tips.items():
             serial.write_string(branch)
-            commit_ident = bytes.fromhex(commit_ident)
-            serial.write_data(commit_ident)
+            serial.write_layout(self.tip_layout, bytes.fromhex(commit_ident))
         return serial.result()
 
 class FetchMessage:
@@ -465,10 +1029,93 @@ class FetchMessage:
     def to_data(self):
         return bytes.fromhex(self.object_ident)
 
+class FetchChunkMessage:
+
+    command = 'fetch_chunk'
+
+    layout = Layout(('object_ident', '32s'), ('offset', 'I'))
+
+    def __init__(self, object_ident, offset):
+        self.object_ident = object_ident
+        self.offset = offset
+
+    @classmethod
+    def from_data(cls, data):
+        deserial = darkwiki.Deserializer(data)
+        try:
+            object_ident, offset = deserial.read_layout(cls.layout)
+        except darkwiki.DeserialError:
+            return None
+        return cls(object_ident.hex(), offset)
+
+    def to_data(self):
+        return self.layout.pack(bytes.fromhex(self.object_ident), self.offset)
+
+class AckMessage:
+
+    command = 'ack'
+
+    layout = Layout(('object_ident', '32s'), ('offset', 'I'))
+
+    def __init__(self, object_ident, offset):
+        self.object_ident = object_ident
+        self.offset = offset
+
+    @classmethod
+    def from_data(cls, data):
+        deserial = darkwiki.Deserializer(data)
+        try:
+            object_ident, offset = deserial.read_layout(cls.layout)
+        except darkwiki.DeserialError:
+            return None
+        return cls(object_ident.hex(), offset)
+
+    def to_data(self):
+        return self.layout.pack(bytes.fromhex(self.object_ident), self.offset)
+
+class ChunkMessage:
+
+    command = 'chunk'
+
+    # followed by data
+    layout = Layout(('ident', '32s'), ('total_size', 'I'),
+                    ('offset', 'I'))
+
+    def __init__(self, ident, total_size, offset, data):
+        self.ident = ident
+        self.total_size = total_size
+        self.offset = offset
+        self.data = data
+
+    @classmethod
+    def from_data(cls, data):
+        deserial = darkwiki.Deserializer(data)
+        try:
+            ident, total_size, offset = deserial.read_layout(cls.layout)
+            chunk_data = deserial.read_data()
+        except darkwiki.DeserialError:
+            return None
+        return cls(ident.hex(), total_size, offset, chunk_data)
+
+    def to_data(self):
+        serial = darkwiki.Serializer()
+        serial.write_layout(self.layout, bytes.fromhex(self.ident),
+                            self.total_size, self.offset)
+        serial.write_data(self.data)
+        return serial.result()
+
 class ObjectMessage:
 
     command = 'object'
 
+    # followed by the object
+    layout = Layout(('ident', '32s'), ('object_type', 'B'))
+    # mode:string, then this, then filename:string
+    tree_row_layout = Layout(('type', 'B'), ('ident', '32s'))
+    # followed by previous_commit:data, empty for a root commit
+    commit_layout = Layout(('tree', '32s'), ('timestamp', 'I'),
+                           ('utc_offset', 'i'))
+
     def __init__(self, ident, object_type, object_):
         self.ident = ident
         self.object_type = object_type
@@ -478,15 +1125,16 @@ class ObjectMessage:
     def from_data(cls, data):
         deserial = darkwiki.Deserializer(data)
         try:
-            ident = deserial.read_data().hex()
-            object_type = darkwiki.DataType(deserial.read_byte())
+            ident, object_type = deserial.read_layout(cls.layout)
+            ident = ident.hex()
+            object_type = darkwiki.DataType(object_type)
             if object_type == darkwiki.DataType.BLOB:
                 object_ = deserial.read_data()
             elif object_type == darkwiki.DataType.TREE:
                 object_ = ObjectMessage._read_tree(deserial)
             elif object_type == darkwiki.DataType.COMMIT:
                 object_ = ObjectMessage._read_commit(deserial)
-        except darkwiki.DeserialError:
+        except (darkwiki.DeserialError, ValueError):
             return None
         return cls(ident, object_type, object_)
 
@@ -495,43 +1143,50 @@ class ObjectMessage:
         rows_size = deserial.read_4_bytes()
         tree = []
         for _ in range(rows_size):
-            tree.append((
-                deserial.read_string(),                     # mode
-                darkwiki.DataType(deserial.read_byte()),    # type
-                deserial.read_data().hex(),                 # ident
-                deserial.read_string()                      # filename
-            ))
+            mode = deserial.read_string()
+            type_, ident = deserial.read_layout(ObjectMessage.tree_row_layout)
+            filename = deserial.read_string()
+            type_ = darkwiki.DataType(type_)
+            tree.append((mode, type_, ident.hex(), filename))
         return tree
 
     @staticmethod
     def _read_commit(deserial):
-        return {
-            'tree': deserial.read_data().hex(),
-            'timestamp': deserial.read_4_bytes(),
-            'utc_offset': deserial.read_4_bytes(),
+        tree, timestamp, utc_offset = deserial.read_layout(
+            ObjectMessage.commit_layout)
+        commit = {
+            'tree': tree.hex(),
+            'timestamp': timestamp,
+            'utc_offset': utc_offset,
             'previous_commit': deserial.read_data().hex()
         }
+        # Root commits have no previous commit
+        if not commit['previous_commit']:
+            commit['previous_commit'] = None
+        return commit
 
     def to_data(self):
         serial = darkwiki.Serializer()
-        serial.write_data(bytes.fromhex(self.ident))
-        serial.write_byte(self.object_type.value)
+        serial.write_layout(self.layout, bytes.fromhex(self.ident),
+                            self.object_type.value)
         if self.object_type == darkwiki.DataType.BLOB:
             serial.write_data(self.object)
         elif self.object_type == darkwiki.DataType.TREE:
             serial.write_4_bytes(len(self.object))
             for mode, type_, ident, filename in self.object:
                 serial.write_string(mode)
-                serial.write_byte(type_.value)
-                serial.write_data(bytes.fromhex(ident))
+                serial.write_layout(self.tree_row_layout, type_.value,
+                                    bytes.fromhex(ident))
                 serial.write_string(filename)
         elif self.object_type == darkwiki.DataType.COMMIT:
-            tree = bytes.fromhex(self.object['tree'])
-            serial.write_data(tree)
-            serial.write_4_bytes(self.object['timestamp'])
-            serial.write_4_bytes(self.object['utc_offset'])
-            previous = bytes.fromhex(self.object['previous_commit'])
-            serial.write_data(previous)
+            serial.write_layout(self.commit_layout,
+                                bytes.fromhex(self.object['tree']),
+                                self.object['timestamp'],
+                                self.object['utc_offset'])
+            previous = self.object['previous_commit']
+            if previous is None:
+                previous = ''
+            serial.write_data(bytes.fromhex(previous))
         return serial.result()
 
 class MessageFactory:
@@ -539,7 +1194,10 @@ class MessageFactory:
         HelloMessage,
         SyncMessage,
         FetchMessage,
-        ObjectMessage
+        ObjectMessage,
+        FetchChunkMessage,
+        ChunkMessage,
+        AckMessage
     ]
     typemap = dict((cls_type.command, cls_type) for cls_type in message_types)
 
@@ -554,76 +1212,106 @@ class MessageFactory:
 
         cls_type = MessageFactory.typemap[header.command]
 
-        message = cls_type.from_data(header.payload)
+        payload = header.payload
+        if header.flags & FLAG_COMPRESSED:
+            payload = decompress_payload(payload)
+            if payload is None:
+                return None
+
+        message = cls_type.from_data(payload)
         return message
 
     @staticmethod
-    def serialize(command, *args):
+    def serialize(command, *args, compress=False):
         assert command in MessageFactory.typemap
         cls_type = MessageFactory.typemap[command]
 
         message = cls_type(*args)
 
-        header = MessageHeader(command, message.to_data())
+        payload = message.to_data()
+        flags = 0
+        if compress and len(payload) >= COMPRESS_THRESHOLD:
+            compressed = zlib.compress(payload, COMPRESS_LEVEL)
+            # Random data such as encrypted blobs only gets bigger
+            if len(compressed) < len(payload):
+                payload = compressed
+                flags |= FLAG_COMPRESSED
+
+        header = MessageHeader(command, payload, flags)
         return header.to_data()
 
+def decompress_payload(payload):
+    decompressor = zlib.decompressobj()
+    try:
+        # Refuse anything that inflates beyond what we would accept
+        payload = decompressor.decompress(payload, MAX_DECOMPRESSED_SIZE)
+    except zlib.error:
+        return None
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        return None
+    return payload
+
+def message_checksum(data):
+    return hashlib.sha256(data).digest()[:4]
+
 class MessageHeader:
-    # magic_bytes:4 = 1337
+    # magic:2 = 1337
     # protocol_version:2
-    # command
+    # command:12
+    # flags:1
+    # payload_size:4
     # payload
     # checksum:4
 
-    def __init__(self, command, payload):
-        self.command = command
-        self.payload = payload
+    layout = Layout(('magic', 'H'), ('protocol_version', 'H'),
+                    ('command', '12s'), ('flags', 'B'),
+                    ('payload_size', 'I'))
+    checksum_size = 4
 
-    @property
-    def magic(self):
-        return 1337
+    magic = 1337
+    protocol_version = 4
 
-    @property
-    def protocol_version(self):
-        return 1
-
-    @property
-    def checksum(self):
-        message_data = self._to_data_no_checksum()
-        hash_data = hashlib.sha256(message_data).digest()[:4]
-        return struct.unpack('<I', hash_data)[0]
-
-    def _to_data_no_checksum(self):
-        serial = darkwiki.Serializer()
-        serial.write_2_bytes(self.magic)
-        serial.write_2_bytes(self.protocol_version)
-        serial.write_fixed_string(self.command, 12)
-        serial.write_data(self.payload)
-        return serial.result()
+    def __init__(self, command, payload, flags=0):
+        self.command = command
+        self.payload = payload
+        self.flags = flags
 
     def to_data(self):
-        serial = darkwiki.Serializer()
-        serial.append(self._to_data_no_checksum())
-        serial.write_4_bytes(self.checksum)
-        return serial.result()
+        payload_start = self.layout.size
+        payload_end = payload_start + len(self.payload)
+
+        data = bytearray(payload_end + self.checksum_size)
+        self.layout.pack_into(data, 0, self.magic, self.protocol_version,
+                              self.command.encode('ascii'), self.flags,
+                              len(self.payload))
+        data[payload_start:payload_end] = self.payload
+        data[payload_end:] = message_checksum(memoryview(data)[:payload_end])
+        return bytes(data)
 
     @classmethod
     def from_data(cls, data):
         deserial = darkwiki.Deserializer(data)
         try:
-            magic = deserial.read_2_bytes()
-            version = deserial.read_2_bytes()
-            command = deserial.read_fixed_string(12)
-            payload = deserial.read_data()
-            checksum = deserial.read_4_bytes()
-        except DeserialError:
+            magic, version, command, flags, payload_size = \
+                deserial.read_layout(cls.layout)
+        except darkwiki.DeserialError:
             return None
 
-        self = cls(command, payload)
+        payload_start = cls.layout.size
+        payload_end = payload_start + payload_size
         # check magic_bytes, protocol_version
+        if (cls.magic != magic or cls.protocol_version != version or
+            len(data) != payload_end + cls.checksum_size):
+            return None
+
         # make sure checksum is good too
-        if (self.magic != magic or self.protocol_version != version or
-            self.checksum != checksum):
+        data = memoryview(data)
+        if message_checksum(data[:payload_end]) != data[payload_end:]:
             return None
 
-        return self
+        try:
+            command = str(command, 'ascii').rstrip('\0')
+        except UnicodeDecodeError:
+            return None
 
+        return cls(command, data[payload_start:payload_end], flags)
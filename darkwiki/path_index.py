@@ -0,0 +1,242 @@
+import bisect
+import darkwiki
+import json
+import os
+import threading
+
+# Written into .darkwiki, one JSON line per commit:
+#   [commit, previous_commit, generation, [changed paths]]
+# Lines are only ever appended, so readers pick up where they stopped.
+FILENAME = 'path-index'
+
+def _tree_entries(db, tree_ident):
+    # name -> (type, ident)
+    if tree_ident is None:
+        return {}
+    _, tree = db.fetch(tree_ident)
+    return dict((filename, (type_, ident))
+                for _, type_, ident, filename in tree)
+
+def changed_paths(db, tree_ident, previous_tree_ident, prefix=''):
+    # Files which differ between two trees. Subtrees with the same
+    # ident are skipped without being read.
+    if tree_ident == previous_tree_ident:
+        return []
+    entries = _tree_entries(db, tree_ident)
+    previous_entries = _tree_entries(db, previous_tree_ident)
+
+    TREE = darkwiki.DataType.TREE
+    paths = []
+    for name in sorted(set(entries) | set(previous_entries)):
+        entry = entries.get(name, (None, None))
+        previous_entry = previous_entries.get(name, (None, None))
+        if entry == previous_entry:
+            continue
+        path = prefix + name
+        if TREE in (entry[0], previous_entry[0]):
+            paths += changed_paths(
+                db,
+                entry[1] if entry[0] == TREE else None,
+                previous_entry[1] if previous_entry[0] == TREE else None,
+                path + '/')
+        # A file added, removed, changed or replaced by a directory
+        if darkwiki.DataType.BLOB in (entry[0], previous_entry[0]):
+            paths.append(path)
+    return paths
+
+def normalize_path(path):
+    # '' stands for the whole wiki
+    parts = darkwiki.directory_tree.split_path(path)
+    return '/'.join(part for part in parts if part != '.')
+
+def _clear_lowest_bit(value):
+    return value & (value - 1)
+
+def _skip_generation(generation):
+    # Where the skip pointer of a commit at generation leads. Spread
+    # like the levels of a skip list, so any ancestor is reached in
+    # O(log n) steps, with one pointer per commit.
+    height = generation - 1
+    if height < 2:
+        return 1
+    if height & 1:
+        return _clear_lowest_bit(_clear_lowest_bit(height - 1)) + 2
+    return _clear_lowest_bit(height) + 1
+
+class PathIndex:
+
+    # Changed paths of every commit, and the inverted path -> commits
+    # map built from them, so the history of a page is found without
+    # reading any trees.
+
+    def __init__(self, db):
+        self._db = db
+        self._lock = threading.Lock()
+        # Bytes of the file already loaded
+        self._offset = 0
+        # commit -> (previous_commit, generation, skip_commit)
+        self._commits = {}
+        # path -> commits which changed it
+        self._paths = {}
+        # Sorted keys of _paths, built again after new paths appear
+        self._sorted_paths = None
+
+    @property
+    def filename(self):
+        return os.path.join(self._db.dot_path, FILENAME)
+
+    def __contains__(self, commit_ident):
+        return commit_ident in self._commits
+
+    def parent(self, commit_ident):
+        return self._commits[commit_ident][0]
+
+    def generation(self, commit_ident):
+        # Commits since the root, counting the root as 1
+        return self._commits[commit_ident][1]
+
+    def refresh(self):
+        # Load lines appended since the last call, by us or by
+        # other processes
+        try:
+            with open(self.filename, 'rb') as file_handle:
+                file_handle.seek(self._offset)
+                data = file_handle.read()
+        except FileNotFoundError:
+            return
+        # A writer may still be in the middle of its last line
+        end = data.rfind(b'\n') + 1
+        self._offset += end
+        for line in data[:end].splitlines():
+            try:
+                commit, previous, generation, paths = json.loads(line)
+            except ValueError:
+                continue
+            self._add(commit, previous, generation, paths)
+
+    def _add(self, commit, previous, generation, paths):
+        # Two processes may have indexed the same commit
+        if commit in self._commits:
+            return
+        skip = None
+        if previous in self._commits:
+            skip = self._ancestor(previous, _skip_generation(generation))
+        self._commits[commit] = (previous, generation, skip)
+        for path in paths:
+            if path not in self._paths:
+                self._paths[path] = []
+                self._sorted_paths = None
+            self._paths[path].append(commit)
+
+    def _ancestor(self, commit_ident, generation):
+        # The ancestor of commit_ident at generation
+        previous, current, skip = self._commits[commit_ident]
+        while current > generation:
+            skip_generation = _skip_generation(current)
+            previous_skip = _skip_generation(current - 1)
+            # Take the skip pointer unless it overshoots, or the
+            # parent's one gets there in fewer steps
+            use_skip = skip_generation == generation or \
+                (skip_generation > generation and
+                 not (previous_skip < skip_generation - 2 and
+                      previous_skip >= generation))
+            if skip is not None and use_skip:
+                commit_ident, current = skip, skip_generation
+            else:
+                commit_ident, current = previous, current - 1
+            previous, _, skip = self._commits[commit_ident]
+        return commit_ident
+
+    def update(self, commit_ident):
+        # Index commit_ident and any of its ancestors not indexed yet
+        with self._lock:
+            self.refresh()
+
+            missing = []
+            while commit_ident is not None and \
+                    commit_ident not in self._commits:
+                _, commit = self._db.fetch(commit_ident)
+                missing.append((commit_ident, commit))
+                commit_ident = commit['previous_commit']
+            if not missing:
+                return
+
+            lines = []
+            # Oldest first, each generation follows from the previous
+            for commit_ident, commit in reversed(missing):
+                previous = commit['previous_commit']
+                if previous is None:
+                    generation = 1
+                    previous_tree = None
+                else:
+                    generation = self._commits[previous][1] + 1
+                    _, previous_commit = self._db.fetch(previous)
+                    previous_tree = previous_commit['tree']
+                paths = changed_paths(self._db, commit['tree'], previous_tree)
+                self._add(commit_ident, previous, generation, paths)
+                lines.append(json.dumps(
+                    [commit_ident, previous, generation, paths]) + '\n')
+
+            # One write, so concurrent writers do not interleave lines
+            with open(self.filename, 'a') as file_handle:
+                file_handle.write(''.join(lines))
+            # Picks up lines other processes appended meanwhile,
+            # our own are skipped as duplicates
+            self.refresh()
+
+    def is_ancestor(self, ancestor_ident, commit_ident):
+        # Whether ancestor_ident is commit_ident or one of its
+        # ancestors, both must be indexed
+        if ancestor_ident not in self._commits:
+            return False
+        generation = self.generation(ancestor_ident)
+        return generation <= self.generation(commit_ident) and \
+            self._ancestor(commit_ident, generation) == ancestor_ident
+
+    def matching_commits(self, paths):
+        # Commits which changed any of paths, where a directory stands
+        # for every file below it
+        sorted_paths = self._sorted_paths
+        if sorted_paths is None:
+            sorted_paths = self._sorted_paths = sorted(self._paths)
+
+        commits = set()
+        for path in paths:
+            path = normalize_path(path)
+            commits.update(self._paths.get(path, ()))
+            # The paths below a directory are next to each other
+            prefix = path + '/' if path else ''
+            index = bisect.bisect_left(sorted_paths, prefix)
+            while index < len(sorted_paths) and \
+                    sorted_paths[index].startswith(prefix):
+                commits.update(self._paths[sorted_paths[index]])
+                index += 1
+        return commits
+
+    def walk(self, commit_ident, paths, stop_ident=None):
+        # Idents of the commits from commit_ident back to stop_ident
+        # which changed paths, newest first. Only the commits which
+        # changed paths are looked at, through skip pointers, so the
+        # cost follows the history of the paths and not of the wiki.
+        self.update(commit_ident)
+        generation = self.generation(commit_ident)
+
+        stop_generation = 0
+        if stop_ident is not None:
+            if not self.is_ancestor(stop_ident, commit_ident):
+                raise ValueError('%s is not an ancestor' % stop_ident)
+            stop_generation = self.generation(stop_ident)
+
+        matching = sorted(self.matching_commits(paths),
+                          key=self.generation, reverse=True)
+        for ident in matching:
+            match_generation = self.generation(ident)
+            if match_generation > generation:
+                continue
+            if match_generation <= stop_generation:
+                break
+            # Other branches changed these paths too
+            commit_ident = self._ancestor(commit_ident, match_generation)
+            generation = match_generation
+            if commit_ident == ident:
+                yield ident
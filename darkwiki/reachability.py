@@ -0,0 +1,304 @@
+import contextlib
+import darkwiki
+import fcntl
+import os
+import threading
+import zlib
+
+# Every object that appears in a bitmap gets the next bit position,
+# stored as one fixed width line per object so the position of an
+# ident is its line number. Lines are only ever appended.
+ORDER_FILENAME = 'object-order'
+_LINE_SIZE = 65
+# Held by writers of the order file and bitmaps. A file of its own,
+# since gc replaces the order file.
+LOCK_FILENAME = 'object-order.lock'
+# One zlib compressed bitmap per selected commit, named by its ident
+BITMAPS_DIRECTORY = 'bitmaps'
+# Besides branch tips, commits whose generation is a multiple of this
+# keep their bitmap, so a new one only walks back to the nearest
+BITMAP_INTERVAL = 100
+
+_HEX_DIGITS = frozenset('0123456789abcdef')
+
+def is_ident(name):
+    # Bitmaps are named by commit ident, anything else is skipped
+    return len(name) == 64 and _HEX_DIGITS.issuperset(name)
+
+def encode_bitmap(bitmap):
+    size = (bitmap.bit_length() + 7) // 8
+    return zlib.compress(bitmap.to_bytes(size, 'little'))
+
+def decode_bitmap(data):
+    return int.from_bytes(zlib.decompress(data), 'little')
+
+def bit_positions(bitmap):
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for index, byte in enumerate(data):
+        if not byte:
+            continue
+        for bit in range(8):
+            if byte >> bit & 1:
+                yield index * 8 + bit
+
+class Reachability:
+
+    # Bitmaps of every object reachable from selected commits. A set
+    # bit means that object and everything below it is on disk.
+
+    def __init__(self, db):
+        self._db = db
+        self._lock = threading.RLock()
+        # The lock file while we hold it, and how deeply
+        self._lock_handle = None
+        self._lock_depth = 0
+        self._reset()
+
+    def _reset(self):
+        # gc replaces the order file, which changes its inode
+        self._order_inode = None
+        # position -> ident and back
+        self._order = []
+        self._positions = {}
+        # commit -> bitmap, for the bitmap files loaded so far
+        self._bitmaps = {}
+        # Union of every bitmap, objects known to be complete
+        self._complete = 0
+        # Bitmaps removed from disk but still used in memory
+        self._pruned = set()
+
+    @property
+    def _order_filename(self):
+        return os.path.join(self._db.dot_path, ORDER_FILENAME)
+
+    @property
+    def _bitmaps_path(self):
+        return os.path.join(self._db.dot_path, BITMAPS_DIRECTORY)
+
+    def _bitmap_filename(self, commit_ident):
+        return os.path.join(self._bitmaps_path, commit_ident)
+
+    @contextlib.contextmanager
+    def locked(self):
+        # Excludes writers in other processes as well. May be taken
+        # again by the same thread, so gc can hold it across clear()
+        # and the rebuild which follows.
+        with self._lock:
+            if self._lock_depth == 0:
+                self._lock_handle = open(
+                    os.path.join(self._db.dot_path, LOCK_FILENAME), 'ab')
+                fcntl.flock(self._lock_handle, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    # Closing releases the flock
+                    self._lock_handle.close()
+                    self._lock_handle = None
+
+    def refresh(self):
+        # Load what other processes appended and wrote since
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        try:
+            with open(self._order_filename, 'rb') as file_handle:
+                inode = os.fstat(file_handle.fileno()).st_ino
+                if inode != self._order_inode:
+                    # Positions were given out again, start over
+                    self._reset()
+                    self._order_inode = inode
+                file_handle.seek(len(self._order) * _LINE_SIZE)
+                data = file_handle.read()
+        except FileNotFoundError:
+            if self._order_inode is not None:
+                self._reset()
+            data = b''
+        for offset in range(0, len(data) - _LINE_SIZE + 1, _LINE_SIZE):
+            ident = data[offset:offset + _LINE_SIZE - 1].decode()
+            self._positions[ident] = len(self._order)
+            self._order.append(ident)
+
+        try:
+            commit_idents = os.listdir(self._bitmaps_path)
+        except FileNotFoundError:
+            return
+        for commit_ident in commit_idents:
+            # Such as the .tmp file of a bitmap being written
+            if not is_ident(commit_ident):
+                continue
+            if commit_ident not in self._bitmaps:
+                self._load_bitmap(commit_ident)
+
+    def _load_bitmap(self, commit_ident):
+        try:
+            with open(self._bitmap_filename(commit_ident), 'rb') as handle:
+                bitmap = decode_bitmap(handle.read())
+        except (FileNotFoundError, zlib.error):
+            return
+        # Bitmaps are written after the order lines they refer to,
+        # anything else is not ours to trust
+        if bitmap.bit_length() > len(self._order):
+            return
+        self._bitmaps[commit_ident] = bitmap
+        self._complete |= bitmap
+
+    def commit_objects(self, commit_ident):
+        # Objects reachable from commit_ident when it has a bitmap
+        bitmap = self._bitmaps.get(commit_ident)
+        if bitmap is None:
+            return None
+        return [self._order[position] for position in bit_positions(bitmap)]
+
+    def clear(self):
+        # Drop every bitmap and position. Used by gc, after which
+        # they are built again for the objects which are left.
+        with self.locked():
+            try:
+                commit_idents = os.listdir(self._bitmaps_path)
+            except FileNotFoundError:
+                commit_idents = []
+            for commit_ident in commit_idents:
+                os.remove(self._bitmap_filename(commit_ident))
+            try:
+                os.remove(self._order_filename)
+            except FileNotFoundError:
+                pass
+            self._reset()
+
+    def is_complete(self, ident):
+        position = self._positions.get(ident)
+        return position is not None and bool(self._complete >> position & 1)
+
+    def _reachable(self, commit_ident):
+        # Bitmap of the objects reachable from commit_ident, plus
+        # those which have no position yet. Computed from the nearest
+        # ancestor with a bitmap, and the objects must all be present.
+        bitmap, new_idents = self._walk(commit_ident)
+        unordered = []
+        for ident in new_idents:
+            if ident in self._positions:
+                bitmap |= 1 << self._positions[ident]
+            else:
+                unordered.append(ident)
+        return bitmap, unordered
+
+    def objects_between(self, commit_ident, base_ident=None):
+        # Idents reachable from commit_ident but not from base_ident,
+        # which is everything reachable when base_ident is None. Sync
+        # does not use this, the receiver asks for what it misses.
+        with self._lock:
+            self._refresh()
+            bitmap, unordered = self._reachable(commit_ident)
+            if base_ident is not None:
+                base_bitmap, base_unordered = self._reachable(base_ident)
+                bitmap &= ~base_bitmap
+                base_unordered = set(base_unordered)
+                unordered = [ident for ident in unordered
+                             if ident not in base_unordered]
+            return [self._order[position]
+                    for position in bit_positions(bitmap)] + unordered
+
+    def _walk(self, commit_ident):
+        # Returns the bitmap of the nearest ancestor with one, and the
+        # objects reachable from commit_ident which it does not cover
+        bitmap = 0
+        commits = []
+        while commit_ident is not None:
+            if commit_ident in self._bitmaps:
+                bitmap = self._bitmaps[commit_ident]
+                break
+            _, commit = self._db.fetch(commit_ident)
+            commits.append((commit_ident, commit))
+            commit_ident = commit['previous_commit']
+
+        new_idents = []
+        seen = set()
+        TREE = darkwiki.DataType.TREE
+        for commit_ident, commit in reversed(commits):
+            new_idents.append(commit_ident)
+            pending = [(commit['tree'], TREE)]
+            while pending:
+                ident, type_ = pending.pop()
+                if ident in seen:
+                    continue
+                # Everything below an object in the bitmap is too
+                position = self._positions.get(ident)
+                if position is not None and bitmap >> position & 1:
+                    continue
+                seen.add(ident)
+                new_idents.append(ident)
+                if type_ == TREE:
+                    _, tree = self._db.fetch(ident)
+                    pending.extend((row[2], row[1]) for row in tree)
+        return bitmap, new_idents
+
+    def update(self, commit_ident):
+        # Store bitmaps for commit_ident and for each ancestor whose
+        # generation is a multiple of BITMAP_INTERVAL. Every object
+        # reachable from commit_ident must be present.
+        path_index = self._db.path_index
+        path_index.update(commit_ident)
+
+        with self._lock:
+            self._refresh()
+            if commit_ident in self._bitmaps:
+                return
+
+            os.makedirs(self._bitmaps_path, exist_ok=True)
+            # Positions must not interleave with other writers, and
+            # the order file is only opened once gc is done with it
+            with self.locked():
+                self._refresh()
+
+                # Selected ancestors without a bitmap, newest first
+                selected = [commit_ident]
+                ident = path_index.parent(commit_ident)
+                while ident is not None and ident not in self._bitmaps:
+                    if path_index.generation(ident) % BITMAP_INTERVAL == 0:
+                        selected.append(ident)
+                    ident = path_index.parent(ident)
+
+                with open(self._order_filename, 'ab') as order_handle:
+                    for ident in reversed(selected):
+                        if ident not in self._bitmaps:
+                            self._store(ident, order_handle)
+                self._prune()
+
+    def _store(self, commit_ident, order_handle):
+        bitmap, new_idents = self._walk(commit_ident)
+        lines = []
+        for ident in new_idents:
+            if ident not in self._positions:
+                self._positions[ident] = len(self._order)
+                self._order.append(ident)
+                lines.append(ident + '\n')
+            bitmap |= 1 << self._positions[ident]
+        order_handle.write(''.join(lines).encode())
+        order_handle.flush()
+
+        filename = self._bitmap_filename(commit_ident)
+        with open(filename + '.tmp', 'wb') as file_handle:
+            file_handle.write(encode_bitmap(bitmap))
+        os.replace(filename + '.tmp', filename)
+        self._bitmaps[commit_ident] = bitmap
+        self._complete |= bitmap
+
+    def _prune(self):
+        # Old tips which are not at an interval have been superseded
+        tips = set(self._db.all_ref_commit_idents())
+        path_index = self._db.path_index
+        for commit_ident in list(self._bitmaps):
+            if commit_ident in tips or commit_ident in self._pruned or \
+                    commit_ident not in path_index:
+                continue
+            if path_index.generation(commit_ident) % BITMAP_INTERVAL:
+                try:
+                    os.remove(self._bitmap_filename(commit_ident))
+                except FileNotFoundError:
+                    pass
+                # Still used in memory, it is as valid as before
+                self._pruned.add(commit_ident)
@@ -3,57 +3,81 @@ import struct
 class DeserialError(Exception):
     pass
 
+class Layout:
+
+    # A fixed size group of fields declared once and compiled
+    # into a single struct.Struct, for example:
+    #   Layout(('magic', 'H'), ('command', '12s'), ('offset', 'I'))
+
+    def __init__(self, *fields):
+        self.names = tuple(name for name, _ in fields)
+        compiled = struct.Struct('!' + ''.join(fmt for _, fmt in fields))
+
+        # Bound directly to avoid an extra call per field
+        self.size = compiled.size
+        self.pack = compiled.pack
+        self.pack_into = compiled.pack_into
+        self.unpack_from = compiled.unpack_from
+
+_byte = struct.Struct('!B')
+_2_bytes = struct.Struct('!H')
+_4_bytes = struct.Struct('!I')
+
 class Deserializer:
 
+    # Reads fields in place from a memoryview over the data.
+    # read_data() and remaining_data() return views into the
+    # original buffer rather than copies.
+
     def __init__(self, data):
-        self._data = data
+        self._data = memoryview(data)
+        self._offset = 0
 
     def __bool__(self):
-        return len(self._data) > 0
+        return self._offset < len(self._data)
 
-    def read_string(self):
-        if len(self._data) < 1:
-            raise DeserialError
-        string_size = self._data[0]
-        if len(self._data) < 1 + string_size:
+    def _read_view(self, size):
+        if len(self._data) - self._offset < size:
             raise DeserialError
-        string = self._data[1:1 + string_size].decode('ascii')
-        self._data = self._data[1 + string_size:]
-        return string
+        view = self._data[self._offset:self._offset + size]
+        self._offset += size
+        return view
+
+    def read_string(self):
+        string_size = self.read_byte()
+        return str(self._read_view(string_size), 'ascii')
 
     def read_fixed_string(self, size):
-        if len(self._data) < size:
-            raise DeserialError
-        string = self._data[:size].decode('ascii').rstrip('\0')
-        self._data = self._data[size:]
-        return string
+        return str(self._read_view(size), 'ascii').rstrip('\0')
 
-    def _read_value(self, value_size, format_type):
-        if len(self._data) < value_size:
+    def _read_struct(self, codec):
+        if len(self._data) - self._offset < codec.size:
             raise DeserialError
-        result = struct.unpack('!' + format_type, self._data[:value_size])[0]
-        self._data = self._data[value_size:]
+        result = codec.unpack_from(self._data, self._offset)
+        self._offset += codec.size
         return result
 
     def read_byte(self):
-        return self._read_value(1, 'B')
+        return self._read_struct(_byte)[0]
 
     def read_2_bytes(self):
-        return self._read_value(2, 'H')
+        return self._read_struct(_2_bytes)[0]
 
     def read_4_bytes(self):
-        return self._read_value(4, 'I')
+        return self._read_struct(_4_bytes)[0]
+
+    def read_layout(self, layout):
+        return self._read_struct(layout)
+
+    def read_fixed_data(self, size):
+        return self._read_view(size)
 
     def read_data(self):
         data_size = self.read_2_bytes()
-        if len(self._data) < data_size:
-            raise DeserialError
-        data = self._data[:data_size]
-        self._data = self._data[data_size:]
-        return data
+        return self._read_view(data_size)
 
     def remaining_data(self):
-        return self._data
+        return self._data[self._offset:]
 
 class Serializer:
 
@@ -70,13 +94,16 @@ class Serializer:
         self._fragments.append(string.encode('ascii'))
 
     def write_byte(self, value):
-        self._fragments.append(bytes([value]))
+        self._fragments.append(_byte.pack(value))
 
     def write_2_bytes(self, value):
-        self._fragments.append(struct.pack('!H', value))
+        self._fragments.append(_2_bytes.pack(value))
 
     def write_4_bytes(self, value):
-        self._fragments.append(struct.pack('!I', value))
+        self._fragments.append(_4_bytes.pack(value))
+
+    def write_layout(self, layout, *values):
+        self._fragments.append(layout.pack(*values))
 
     def write_data(self, data):
         self.write_2_bytes(len(data))
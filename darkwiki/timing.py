@@ -0,0 +1,129 @@
+import collections
+import contextlib
+import functools
+import signal
+import sys
+import time
+
+# Spans are only recorded after enable(), until then the
+# decorators cost a single flag check per call
+enabled = False
+
+# name -> [calls, total seconds, longest call]
+_spans = collections.defaultdict(lambda: [0, 0.0, 0.0])
+# Spans currently open, so recursive calls are not counted twice
+_active = collections.Counter()
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    _spans.clear()
+    _active.clear()
+
+@contextlib.contextmanager
+def span(name):
+    if not enabled:
+        yield
+        return
+
+    entry = _spans[name]
+    entry[0] += 1
+    _active[name] += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _active[name] -= 1
+        # Only the outermost call of a recursive function is timed
+        if not _active[name]:
+            elapsed = time.perf_counter() - start
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+
+def timed(function):
+    name = function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return function(*args, **kwargs)
+        with span(name):
+            return function(*args, **kwargs)
+    return wrapper
+
+def summary():
+    rows = [(name, calls, total, total / calls, longest)
+            for name, (calls, total, longest) in _spans.items() if calls]
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows
+
+def print_summary(file=None):
+    if file is None:
+        file = sys.stderr
+    print('%-32s %8s %10s %10s %10s' % (
+        'span', 'calls', 'total ms', 'mean ms', 'max ms'), file=file)
+    for name, calls, total, mean, longest in summary():
+        print('%-32s %8d %10.2f %10.3f %10.3f' % (
+            name, calls, total * 1000, mean * 1000, longest * 1000),
+            file=file)
+
+class StackSampler:
+
+    # Samples the Python stack on SIGPROF and counts each stack in
+    # the collapsed format read by flamegraph.pl and speedscope.
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.stacks = collections.Counter()
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s (%s:%d)' % (code.co_name, code.co_filename,
+                                         code.co_firstlineno))
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous)
+
+    def dump(self, filename):
+        with open(filename, 'w') as file_handle:
+            for stack, count in self.stacks.most_common():
+                file_handle.write('%s %d\n' % (stack, count))
+
+# Profiles written in the collapsed stack format, anything
+# else is written as cProfile stats for pstats/snakeviz
+COLLAPSED_EXTENSIONS = ('.folded', '.collapsed')
+
+@contextlib.contextmanager
+def profile(filename):
+    if filename.endswith(COLLAPSED_EXTENSIONS):
+        profiler = StackSampler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            profiler.dump(filename)
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(filename)
@@ -0,0 +1,332 @@
+import darkwiki
+import errno
+import json
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+# Linux inotify, see inotify(7)
+IN_MODIFY       = 0x00000002
+IN_ATTRIB       = 0x00000004
+IN_CLOSE_WRITE  = 0x00000008
+IN_MOVED_FROM   = 0x00000040
+IN_MOVED_TO     = 0x00000080
+IN_CREATE       = 0x00000100
+IN_DELETE       = 0x00000200
+IN_DELETE_SELF  = 0x00000400
+IN_MOVE_SELF    = 0x00000800
+IN_Q_OVERFLOW   = 0x00004000
+IN_IGNORED      = 0x00008000
+IN_ONLYDIR      = 0x01000000
+IN_ISDIR        = 0x40000000
+IN_NONBLOCK     = 0o4000
+IN_CLOEXEC      = 0o2000000
+
+WORKTREE_EVENTS = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+                   IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+                   IN_MOVE_SELF | IN_ONLYDIR)
+# Inside .darkwiki only the index and sync cookies matter
+DOT_EVENTS = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+
+_event_header = struct.Struct('iIII')
+
+# Written by the watcher into .darkwiki
+DIRTY_FILENAME = 'dirty'
+# Clients create a cookie file and wait for the watcher to remove
+# it, after which every earlier change is in the dirty file
+COOKIE_PREFIX = 'watcher-cookie.'
+COOKIE_TIMEOUT = 1.0
+
+class Inotify:
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        self._ctypes = ctypes
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise()
+
+    def _raise(self):
+        error = self._ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            self._raise()
+        return wd
+
+    def read(self):
+        # Yields (wd, mask, name) for every queued event
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, size = _event_header.unpack_from(data, offset)
+            offset += _event_header.size
+            name = data[offset:offset + size].rstrip(b'\0')
+            offset += size
+            yield wd, mask, os.fsdecode(name)
+
+    def close(self):
+        os.close(self.fd)
+
+def _index_stat(db):
+    try:
+        stat = os.stat(db._index_filename)
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class Watcher:
+
+    # Keeps the set of indexed paths whose contents may differ from
+    # the index, so diff and commit -a only hash those. The set is
+    # written to .darkwiki/dirty for other processes to read.
+
+    def __init__(self, db):
+        # Our own database, the caller's may not be thread safe
+        self.db = darkwiki.DiskDatabase(db.transform_root_path(''))
+        self.root_path = self.db.transform_root_path('')
+
+        self._inotify = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+        # wd -> directory relative to the root
+        self._directories = {}
+        self._dot_wd = None
+        self._dirty = set()
+        self._index = {}
+        self._index_stat = None
+        # Set when events were lost, nothing can be trusted until
+        # the working tree has been walked and hashed again
+        self._overflow = True
+        # Set for good when we ran out of inotify watches
+        self._unwatched = False
+
+    @property
+    def dirty_filename(self):
+        return os.path.join(self.db.dot_path, DIRTY_FILENAME)
+
+    def start(self):
+        self._inotify = Inotify()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        try:
+            self._dot_wd = self._inotify.add_watch(self.db.dot_path,
+                                                   DOT_EVENTS)
+            self._rescan()
+            while not self._stopped.is_set():
+                readable, _, _ = select.select([self._inotify.fd], [], [],
+                                               0.5)
+                if readable:
+                    self._process(list(self._inotify.read()))
+        except Exception:
+            logging.exception('watcher failed')
+        finally:
+            # Never leave a dirty file behind that nobody maintains
+            try:
+                os.remove(self.dirty_filename)
+            except FileNotFoundError:
+                pass
+            self._inotify.close()
+
+    def _watch_tree(self, directory):
+        # Returns the files found, which may have been written
+        # before the watch was in place
+        files = []
+        pending = [directory]
+        while pending:
+            directory = pending.pop()
+            path = os.path.join(self.root_path, directory)
+            try:
+                wd = self._inotify.add_watch(path, WORKTREE_EVENTS)
+                entries = list(os.scandir(path))
+            except FileNotFoundError:
+                continue
+            except OSError as error:
+                if error.errno != errno.ENOSPC:
+                    raise
+                logging.warning('out of inotify watches, see '
+                                '/proc/sys/fs/inotify/max_user_watches')
+                self._unwatched = True
+                continue
+            self._directories[wd] = directory
+
+            for entry in entries:
+                relative = os.path.join(directory, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    if relative != '.darkwiki':
+                        pending.append(relative)
+                else:
+                    files.append(relative)
+        return files
+
+    def _process(self, events):
+        changed = False
+        cookies = []
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                logging.warning('inotify queue overflowed, rescanning')
+                self._overflow = True
+                changed = True
+            elif wd == self._dot_wd:
+                if name.startswith(COOKIE_PREFIX) and mask & IN_CREATE:
+                    cookies.append(name)
+                elif name == 'index':
+                    self._index_stat = None
+                    changed = True
+            elif wd in self._directories:
+                changed = True
+                self._worktree_event(wd, mask, name)
+
+        if self._overflow or self._index_stat != _index_stat(self.db):
+            self._rescan()
+        elif changed or cookies:
+            self._write()
+
+        # Only now are the changes before each cookie on disk
+        for name in cookies:
+            try:
+                os.remove(os.path.join(self.db.dot_path, name))
+            except FileNotFoundError:
+                pass
+
+    def _worktree_event(self, wd, mask, name):
+        directory = self._directories[wd]
+        if mask & IN_IGNORED:
+            del self._directories[wd]
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            return
+
+        relative = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_MOVED_FROM | IN_MOVED_TO):
+                # Watches below a moved directory now report the
+                # wrong paths, so walk the whole tree again
+                self._overflow = True
+            elif mask & IN_CREATE:
+                self._dirty.update(self._watch_tree(relative))
+            else:
+                # Everything below a removed directory changed
+                prefix = relative + os.sep
+                self._dirty.update(path for path in self._index
+                                   if path.startswith(prefix))
+            return
+        self._dirty.add(relative)
+
+    def _rescan(self):
+        # Compare every dirty path, and every path whose index entry
+        # changed, with the current index. After an overflow that
+        # means hashing the whole working tree again.
+        self._index_stat = _index_stat(self.db)
+        try:
+            index = dict((filename, ident)
+                         for _, ident, filename in self.db.read_index())
+        except (AssertionError, ValueError):
+            # Caught the index half written, its close event will
+            # bring us back here
+            self._index_stat = None
+            return
+
+        if self._overflow:
+            # Adding a watch again returns the same wd, so this
+            # also corrects the paths of existing watches
+            self._watch_tree('')
+            candidates = set(index)
+            self._overflow = False
+        else:
+            candidates = set(self._dirty)
+            candidates.update(filename for filename, ident in index.items()
+                              if self._index.get(filename) != ident)
+        self._index = index
+
+        dirty = set()
+        for filename in candidates:
+            if filename not in index:
+                continue
+            try:
+                if self.db.hash_file(filename) == index[filename]:
+                    continue
+            except OSError:
+                pass
+            dirty.add(filename)
+        self._dirty = dirty
+        self._write()
+
+    def _write(self):
+        state = {
+            'pid': os.getpid(),
+            'index': self._index_stat,
+            'overflow': self._overflow or self._unwatched,
+            'paths': sorted(self._dirty)
+        }
+        temp_filename = self.dirty_filename + '.tmp'
+        with open(temp_filename, 'w') as file_handle:
+            json.dump(state, file_handle)
+        os.replace(temp_filename, self.dirty_filename)
+
+def _read_state(db):
+    try:
+        with open(os.path.join(db.dot_path, DIRTY_FILENAME)) as file_handle:
+            return json.load(file_handle)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _sync_cookie(db, timeout):
+    cookie = os.path.join(db.dot_path, '%s%d.%d' % (
+        COOKIE_PREFIX, os.getpid(), time.monotonic_ns()))
+    open(cookie, 'w').close()
+
+    deadline = time.monotonic() + timeout
+    while os.path.exists(cookie):
+        if time.monotonic() > deadline:
+            try:
+                os.remove(cookie)
+            except FileNotFoundError:
+                return True
+            return False
+        time.sleep(0.001)
+    return True
+
+def dirty_paths(db, timeout=COOKIE_TIMEOUT):
+    # Indexed paths that may differ from the index, or None when
+    # no watcher is running and every path has to be checked
+    state = _read_state(db)
+    if state is None or not _pid_alive(state['pid']):
+        return None
+    if not _sync_cookie(db, timeout):
+        return None
+
+    state = _read_state(db)
+    if state is None or state['overflow']:
+        return None
+    if state['index'] != _index_stat(db):
+        return None
+    return set(state['paths'])
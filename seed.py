@@ -1,52 +1,122 @@
+import aiozmq
+import asyncio
 import darkwiki
-import threading
+import random
+import time
 import zmq
 
-class SeedNode(threading.Thread):
+SEED_PORT = 5577
+# Peers which have not registered again within this many seconds
+# are forgotten
+PEER_TTL = 600
+# Maximum number of peers returned to a caller
+SAMPLE_SIZE = 64
 
-    def __init__(self):
-        threading.Thread.__init__ (self)
+class SeedNode:
 
+    def __init__(self, port=SEED_PORT, ttl=PEER_TTL, sample_size=SAMPLE_SIZE):
+        self.port = port
+        self.ttl = ttl
+        self.sample_size = sample_size
+
+        # address -> (public_key, last seen)
         self._addrs = {}
+        # Addresses kept in a list as well for O(1) random sampling
+        self._addr_list = []
+        self._addr_positions = {}
 
-    def run(self):
-        context = zmq.Context()
-        socket = context.socket(zmq.REP)
-        socket.bind('tcp://*:5577')
+    def __len__(self):
+        return len(self._addr_list)
 
-        while True:
-            self.receive(socket)
-            self.reply(socket)
+    async def start(self):
+        self._stream = await aiozmq.create_zmq_stream(
+            zmq_type=zmq.ROUTER,
+            bind='tcp://*:%d' % self.port)
 
-    def receive(self, socket):
-        message = socket.recv()
+        expire = asyncio.ensure_future(self._expire_loop())
+        try:
+            while True:
+                frames = await self._stream.read()
+                self._process(frames)
+        finally:
+            expire.cancel()
+            self._stream.close()
+
+    def _process(self, frames):
+        # REQ sockets send [identity, empty delimiter, message]
+        if len(frames) != 3 or frames[1] != b'':
+            print('Bad message')
+            return
+        identity, _, message = frames
 
         deserial = darkwiki.Deserializer(message)
         try:
             address = deserial.read_string()
-            public_key = deserial.read_data()
+            public_key = bytes(deserial.read_data())
         except darkwiki.DeserialError:
             print('Bad message')
             return
 
-        print('Received:', address, public_key.hex())
-        self._addrs[address] = public_key
+        self.register(address, public_key)
+
+        reply = self.reply_data(self.sample(exclude=address))
+        self._stream.write([identity, b'', reply])
+
+    def register(self, address, public_key, now=None):
+        if now is None:
+            now = time.monotonic()
+
+        if address not in self._addrs:
+            self._addr_positions[address] = len(self._addr_list)
+            self._addr_list.append(address)
+        self._addrs[address] = (public_key, now)
 
-    def reply(self, socket):
+    def forget(self, address):
+        del self._addrs[address]
+        # Move the last address into the freed slot
+        position = self._addr_positions.pop(address)
+        last_address = self._addr_list.pop()
+        if last_address != address:
+            self._addr_list[position] = last_address
+            self._addr_positions[last_address] = position
+
+    def expire(self, now=None):
+        if now is None:
+            now = time.monotonic()
+
+        stale = [address for address, (_, last_seen) in self._addrs.items()
+                 if now - last_seen > self.ttl]
+        for address in stale:
+            self.forget(address)
+        return len(stale)
+
+    async def _expire_loop(self):
+        while True:
+            await asyncio.sleep(self.ttl / 4)
+            expired = self.expire()
+            if expired:
+                print('Expired %d peers, %d remaining' % (expired, len(self)))
+
+    def sample(self, exclude=None):
+        # Draw one extra in case we pick the caller
+        size = min(self.sample_size + 1, len(self._addr_list))
+        positions = random.sample(range(len(self._addr_list)), size)
+        addresses = [self._addr_list[position] for position in positions]
+        addresses = [address for address in addresses if address != exclude]
+        return [(address, self._addrs[address][0])
+                for address in addresses[:self.sample_size]]
+
+    def reply_data(self, peers):
         serial = darkwiki.Serializer()
-        serial.write_2_bytes(len(self._addrs))
-        for address, public_key in self._addrs.items():
+        serial.write_2_bytes(len(peers))
+        for address, public_key in peers:
             serial.write_string(address)
             serial.write_data(public_key)
-        data = serial.result()
-
-        socket.send(data)
+        return serial.result()
 
 def main():
     seed_node = SeedNode()
-    seed_node.start()
-    seed_node.join()
+    asyncio.get_event_loop().run_until_complete(seed_node.start())
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,65 @@
+import asyncio
+import darkwiki
+import os
+from darkwiki.async_storage import AsyncStorage
+from darkwiki.metrics import Metrics
+from darkwiki.micronet import Channel, Envelope, MessageFactory
+
+def make_db(root_path):
+    # An empty wiki in root_path
+    os.mkdir(os.path.join(root_path, '.darkwiki'))
+    db = darkwiki.DiskDatabase(root_path)
+    db.initialize()
+    return db
+
+class FakeStorage:
+
+    # Leaves envelopes unencrypted so the tests can read them
+
+    async def encrypt(self, session, message):
+        return message
+
+    async def branches_tips(self):
+        return {}
+
+    async def partial_sizes(self, idents):
+        # Like the executor, gives the loop a chance to run
+        await asyncio.sleep(0)
+        return [None] * len(idents)
+
+class PlainStorage(AsyncStorage):
+
+    # The real storage, without the encryption
+
+    async def encrypt(self, session, message):
+        return message
+
+class FakeNode:
+
+    def __init__(self, batch_max_bytes=64 * 1024, db=None, storage=None):
+        self.id = 1
+        self.secret = darkwiki.random_secret()
+        self.db = db
+        self.interface = None
+        self.metrics = Metrics()
+        self.storage = FakeStorage() if storage is None else storage
+        self.batch_max_bytes = batch_max_bytes
+        self.batch_max_delay = 0.0
+        self.sent = []
+
+    def schedule(self, coroutine):
+        return asyncio.ensure_future(coroutine)
+
+    def send(self, topic, ciphertext):
+        self.sent.append(ciphertext)
+
+def make_channel(node):
+    public_key = darkwiki.secret_to_public(darkwiki.random_secret())
+    return Channel(node, '127.0.0.1:1', public_key)
+
+def messages(envelope):
+    return [MessageFactory.deserialize(message)
+            for message in Envelope.from_data(envelope)]
+
+def commands(envelope):
+    return [message.command for message in messages(envelope)]
@@ -0,0 +1,124 @@
+import asyncio
+import darkwiki
+import hashlib
+import os
+import tempfile
+import unittest
+from darkwiki.micronet import CHUNK_SIZE, ChunkMessage, Protocol
+from fakes import FakeNode, PlainStorage, make_channel, make_db, messages
+
+class ChunkTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp = tempfile.TemporaryDirectory()
+        self.db = make_db(self._temp.name)
+        self.data = os.urandom(2 * CHUNK_SIZE + 100)
+        self.ident = hashlib.sha256(self.data).hexdigest()
+
+    def tearDown(self):
+        self._temp.cleanup()
+
+    def chunk(self, offset):
+        return ChunkMessage(self.ident, len(self.data), offset,
+                            self.data[offset:offset + CHUNK_SIZE])
+
+    def test_reassembly(self):
+        for offset in range(0, len(self.data), CHUNK_SIZE):
+            self.db.write_partial(self.ident, offset,
+                                  self.data[offset:offset + CHUNK_SIZE])
+        self.assertEqual(self.db.partial_size(self.ident), len(self.data))
+        self.assertTrue(self.db.finish_partial(self.ident))
+        self.assertEqual(self.db.fetch(self.ident),
+                         (darkwiki.DataType.BLOB, self.data))
+        self.assertIsNone(self.db.partial_size(self.ident))
+
+    def test_failed_verification(self):
+        self.db.write_partial(self.ident, 0, b'not the object')
+        self.assertFalse(self.db.finish_partial(self.ident))
+        self.assertFalse(self.db.exists(self.ident))
+        self.assertIsNone(self.db.partial_size(self.ident))
+
+    def test_append_partial(self):
+        async def run():
+            storage = PlainStorage(self.db, None)
+            try:
+                first = await storage.append_partial(self.ident, 0, b'abc')
+                duplicate = await storage.append_partial(
+                    self.ident, 0, b'abc')
+                stale = await storage.append_partial(self.ident, 10, b'x')
+                second = await storage.append_partial(self.ident, 3, b'de')
+            finally:
+                storage.shutdown()
+            return first, duplicate, stale, second
+        self.assertEqual(asyncio.run(run()), (3, None, None, 5))
+
+    def test_receive_chunks(self):
+        async def run():
+            storage = PlainStorage(self.db, None)
+            node = FakeNode(db=self.db, storage=storage)
+            protocol = Protocol(make_channel(node))
+            channel = protocol._channel
+            sent = []
+            try:
+                for offset in (0, 0, CHUNK_SIZE, 2 * CHUNK_SIZE):
+                    await protocol._receive_chunk(self.chunk(offset))
+                    await channel.flush()
+                    sent.append([(message.command, message.offset)
+                                 for envelope in node.sent
+                                 for message in messages(envelope)])
+                    node.sent.clear()
+            finally:
+                storage.shutdown()
+            return sent
+        sent = asyncio.run(run())
+        self.assertEqual(sent, [
+            [('ack', 0), ('fetch_chunk', CHUNK_SIZE)],
+            # A duplicate is acked and otherwise ignored
+            [('ack', 0)],
+            [('ack', CHUNK_SIZE), ('fetch_chunk', 2 * CHUNK_SIZE)],
+            [('ack', 2 * CHUNK_SIZE)]
+        ])
+        self.assertEqual(self.db.fetch(self.ident)[1], self.data)
+
+    def test_resume(self):
+        # An interrupted transfer continues where it stopped
+        self.db.write_partial(self.ident, 0, self.data[:CHUNK_SIZE])
+        async def run():
+            storage = PlainStorage(self.db, None)
+            node = FakeNode(db=self.db, storage=storage)
+            protocol = Protocol(make_channel(node))
+            try:
+                await protocol._fetch([self.ident, '0' * 64])
+                await protocol._channel.flush()
+            finally:
+                storage.shutdown()
+            return [message for envelope in node.sent
+                    for message in messages(envelope)]
+        sent = asyncio.run(run())
+        self.assertEqual([message.command for message in sent],
+                         ['fetch_chunk', 'fetch'])
+        self.assertEqual(sent[0].offset, CHUNK_SIZE)
+
+    def test_large_tree_sent_whole(self):
+        # Only blobs are chunked, a tree goes in one message however
+        # many pages its directory has
+        tree = [('644', darkwiki.DataType.BLOB, '%064x' % index,
+                 'page_%d.md' % index) for index in range(2000)]
+        ident = self.db.add_object(tree, darkwiki.DataType.TREE)
+        async def run():
+            storage = PlainStorage(self.db, None)
+            node = FakeNode(db=self.db, storage=storage)
+            protocol = Protocol(make_channel(node))
+            try:
+                await protocol._reply(ident, None)
+                await protocol._channel.flush()
+            finally:
+                storage.shutdown()
+            return [message for envelope in node.sent
+                    for message in messages(envelope)]
+        sent = asyncio.run(run())
+        self.assertEqual([message.command for message in sent], ['object'])
+        self.assertEqual(sent[0].object, tree)
+
+if __name__ == '__main__':
+    unittest.main()
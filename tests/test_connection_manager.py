@@ -0,0 +1,176 @@
+import asyncio
+import darkwiki
+import unittest
+from darkwiki.connection_manager import ConnectionManager
+from darkwiki.metrics import Metrics
+
+class FakeChannel:
+
+    def __init__(self, peer):
+        self.peer = peer
+        self.closed = False
+        self.result = asyncio.get_event_loop().create_future()
+
+    async def start(self):
+        await self.result
+
+    def close(self):
+        self.closed = True
+
+class FakeNode:
+
+    def __init__(self):
+        self.metrics = Metrics()
+        self.channels = []
+
+    def create_channel(self, peer):
+        channel = FakeChannel(peer)
+        self.channels.append(channel)
+        return channel
+
+def make_manager(peer_count, **kwargs):
+    node = FakeNode()
+    manager = ConnectionManager(node, **kwargs)
+    manager.add_peers({'127.0.0.1:%d' % index: bytes([index]) * 32
+                       for index in range(peer_count)})
+    return node, manager
+
+def node_id(index):
+    return darkwiki.micronet.public_to_node_id(bytes([index]) * 32)
+
+class ConnectionManagerTest(unittest.TestCase):
+
+    def test_fill_respects_target_outbound(self):
+        async def run():
+            node, manager = make_manager(5, target_outbound=2)
+            manager.fill()
+            return len(node.channels), len(manager.outbound)
+        self.assertEqual(asyncio.run(run()), (2, 2))
+
+    def test_fill_prefers_higher_score(self):
+        async def run():
+            node, manager = make_manager(3, target_outbound=1)
+            manager.peers[2].objects_received = 10
+            manager.fill()
+            return [channel.peer.address for channel in node.channels]
+        self.assertEqual(asyncio.run(run()), ['127.0.0.1:2'])
+
+    def test_rotate_drops_worst(self):
+        async def run():
+            node, manager = make_manager(3, target_outbound=2)
+            manager.peers[0].objects_received = 10
+            manager.peers[1].objects_received = 5
+            manager.fill()
+            manager.peers[1].record_latency(2.0)
+            manager.rotate()
+            await asyncio.sleep(0.01)
+            connected = [peer.address for peer in manager.connected]
+            return node, manager, connected
+        node, manager, connected = asyncio.run(run())
+        self.assertEqual(connected, ['127.0.0.1:0'])
+        self.assertTrue(node.channels[1].closed)
+        self.assertEqual(manager.peers[1].failures, 0)
+
+    def test_subscriber_gets_inbound_channel(self):
+        async def run():
+            node, manager = make_manager(5, target_outbound=2)
+            manager.fill()
+            connected = {peer.address for peer in manager.connected}
+            other = [index for index in range(5)
+                     if '127.0.0.1:%d' % index not in connected][0]
+            manager.subscribed(node_id(other))
+            addresses = [peer.address for peer in manager.connected]
+            return other, addresses, len(manager.outbound)
+        other, addresses, outbound = asyncio.run(run())
+        self.assertIn('127.0.0.1:%d' % other, addresses)
+        self.assertEqual(len(addresses), 3)
+        self.assertEqual(outbound, 2)
+
+    def test_target_inbound(self):
+        async def run():
+            node, manager = make_manager(5, target_outbound=0,
+                                         target_inbound=2)
+            for index in range(5):
+                manager.subscribed(node_id(index))
+            return len(manager.connected)
+        self.assertEqual(asyncio.run(run()), 2)
+
+    def test_unsubscribe_disconnects(self):
+        async def run():
+            node, manager = make_manager(3, target_outbound=0)
+            manager.subscribed(node_id(1))
+            manager.unsubscribed(node_id(1))
+            await asyncio.sleep(0.01)
+            return node, manager.connected
+        node, connected = asyncio.run(run())
+        self.assertEqual(connected, [])
+        self.assertTrue(node.channels[0].closed)
+
+    def test_rotate_ignores_inbound(self):
+        async def run():
+            node, manager = make_manager(4, target_outbound=1)
+            manager.fill()
+            outbound = manager.outbound[0]
+            inbound = [peer for peer in manager.peers
+                       if peer is not outbound][0]
+            manager.subscribed(inbound.node_id)
+            manager.rotate()
+            await asyncio.sleep(0.01)
+            return manager.connected, inbound
+        connected, inbound = asyncio.run(run())
+        self.assertEqual(connected, [inbound])
+
+    def test_timeout_without_subscription_is_not_a_failure(self):
+        async def run():
+            node, manager = make_manager(1, target_outbound=1)
+            manager.fill()
+            node.channels[0].result.set_exception(asyncio.TimeoutError())
+            await asyncio.sleep(0.01)
+            return node, manager
+        node, manager = asyncio.run(run())
+        peer = manager.peers[0]
+        self.assertEqual(peer.failures, 0)
+        self.assertEqual(node.metrics.counters['channel_unanswered'], 1)
+        self.assertGreater(peer.next_attempt, 0)
+
+    def test_timeout_from_subscriber_is_a_failure(self):
+        async def run():
+            node, manager = make_manager(1, target_outbound=0)
+            manager.subscribed(node_id(0))
+            node.channels[0].result.set_exception(asyncio.TimeoutError())
+            await asyncio.sleep(0.01)
+            return manager
+        manager = asyncio.run(run())
+        self.assertEqual(manager.peers[0].failures, 1)
+        self.assertEqual(manager.connected, [])
+
+    def test_clean_exit_is_not_a_failure(self):
+        async def run():
+            node, manager = make_manager(1, target_outbound=1)
+            manager.fill()
+            node.channels[0].result.set_result(None)
+            await asyncio.sleep(0.01)
+            manager.fill()
+            return node, manager, len(manager.connected)
+        node, manager, connected = asyncio.run(run())
+        self.assertEqual(manager.peers[0].failures, 0)
+        self.assertNotIn('channel_failures', node.metrics.counters)
+        # Connected again straight away
+        self.assertEqual(len(node.channels), 2)
+        self.assertEqual(connected, 1)
+
+    def test_error_backs_off(self):
+        async def run():
+            node, manager = make_manager(1, target_outbound=1)
+            manager.fill()
+            node.channels[0].result.set_exception(OSError())
+            await asyncio.sleep(0.01)
+            manager.fill()
+            return node, manager
+        node, manager = asyncio.run(run())
+        self.assertEqual(manager.peers[0].failures, 1)
+        self.assertEqual(len(node.channels), 1)
+        self.assertEqual(node.metrics.counters['channel_failures'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
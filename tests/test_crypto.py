@@ -0,0 +1,52 @@
+import darkwiki
+import unittest
+
+class SessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.secret = darkwiki.random_secret()
+        self.peer_secret = darkwiki.random_secret()
+        self.public = darkwiki.secret_to_public(self.secret)
+        self.peer_public = darkwiki.secret_to_public(self.peer_secret)
+        self.session = darkwiki.Session(self.secret, self.peer_public)
+        self.peer_session = darkwiki.Session(self.peer_secret, self.public)
+
+    def test_round_trip(self):
+        for message in (b'', b'hello', bytes(range(256)) * 128):
+            cipher = self.session.encrypt(message)
+            self.assertNotEqual(bytes(cipher), message)
+            self.assertEqual(self.peer_session.decrypt(cipher), message)
+            # Both directions share the key
+            cipher = self.peer_session.encrypt(message)
+            self.assertEqual(self.session.decrypt(cipher), message)
+
+    def test_fresh_nonce(self):
+        self.assertNotEqual(self.session.encrypt(b'hello'),
+                            self.session.encrypt(b'hello'))
+
+    def test_tampered(self):
+        cipher = bytearray(self.session.encrypt(b'hello'))
+        for index in (0, 24, len(cipher) - 1):
+            tampered = bytearray(cipher)
+            tampered[index] ^= 1
+            self.assertIsNone(self.peer_session.decrypt(bytes(tampered)))
+        self.assertIsNone(self.peer_session.decrypt(bytes(cipher[:-1])))
+
+    def test_wrong_key(self):
+        cipher = self.session.encrypt(b'hello')
+        other_secret = darkwiki.random_secret()
+        other_public = darkwiki.secret_to_public(other_secret)
+        # Someone else, and the right peer expecting someone else
+        for session in (darkwiki.Session(other_secret, self.public),
+                        darkwiki.Session(self.peer_secret, other_public)):
+            self.assertIsNone(session.decrypt(cipher))
+
+    def test_wrappers(self):
+        cipher = darkwiki.encrypt_sign(b'hello', self.secret,
+                                       self.peer_public)
+        self.assertEqual(darkwiki.decrypt_verify(cipher, self.public,
+                                                 self.peer_secret),
+                         b'hello')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import socket
+import tempfile
+import unittest
+from darkwiki.daemon import (find_socket_path, receive_message, send_message,
+                             socket_path)
+
+class FindSocketPathTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp = tempfile.TemporaryDirectory()
+        self.outer = os.path.join(self._temp.name, '.darkwiki')
+        os.mkdir(self.outer)
+        open(socket_path(self.outer), 'w').close()
+
+    def tearDown(self):
+        self._temp.cleanup()
+
+    def test_from_subdirectory(self):
+        path = os.path.join(self._temp.name, 'pages', 'deep')
+        os.makedirs(path)
+        self.assertEqual(find_socket_path(path), socket_path(self.outer))
+
+    def test_nested_wiki_without_daemon(self):
+        inner = os.path.join(self._temp.name, 'inner')
+        os.makedirs(os.path.join(inner, '.darkwiki'))
+        path = os.path.join(inner, 'pages')
+        os.mkdir(path)
+        self.assertIsNone(find_socket_path(path))
+        self.assertIsNone(find_socket_path(inner))
+
+    def test_nested_wiki_with_daemon(self):
+        inner = os.path.join(self._temp.name, 'inner', '.darkwiki')
+        os.makedirs(inner)
+        open(socket_path(inner), 'w').close()
+        self.assertEqual(find_socket_path(os.path.dirname(inner)),
+                         socket_path(inner))
+
+class MessageTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        client, server = socket.socketpair()
+        with client, server:
+            message = {'argv': ['log'], 'text': 'x' * 10000}
+            send_message(client, message)
+            self.assertEqual(receive_message(server), message)
+
+    def test_closed_connection(self):
+        client, server = socket.socketpair()
+        with server:
+            client.sendall(b'\x00\x00\x00\x10{')
+            client.close()
+            with self.assertRaises(ConnectionError):
+                receive_message(server)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import darkwiki
+import os
+import tempfile
+import threading
+import unittest
+from fakes import make_db
+
+class AddDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp = tempfile.TemporaryDirectory()
+        self.db = make_db(self._temp.name)
+
+    def tearDown(self):
+        self._temp.cleanup()
+
+    def test_add_blob(self):
+        ident = self.db.add_blob(b'hello')
+        self.assertTrue(self.db.exists(ident))
+        self.assertEqual(self.db.fetch(ident),
+                         (darkwiki.DataType.BLOB, b'hello'))
+        self.assertEqual(self.db.list(), [ident])
+        self.assertEqual(os.listdir(self.db._incoming_path), [])
+
+    def test_concurrent_adds(self):
+        data = os.urandom(1024 * 1024)
+        # An object must be complete whenever it exists
+        seen = []
+        def add():
+            ident = self.db.add_blob(data)
+            seen.append(self.db.fetch(ident)[1] == data)
+        threads = [threading.Thread(target=add) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(seen, [True] * 8)
+        self.assertEqual(len(self.db.list()), 1)
+        self.assertEqual(os.listdir(self.db._incoming_path), [])
+
+class SwitchBranchTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self._temp.name, 'wiki')
+        os.mkdir(self.root)
+        self.db = make_db(self.root)
+        self._cwd = os.getcwd()
+        # Somewhere else, like a benchmark run from its own directory
+        self.elsewhere = os.path.join(self._temp.name, 'elsewhere')
+        os.mkdir(self.elsewhere)
+        os.chdir(self.elsewhere)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._temp.cleanup()
+
+    def write(self, filename, text):
+        path = os.path.join(self.root, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file_handle:
+            file_handle.write(text)
+        self.db.add_file(filename)
+
+    def test_files_written_below_root(self):
+        self.write('a.md', 'a')
+        first = self.db.commit()
+        self.db.create_branch('other', first)
+        self.write('sub/b.md', 'b')
+        self.db.commit()
+
+        self.db.switch_branch('other')
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'sub')))
+        self.db.switch_branch('master')
+        with open(os.path.join(self.root, 'sub', 'b.md')) as file_handle:
+            self.assertEqual(file_handle.read(), 'b')
+        self.assertEqual(os.listdir(self.elsewhere), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import asyncio
+import unittest
+from darkwiki.micronet import Envelope, Protocol
+from fakes import FakeNode, commands, make_channel
+from unittest import mock
+
+class EnvelopeTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        messages = [b'', b'a', b'x' * 70000]
+        data = Envelope.to_data(messages)
+        self.assertEqual([bytes(message) for message
+                          in Envelope.from_data(data)], messages)
+
+    def test_truncated(self):
+        data = Envelope.to_data([b'hello', b'world'])
+        self.assertIsNone(Envelope.from_data(data[:-1]))
+
+class ChannelBatchTest(unittest.TestCase):
+
+    def test_messages_sent_together_share_an_envelope(self):
+        async def run():
+            node = FakeNode()
+            channel = make_channel(node)
+            for index in range(100):
+                await channel.send(b'message %d' % index)
+            await asyncio.sleep(0.01)
+            return node.sent
+        sent = asyncio.run(run())
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(len(Envelope.from_data(sent[0])), 100)
+
+    def test_full_envelope_is_flushed(self):
+        async def run():
+            node = FakeNode(batch_max_bytes=100)
+            channel = make_channel(node)
+            for _ in range(10):
+                await channel.send(b'x' * 30)
+            await asyncio.sleep(0.01)
+            return node.sent
+        sent = asyncio.run(run())
+        self.assertEqual([len(Envelope.from_data(envelope))
+                          for envelope in sent], [3, 3, 3, 1])
+
+    @mock.patch('darkwiki.micronet.ENVELOPE_MAX_MESSAGES', 4)
+    def test_message_count_is_capped(self):
+        async def run():
+            node = FakeNode(batch_max_bytes=1024 * 1024)
+            channel = make_channel(node)
+            for _ in range(10):
+                await channel.send(b'')
+            await asyncio.sleep(0.01)
+            return node.sent
+        sent = asyncio.run(run())
+        self.assertEqual([len(Envelope.from_data(envelope))
+                          for envelope in sent], [4, 4, 2])
+
+    def test_holding_waits_for_flush(self):
+        async def run():
+            node = FakeNode()
+            channel = make_channel(node)
+            channel.holding = True
+            for index in range(10):
+                await channel.send(b'message %d' % index)
+                await asyncio.sleep(0)
+            await asyncio.sleep(0.01)
+            held = len(node.sent)
+            channel.holding = False
+            await channel.flush()
+            return held, node.sent
+        held, sent = asyncio.run(run())
+        self.assertEqual(held, 0)
+        self.assertEqual(len(sent), 1)
+
+class ProtocolFetchTest(unittest.TestCase):
+
+    def test_fetches_share_an_envelope(self):
+        async def run():
+            node = FakeNode()
+            protocol = Protocol(make_channel(node))
+            await protocol._fetch(['%064x' % index for index in range(32)])
+            await asyncio.sleep(0.01)
+            return node.sent
+        sent = asyncio.run(run())
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(commands(sent[0]), ['fetch'] * 32)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+from darkwiki.flow_control import FetchWindow, SendWindow
+
+class FetchWindowTest(unittest.TestCase):
+
+    def test_max_in_flight(self):
+        window = FetchWindow(max_in_flight=3)
+        for ident in 'abcde':
+            window.queue(ident)
+        window.queue('a')
+        self.assertEqual(window.ready(now=0), ['a', 'b', 'c'])
+        self.assertEqual(window.ready(now=0), [])
+        self.assertEqual(len(window), 5)
+
+        window.complete('b')
+        self.assertEqual(window.ready(now=0), ['d'])
+        self.assertEqual(window.in_flight, 3)
+
+    def test_expired_are_retried(self):
+        window = FetchWindow(timeout=5.0, max_retries=2)
+        window.queue('a')
+        window.queue('b')
+        window.ready(now=0)
+        window.touch('b', now=4)
+        self.assertEqual(window.expired(now=6), ['a'])
+        self.assertEqual(window.expired(now=10), ['b'])
+        self.assertEqual(window.expired(now=11), ['a'])
+        # Out of retries, a is dropped from the window
+        self.assertEqual(window.expired(now=16), ['b'])
+        self.assertEqual(window.in_flight, 1)
+
+class SendWindowTest(unittest.TestCase):
+
+    def test_byte_credit(self):
+        window = SendWindow(max_bytes=100, max_messages=10)
+        # The first reply goes through however large
+        self.assertTrue(window.has_credit(1000))
+        window.sent('a', 60, now=0)
+        self.assertTrue(window.has_credit(40))
+        self.assertFalse(window.has_credit(41))
+        window.acked('a')
+        self.assertEqual(window.unacked_bytes, 0)
+
+    def test_message_credit(self):
+        window = SendWindow(max_bytes=1000, max_messages=2)
+        window.sent('a', 1, now=0)
+        window.sent('b', 1, now=0)
+        self.assertFalse(window.has_credit(1))
+
+    def test_deferred_reply_waits_for_ack(self):
+        window = SendWindow(max_bytes=100)
+        window.sent('a', 80, now=0)
+        window.defer('reply', 50)
+        self.assertIsNone(window.next_ready())
+        window.acked('a')
+        self.assertEqual(window.next_ready(), 'reply')
+        self.assertEqual(window.pending(), 0)
+
+    def test_overdue_ack_returns_credit(self):
+        window = SendWindow(max_bytes=100, timeout=5.0)
+        window.sent('a', 80, now=0)
+        window.expire(now=4)
+        self.assertEqual(window.unacked_bytes, 80)
+        window.expire(now=5)
+        self.assertEqual(window.unacked_bytes, 0)
+
+if __name__ == '__main__':
+    unittest.main()
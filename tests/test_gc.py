@@ -0,0 +1,120 @@
+import darkwiki
+import fcntl
+import os
+import tempfile
+import time
+import unittest
+from darkwiki import gc
+from fakes import make_db
+from unittest import mock
+
+DAY = 24 * 3600
+
+class CollectTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp = tempfile.TemporaryDirectory()
+        self.root = self._temp.name
+        self.db = make_db(self.root)
+
+        self.write('page.md', 'committed')
+        self.db.add_file('page.md')
+        self.commit = self.db.commit()
+
+    def tearDown(self):
+        self._temp.cleanup()
+
+    def write(self, filename, text):
+        with open(os.path.join(self.root, filename), 'w') as file_handle:
+            file_handle.write(text)
+
+    def age(self, path, days):
+        mtime = time.time() - days * DAY
+        os.utime(path, (mtime, mtime))
+
+    def unreachable(self, data, days):
+        ident = self.db.add_blob(data)
+        self.age(self.db._object_path(ident), days)
+        return ident
+
+    def test_keeps_reachable(self):
+        for ident in self.db.list():
+            self.age(self.db._object_path(ident), 30)
+        result = gc.collect(self.db)
+        self.assertEqual(result.pruned, [])
+        self.assertEqual(result.live, len(self.db.list()))
+
+    def test_grace_period(self):
+        old = self.unreachable(b'old', 15)
+        young = self.unreachable(b'young', 13)
+        result = gc.collect(self.db)
+        self.assertEqual(result.pruned, [old])
+        self.assertEqual(result.kept, 1)
+        self.assertFalse(self.db.exists(old))
+        self.assertTrue(self.db.exists(young))
+
+    def test_dry_run(self):
+        old = self.unreachable(b'old', 15)
+        result = gc.collect(self.db, dry_run=True)
+        self.assertEqual(result.pruned, [old])
+        self.assertEqual(result.pruned_bytes, len(b'BLOB:old'))
+        self.assertTrue(self.db.exists(old))
+
+    def test_keeps_index_blobs(self):
+        self.write('page.md', 'staged')
+        self.db.add_file('page.md')
+        staged = self.db.read_index()[0][1]
+        self.age(self.db._object_path(staged), 30)
+        gc.collect(self.db)
+        self.assertTrue(self.db.exists(staged))
+
+    def test_keeps_remote_branches(self):
+        self.write('page.md', 'remote')
+        self.db.add_file('page.md')
+        # As sync would, without touching master
+        remote_path = 'refs/remotes/%s' % ('ab' * 32)
+        os.makedirs(self.db._ref_path(remote_path))
+        remote = self.db.commit(remote_path + '/master')
+        for ident in self.db.list():
+            self.age(self.db._object_path(ident), 30)
+        result = gc.collect(self.db)
+        self.assertEqual(result.pruned, [])
+        self.assertTrue(self.db.exists(remote))
+
+    def test_stale_partials(self):
+        self.db.write_partial('a' * 64, 0, b'old')
+        self.db.write_partial('b' * 64, 0, b'new')
+        self.age(self.db._partial_path('a' * 64), 15)
+        result = gc.collect(self.db)
+        self.assertEqual(result.partials, ['a' * 64])
+        self.assertIsNone(self.db.partial_size('a' * 64))
+        self.assertEqual(self.db.partial_size('b' * 64), 3)
+
+    def test_bitmaps_rebuilt(self):
+        self.unreachable(b'old', 15)
+        gc.collect(self.db)
+        reachability = darkwiki.Reachability(self.db)
+        reachability.refresh()
+        self.assertEqual(set(reachability.commit_objects(self.commit)),
+                         set(self.db.list()))
+
+    def test_bitmaps_rebuilt_under_lock(self):
+        lock_path = os.path.join(self.db.dot_path,
+                                 darkwiki.reachability.LOCK_FILENAME)
+        blocked = []
+        def update(commit_ident):
+            # Stands in for a writer in another process
+            with open(lock_path, 'ab') as other_handle:
+                try:
+                    fcntl.flock(other_handle,
+                                fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    blocked.append(commit_ident)
+            original(commit_ident)
+        original = self.db.reachability.update
+        with mock.patch.object(self.db.reachability, 'update', update):
+            gc.collect(self.db)
+        self.assertEqual(blocked, [self.commit])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from fakes import make_db
+from unittest import mock
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'darkwiki.py')
+
+class LogTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp = tempfile.TemporaryDirectory()
+        self.root = self._temp.name
+        self.db = make_db(self.root)
+
+        # A page named like the branch below
+        self.commits = [
+            self._commit(1000, {'a.md': 'a', 'b/x.md': 'x'}),
+            self._commit(2000, {'a.md': 'a2'}),
+            self._commit(3000, {'b/x.md': 'x2'}),
+            self._commit(4000, {'main': 'page'})
+        ]
+        self.db.create_branch('main', self.commits[0])
+
+    def tearDown(self):
+        self._temp.cleanup()
+
+    def _commit(self, timestamp, files):
+        for filename, text in files.items():
+            path = os.path.join(self.root, filename)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as file_handle:
+                file_handle.write(text)
+            self.db.add_file(filename)
+        with mock.patch('time.time', return_value=timestamp):
+            return self.db.commit()
+
+    def log(self, *args):
+        environ = dict(os.environ, DARKWIKI_NO_DAEMON='1')
+        result = subprocess.run([sys.executable, SCRIPT, 'log'] + list(args),
+                                cwd=self.root, env=environ,
+                                capture_output=True, text=True)
+        idents = [line for line in result.stdout.split('\n')
+                  if len(line) == 64]
+        return result.returncode, idents, result.stderr
+
+    def commits_at(self, *indexes):
+        return [self.commits[index] for index in indexes]
+
+    def test_all(self):
+        self.assertEqual(self.log(), (0, self.commits_at(3, 2, 1, 0), ''))
+
+    def test_max_count(self):
+        self.assertEqual(self.log('-n', '2')[1], self.commits_at(3, 2))
+
+    def test_since_until(self):
+        _, idents, _ = self.log('--since', '2000', '--until', '3000')
+        self.assertEqual(idents, self.commits_at(2, 1))
+
+    def test_range(self):
+        revision = '%s..%s' % (self.commits[1], self.commits[3][:10])
+        self.assertEqual(self.log(revision)[1], self.commits_at(3, 2))
+
+    def test_paths(self):
+        self.assertEqual(self.log('--', 'a.md')[1], self.commits_at(1, 0))
+        self.assertEqual(self.log('--', 'b')[1], self.commits_at(2, 0))
+        self.assertEqual(self.log('--', 'a.md', 'b/x.md')[1],
+                         self.commits_at(2, 1, 0))
+
+    def test_paths_build_index(self):
+        filename = self.db.path_index.filename
+        self.assertFalse(os.path.exists(filename))
+        self.log()
+        self.assertFalse(os.path.exists(filename))
+        self.log('--', 'a.md')
+        self.assertTrue(os.path.exists(filename))
+
+    def test_page_named_like_a_revision(self):
+        self.assertEqual(self.log('--', 'main')[1], self.commits_at(3))
+        prefix = self.commits[0][:8]
+        self.assertEqual(self.log('--', prefix), (0, [], ''))
+        self.assertEqual(self.log('main')[1], self.commits_at(0))
+        self.assertEqual(self.log('HEAD', '--', 'main')[1],
+                         self.commits_at(3))
+        self.assertEqual(self.log('main', '--', 'main')[1], [])
+
+    def test_path_below_a_branch(self):
+        self.assertEqual(self.log('--', 'main/page.md'), (0, [], ''))
+
+    def test_unknown_revision(self):
+        code, idents, error = self.log('nosuchrev')
+        self.assertNotEqual(code, 0)
+        self.assertEqual(idents, [])
+        self.assertIn('unknown revision', error)
+
+        code, _, error = self.log('main/page.md')
+        self.assertNotEqual(code, 0)
+        self.assertIn('unknown revision', error)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import asyncio
+import darkwiki
+import os
+import unittest
+import zlib
+from darkwiki.micronet import (CAPABILITY_ZLIB, COMPRESS_THRESHOLD,
+                               FLAG_COMPRESSED, HelloMessage, MessageFactory,
+                               MessageHeader, Protocol, decompress_payload)
+from darkwiki.serialize import Deserializer, Layout, Serializer
+from fakes import FakeNode, make_channel
+from unittest import mock
+
+BLOB = darkwiki.DataType.BLOB
+TREE = darkwiki.DataType.TREE
+COMMIT = darkwiki.DataType.COMMIT
+
+IDENT = 'ab' * 32
+
+def round_trip(command, *args):
+    return MessageFactory.deserialize(MessageFactory.serialize(command, *args))
+
+class LayoutTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        layout = Layout(('ident', '32s'), ('size', 'I'), ('offset', 'i'))
+        self.assertEqual(layout.names, ('ident', 'size', 'offset'))
+        self.assertEqual(layout.size, 40)
+
+        serial = Serializer()
+        serial.write_layout(layout, b'x' * 32, 7, -3)
+        serial.write_byte(1)
+        deserial = Deserializer(serial.result())
+        self.assertEqual(deserial.read_layout(layout), (b'x' * 32, 7, -3))
+        self.assertEqual(deserial.read_byte(), 1)
+
+class MessageTest(unittest.TestCase):
+
+    def test_hello(self):
+        self.assertEqual(round_trip('hello', 3).capabilities, 3)
+        self.assertIsNone(HelloMessage.from_data(b''))
+
+    def test_sync(self):
+        tips = {'master': IDENT, 'other': 'cd' * 32}
+        self.assertEqual(round_trip('sync', tips).tips, tips)
+
+    def test_fetch_ack(self):
+        self.assertEqual(round_trip('fetch', IDENT).object_ident, IDENT)
+        for command in ('fetch_chunk', 'ack'):
+            message = round_trip(command, IDENT, 70000)
+            self.assertEqual((message.object_ident, message.offset),
+                             (IDENT, 70000))
+
+    def test_chunk(self):
+        message = round_trip('chunk', IDENT, 100000, 32768, b'data')
+        self.assertEqual((message.ident, message.total_size, message.offset,
+                          bytes(message.data)),
+                         (IDENT, 100000, 32768, b'data'))
+
+    def test_blob(self):
+        message = round_trip('object', IDENT, BLOB, b'page text')
+        self.assertEqual((message.ident, message.object_type), (IDENT, BLOB))
+        self.assertEqual(bytes(message.object), b'page text')
+
+    def test_tree(self):
+        tree = [('644', BLOB, IDENT, 'page.md'),
+                ('755', TREE, 'cd' * 32, 'subdir')]
+        message = round_trip('object', IDENT, TREE, tree)
+        self.assertEqual(message.object, tree)
+
+    def test_commit(self):
+        root = {'tree': IDENT, 'timestamp': 1600000000,
+                'utc_offset': -3600, 'previous_commit': None}
+        child = dict(root, previous_commit='cd' * 32)
+        for commit in (root, child):
+            message = round_trip('object', IDENT, COMMIT, commit)
+            self.assertEqual(message.object, commit)
+
+    def test_large_tree(self):
+        # One directory of 2000 pages is well over 64 KiB
+        tree = [('644', BLOB, '%064x' % index, 'page_%d.md' % index)
+                for index in range(2000)]
+        message = round_trip('object', IDENT, TREE, tree)
+        self.assertEqual(message.object, tree)
+
+class MessageHeaderTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        data = MessageHeader('fetch', b'payload', 1).to_data()
+        header = MessageHeader.from_data(data)
+        self.assertEqual((header.command, bytes(header.payload),
+                          header.flags), ('fetch', b'payload', 1))
+
+    def test_large_payload(self):
+        payload = os.urandom(100000)
+        data = MessageHeader('object', payload).to_data()
+        self.assertEqual(bytes(MessageHeader.from_data(data).payload),
+                         payload)
+
+    def test_rejects_corruption(self):
+        data = MessageHeader('fetch', b'payload').to_data()
+        self.assertIsNone(MessageHeader.from_data(data[:-1]))
+        self.assertIsNone(MessageHeader.from_data(data + b'x'))
+        for index in (0, 2, len(data) - 6, len(data) - 1):
+            corrupted = bytearray(data)
+            corrupted[index] ^= 1
+            self.assertIsNone(MessageHeader.from_data(bytes(corrupted)))
+
+    def test_unknown_command(self):
+        data = MessageHeader('nosuch', b'').to_data()
+        self.assertIsNone(MessageFactory.deserialize(data))
+
+class CompressionTest(unittest.TestCase):
+
+    def serialize(self, data, compress=True):
+        message_data = MessageFactory.serialize('object', IDENT, BLOB, data,
+                                                compress=compress)
+        header = MessageHeader.from_data(message_data)
+        message = MessageFactory.deserialize(message_data)
+        self.assertEqual(bytes(message.object), data)
+        return header
+
+    def test_small_payload_not_compressed(self):
+        # The object header and data size take 35 bytes
+        header = self.serialize(b'a' * (COMPRESS_THRESHOLD - 36))
+        self.assertFalse(header.flags & FLAG_COMPRESSED)
+
+    def test_large_payload_compressed(self):
+        header = self.serialize(b'a' * COMPRESS_THRESHOLD)
+        self.assertTrue(header.flags & FLAG_COMPRESSED)
+        self.assertLess(len(header.payload), COMPRESS_THRESHOLD)
+
+    def test_incompressible_payload_left_alone(self):
+        header = self.serialize(os.urandom(4096))
+        self.assertFalse(header.flags & FLAG_COMPRESSED)
+
+    def test_large_tree(self):
+        tree = [('644', BLOB, '%064x' % index, 'page_%d.md' % index)
+                for index in range(2000)]
+        message_data = MessageFactory.serialize('object', IDENT, TREE, tree,
+                                                compress=True)
+        header = MessageHeader.from_data(message_data)
+        self.assertTrue(header.flags & FLAG_COMPRESSED)
+        self.assertGreater(len(decompress_payload(header.payload)), 0xffff)
+        message = MessageFactory.deserialize(message_data)
+        self.assertEqual(message.object, tree)
+
+    def test_only_when_asked(self):
+        header = self.serialize(b'a' * 4096, compress=False)
+        self.assertFalse(header.flags & FLAG_COMPRESSED)
+
+    @mock.patch('darkwiki.micronet.MAX_DECOMPRESSED_SIZE', 4096)
+    def test_decompress_limits(self):
+        self.assertEqual(decompress_payload(zlib.compress(b'a' * 1000)),
+                         b'a' * 1000)
+        self.assertEqual(decompress_payload(zlib.compress(b'a' * 4096)),
+                         b'a' * 4096)
+        # Inflates beyond what we would accept
+        self.assertIsNone(decompress_payload(zlib.compress(b'a' * 4097)))
+        self.assertIsNone(decompress_payload(b'not zlib'))
+        self.assertIsNone(decompress_payload(zlib.compress(b'a' * 1000)[:-4]))
+
+    def test_enabled_by_hello(self):
+        async def run():
+            protocol = Protocol(make_channel(FakeNode()))
+            await protocol._process(HelloMessage(CAPABILITY_ZLIB))
+            enabled = protocol._compress
+            await protocol._process(HelloMessage())
+            return enabled, protocol._compress
+        self.assertEqual(asyncio.run(run()), (True, False))
+
+if __name__ == '__main__':
+    unittest.main()
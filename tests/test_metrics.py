@@ -0,0 +1,107 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from darkwiki.metrics import Histogram, Metrics
+
+class HistogramTest(unittest.TestCase):
+
+    def test_bucket_boundaries(self):
+        histogram = Histogram(buckets=(1, 2, 5))
+        for value in (0, 1, 1.5, 2, 2.01, 5, 5.01, 100):
+            histogram.observe(value)
+        # A value on a bound belongs to that bucket
+        self.assertEqual(histogram.counts, [2, 2, 2, 2])
+        self.assertEqual(histogram.to_dict()['buckets'],
+                         {'1': 2, '2': 2, '5': 2, 'inf': 2})
+
+    def test_quantiles(self):
+        histogram = Histogram(buckets=(1, 2, 5, 10))
+        for value in [0.5] * 50 + [1.5] * 40 + [4] * 9 + [7]:
+            histogram.observe(value)
+        self.assertEqual(histogram.quantile(0.5), 1)
+        self.assertEqual(histogram.quantile(0.51), 2)
+        self.assertEqual(histogram.quantile(0.9), 2)
+        self.assertEqual(histogram.quantile(0.99), 5)
+        # Never above the largest value seen
+        self.assertEqual(histogram.quantile(1.0), 7)
+
+    def test_overflow_quantile(self):
+        histogram = Histogram(buckets=(1,))
+        histogram.observe(0.5)
+        histogram.observe(40)
+        self.assertEqual(histogram.quantile(0.5), 1)
+        self.assertEqual(histogram.quantile(0.99), 40)
+
+    def test_summary(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.quantile(0.5), None)
+        self.assertEqual(histogram.to_dict()['mean'], None)
+        for value in (0.002, 0.004, 0.012):
+            histogram.observe(value)
+        result = histogram.to_dict()
+        self.assertEqual((result['count'], result['min'], result['max']),
+                         (3, 0.002, 0.012))
+        self.assertAlmostEqual(result['mean'], 0.006)
+        self.assertEqual(result['p50'], 0.005)
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self._temp.name, 'stats.json')
+
+    def tearDown(self):
+        self._temp.cleanup()
+
+    def test_peer_adds_to_totals(self):
+        metrics = Metrics()
+        metrics.increment('objects', 3, peer='a')
+        metrics.increment('objects', peer='b')
+        metrics.increment('objects')
+        metrics.observe('latency', 0.02, peer='a')
+        metrics.set_gauge('queue', 7, peer='a')
+        self.assertEqual(metrics.counters['objects'], 5)
+        self.assertEqual(metrics.peers['a'].counters['objects'], 3)
+        self.assertEqual(metrics.histograms['latency'].count, 1)
+        self.assertEqual(metrics.peers['a'].histograms['latency'].count, 1)
+        # Gauges are not summed
+        self.assertEqual(metrics.gauges, {})
+        self.assertEqual(metrics.peers['a'].gauges, {'queue': 7})
+
+    def test_write(self):
+        metrics = Metrics()
+        metrics.increment('envelopes_sent', 2, peer='127.0.0.1:1')
+        metrics.set_gauge('connected_peers', 1)
+        metrics.observe('fetch_latency', 0.03)
+        metrics.write(self.filename)
+
+        with open(self.filename) as file_handle:
+            stats = json.load(file_handle)
+        self.assertEqual(stats['counters'], {'envelopes_sent': 2})
+        self.assertEqual(stats['gauges'], {'connected_peers': 1})
+        self.assertEqual(stats['histograms']['fetch_latency']['count'], 1)
+        self.assertEqual(stats['histograms']['fetch_latency']['p50'], 0.03)
+        self.assertEqual(stats['peers']['127.0.0.1:1']['counters'],
+                         {'envelopes_sent': 2})
+        self.assertGreaterEqual(stats['uptime'], 0)
+        self.assertIn('time', stats)
+        # Written through a temporary file, which is gone
+        self.assertEqual(os.listdir(self._temp.name), ['stats.json'])
+
+    def test_write_periodically(self):
+        metrics = Metrics()
+        async def run():
+            task = asyncio.ensure_future(
+                metrics.write_periodically(self.filename, 0.01))
+            await asyncio.sleep(0.005)
+            metrics.increment('hello')
+            await asyncio.sleep(0.03)
+            task.cancel()
+        asyncio.run(run())
+        with open(self.filename) as file_handle:
+            self.assertEqual(json.load(file_handle)['counters'], {'hello': 1})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import random
+import tempfile
+import unittest
+from darkwiki.path_index import PathIndex
+from fakes import make_db
+
+class FakeDatabase:
+
+    def __init__(self, dot_path):
+        self.dot_path = dot_path
+
+def naive_walk(path_index, commit_ident, paths, stop_ident=None):
+    matching = path_index.matching_commits(paths)
+    result = []
+    while commit_ident != stop_ident:
+        if commit_ident in matching:
+            result.append(commit_ident)
+        commit_ident = path_index.parent(commit_ident)
+    return result
+
+class PathIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp = tempfile.TemporaryDirectory()
+        self.root = self._temp.name
+        self.db = make_db(self.root)
+
+    def tearDown(self):
+        self._temp.cleanup()
+
+    def _commit(self, files):
+        for filename, text in files.items():
+            path = os.path.join(self.root, filename)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as file_handle:
+                file_handle.write(text)
+            self.db.add_file(filename)
+        return self.db.commit()
+
+    def test_update_indexes_history(self):
+        first = self._commit({'a.md': 'a', 'ab/x.md': 'x', 'b/c/y.md': 'y'})
+        second = self._commit({'a.md': 'a2'})
+        third = self._commit({'b/c/y.md': 'y2', 'a/z.md': 'z'})
+        # Committing leaves the index to whoever needs it
+        self.assertFalse(os.path.exists(self.db.path_index.filename))
+        self.db.path_index.update(third)
+
+        # Another process only sees the file
+        path_index = PathIndex(self.db)
+        path_index.refresh()
+        self.assertEqual(path_index.generation(third), 3)
+        self.assertEqual(path_index.parent(third), second)
+
+        matching = path_index.matching_commits
+        self.assertEqual(matching(['a.md']), {first, second})
+        self.assertEqual(matching(['./b/']), {first, third})
+        self.assertEqual(matching(['a']), {third})
+        self.assertEqual(matching(['a.m']), set())
+        self.assertEqual(matching(['.']), {first, second, third})
+
+        self.assertEqual(list(path_index.walk(third, ['a.md'])),
+                         [second, first])
+        self.assertEqual(list(path_index.walk(third, ['a.md'], first)),
+                         [second])
+
+    def test_new_paths_are_matched(self):
+        path_index = self.db.path_index
+        first = self._commit({'a.md': 'a'})
+        path_index.update(first)
+        self.assertEqual(path_index.matching_commits(['a.md']), {first})
+        second = self._commit({'a/b.md': 'b'})
+        path_index.update(second)
+        self.assertEqual(path_index.matching_commits(['a']), {second})
+
+    def test_walk_across_branches(self):
+        path_index = PathIndex(FakeDatabase(self.root))
+        rng = random.Random(1)
+        commits = []
+        for index in range(2000):
+            ident = 'c%d' % index
+            # Mostly linear, with some branches off older commits
+            if not commits:
+                previous = None
+            elif rng.random() < 0.05:
+                previous = rng.choice(commits)
+            else:
+                previous = commits[-1]
+            generation = 1 if previous is None else \
+                path_index.generation(previous) + 1
+            paths = rng.sample(['a', 'b', 'd/e', 'd/f'], rng.randint(0, 2))
+            path_index._add(ident, previous, generation, paths)
+            commits.append(ident)
+
+        for _ in range(50):
+            start = rng.choice(commits)
+            paths = [rng.choice(['a', 'd', 'd/f'])]
+            self.assertEqual(list(path_index.walk(start, paths)),
+                             naive_walk(path_index, start, paths))
+
+            ancestors = []
+            ident = start
+            while ident is not None:
+                ancestors.append(ident)
+                ident = path_index.parent(ident)
+            stop = rng.choice(ancestors)
+            self.assertTrue(path_index.is_ancestor(stop, start))
+            self.assertEqual(list(path_index.walk(start, paths, stop)),
+                             naive_walk(path_index, start, paths, stop))
+
+            other = rng.choice(commits)
+            if other not in ancestors:
+                self.assertFalse(path_index.is_ancestor(other, start))
+                with self.assertRaises(ValueError):
+                    list(path_index.walk(start, paths, other))
+
+if __name__ == '__main__':
+    unittest.main()
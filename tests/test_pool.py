@@ -0,0 +1,105 @@
+import darkwiki
+import unittest
+from darkwiki.micronet import Pool, pool_object_size
+
+BLOB = darkwiki.DataType.BLOB
+TREE = darkwiki.DataType.TREE
+COMMIT = darkwiki.DataType.COMMIT
+
+class PoolAddTest(unittest.TestCase):
+
+    def test_add_accounts_size(self):
+        pool = Pool(None, None)
+        tree = [('644', BLOB, 'b' * 64, 'page.md')]
+        commit = {'tree': 't' * 64, 'timestamp': 1, 'utc_offset': 0,
+                  'previous_commit': None}
+
+        self.assertTrue(pool.add('1', BLOB, b'hello'))
+        self.assertTrue(pool.add('2', TREE, tree))
+        self.assertTrue(pool.add('3', COMMIT, commit))
+
+        self.assertEqual(len(pool), 3)
+        self.assertTrue(pool.exists('3'))
+        self.assertEqual(pool.size, 5 + pool_object_size(TREE, tree) +
+                                    pool_object_size(COMMIT, commit))
+
+    def test_add_again_replaces(self):
+        pool = Pool(None, None)
+        pool.add('1', BLOB, b'hello')
+        pool.add('1', BLOB, b'hi')
+        self.assertEqual(len(pool), 1)
+        self.assertEqual(pool.size, 2)
+
+class PoolEvictionTest(unittest.TestCase):
+
+    def test_oldest_evicted_first(self):
+        pool = Pool(None, None, max_bytes=10)
+        pool.add('1', BLOB, b'aaaa')
+        pool.add('2', BLOB, b'bbbb')
+        pool.add('3', BLOB, b'cccc')
+        self.assertFalse(pool.exists('1'))
+        self.assertTrue(pool.exists('2'))
+        self.assertTrue(pool.exists('3'))
+        self.assertEqual(pool.size, 8)
+
+    def test_evicts_until_within_budget(self):
+        pool = Pool(None, None, max_bytes=10)
+        for ident in '123':
+            pool.add(ident, BLOB, b'xxx')
+        pool.add('4', BLOB, b'y' * 8)
+        self.assertEqual(len(pool), 1)
+        self.assertEqual(pool.size, 8)
+
+    def test_oversize_object_rejected(self):
+        pool = Pool(None, None, max_bytes=10)
+        pool.add('1', BLOB, b'aaaa')
+        self.assertFalse(pool.add('2', BLOB, b'b' * 11))
+        self.assertFalse(pool.exists('2'))
+        self.assertTrue(pool.exists('1'))
+        self.assertEqual(pool.size, 4)
+
+    def test_evicted_commit_leaves_chain(self):
+        commit = make_commit(None)
+        size = pool_object_size(COMMIT, commit)
+        pool = Pool(None, None, max_bytes=size + 3)
+        pool.add('c', COMMIT, commit)
+        pool.add('1', BLOB, b'abcd')
+        self.assertFalse(pool.exists('c'))
+        self.assertEqual(pool._commits_map, {})
+        self.assertIsNone(pool._resolve_commit_chain())
+
+def make_commit(previous_commit):
+    return {'tree': 't' * 64, 'timestamp': 1, 'utc_offset': 0,
+            'previous_commit': previous_commit}
+
+class PoolChainTest(unittest.TestCase):
+
+    def test_longest_chain(self):
+        pool = Pool(None, None)
+        pool.add('a', COMMIT, make_commit(None))
+        pool.add('b', COMMIT, make_commit('a'))
+        pool.add('c', COMMIT, make_commit('b'))
+        pool.add('x', COMMIT, make_commit('a'))
+        chain = pool._resolve_commit_chain()
+        self.assertEqual([commit['ident'] for commit in chain],
+                         ['c', 'b', 'a'])
+
+    def test_cycle_is_broken(self):
+        pool = Pool(None, None)
+        pool.add('a', COMMIT, make_commit(None))
+        pool.add('b', COMMIT, make_commit('a'))
+        # c and d lead back to each other, e to itself
+        pool.add('c', COMMIT, make_commit('d'))
+        pool.add('d', COMMIT, make_commit('c'))
+        pool.add('e', COMMIT, make_commit('e'))
+        chain = pool._resolve_commit_chain()
+        self.assertEqual([commit['ident'] for commit in chain], ['b', 'a'])
+
+    def test_only_cycles(self):
+        pool = Pool(None, None)
+        pool.add('c', COMMIT, make_commit('d'))
+        pool.add('d', COMMIT, make_commit('c'))
+        self.assertIsNone(pool._resolve_commit_chain())
+
+if __name__ == '__main__':
+    unittest.main()
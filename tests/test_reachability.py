@@ -0,0 +1,136 @@
+import darkwiki
+import fcntl
+import os
+import tempfile
+import unittest
+from darkwiki.reachability import Reachability
+from fakes import make_db
+from unittest import mock
+
+def graph_walk(db, commit_ident, base_ident=None):
+    # Reads every object, for comparison with the bitmaps
+    def walk(ident):
+        seen = set()
+        pending = [ident]
+        while pending:
+            ident = pending.pop()
+            if ident is None or ident in seen:
+                continue
+            seen.add(ident)
+            type_, object_ = db.fetch(ident)
+            if type_ == darkwiki.DataType.TREE:
+                pending.extend(row[2] for row in object_)
+            elif type_ == darkwiki.DataType.COMMIT:
+                pending += [object_['tree'], object_['previous_commit']]
+        return seen
+    objects = walk(commit_ident)
+    if base_ident is not None:
+        objects -= walk(base_ident)
+    return objects
+
+@mock.patch('darkwiki.reachability.BITMAP_INTERVAL', 3)
+class ReachabilityTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp = tempfile.TemporaryDirectory()
+        self.root = self._temp.name
+        self.db = make_db(self.root)
+
+    def tearDown(self):
+        self._temp.cleanup()
+
+    def commit(self, index):
+        for filename in ('page_%d.md' % index, 'sub/page_%d.md' % (index % 3)):
+            path = os.path.join(self.root, filename)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as file_handle:
+                file_handle.write('%s %d' % (filename, index))
+            self.db.add_file(filename)
+        commit = self.db.commit()
+        # As sync does once it has the whole history
+        self.db.reachability.update(commit)
+        return commit
+
+    def bitmaps(self):
+        return sorted(os.listdir(self.db.reachability._bitmaps_path))
+
+    def test_objects_between(self):
+        commits = [self.commit(index) for index in range(8)]
+        reachability = Reachability(self.db)
+        for commit in commits:
+            self.assertEqual(set(reachability.objects_between(commit)),
+                             graph_walk(self.db, commit))
+        for base in commits[:5]:
+            self.assertEqual(
+                set(reachability.objects_between(commits[-1], base)),
+                graph_walk(self.db, commits[-1], base))
+
+    def test_bitmaps_at_intervals_and_tip(self):
+        commits = [self.commit(index) for index in range(8)]
+        # Generations 3 and 6, and the tip at 8
+        self.assertEqual(self.bitmaps(),
+                         sorted([commits[2], commits[5], commits[7]]))
+
+    def test_is_complete(self):
+        commit = self.commit(0)
+        reachability = Reachability(self.db)
+        reachability.refresh()
+        for ident in graph_walk(self.db, commit):
+            self.assertTrue(reachability.is_complete(ident))
+        self.assertFalse(reachability.is_complete('0' * 64))
+
+    def test_other_process_sees_positions(self):
+        first = self.commit(0)
+        other = Reachability(self.db)
+        self.assertEqual(set(other.objects_between(first)),
+                         graph_walk(self.db, first))
+        second = self.commit(1)
+        other.refresh()
+        self.assertEqual(set(other.commit_objects(second)),
+                         graph_walk(self.db, second))
+
+    def test_clear(self):
+        commit = self.commit(0)
+        reachability = self.db.reachability
+        reachability.clear()
+        self.assertEqual(self.bitmaps(), [])
+        self.assertFalse(os.path.exists(reachability._order_filename))
+        self.assertIsNone(reachability.commit_objects(commit))
+        # Still works by walking the objects, and can be built again
+        self.assertEqual(set(reachability.objects_between(commit)),
+                         graph_walk(self.db, commit))
+        reachability.update(commit)
+        self.assertEqual(self.bitmaps(), [commit])
+
+    def test_locked_excludes_other_writers(self):
+        commit = self.commit(0)
+        reachability = self.db.reachability
+        lock_path = os.path.join(self.db.dot_path,
+                                 darkwiki.reachability.LOCK_FILENAME)
+        with reachability.locked():
+            # Taken again from within, as gc does
+            reachability.clear()
+            reachability.update(commit)
+            with open(lock_path, 'ab') as other_handle:
+                with self.assertRaises(BlockingIOError):
+                    fcntl.flock(other_handle,
+                                fcntl.LOCK_EX | fcntl.LOCK_NB)
+        with open(lock_path, 'ab') as other_handle:
+            fcntl.flock(other_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.assertEqual(self.bitmaps(), [commit])
+
+    def test_skips_files_which_are_not_bitmaps(self):
+        self.commit(0)
+        second = self.commit(1)
+        # A bitmap being written by another process
+        partial = self.db.reachability._bitmap_filename(second) + '.tmp'
+        with open(partial, 'wb') as file_handle:
+            file_handle.write(darkwiki.reachability.encode_bitmap(1))
+        reachability = Reachability(self.db)
+        reachability.refresh()
+        self.assertEqual(sorted(reachability._bitmaps), [second])
+        self.assertEqual(set(reachability.commit_objects(second)),
+                         graph_walk(self.db, second))
+
+if __name__ == '__main__':
+    unittest.main()
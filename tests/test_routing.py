@@ -0,0 +1,51 @@
+import aiozmq
+import asyncio
+import unittest
+import zmq
+from darkwiki.micronet import node_topic
+
+class RoutingTest(unittest.TestCase):
+
+    def test_only_the_recipient_receives(self):
+        async def run():
+            publish = await aiozmq.create_zmq_stream(zmq.PUB)
+            address = await publish.transport.bind('tcp://127.0.0.1:*')
+            # Subscribed as a channel of that node would be
+            streams = {}
+            for node_id in (1, 2, 0x01000000):
+                stream = await aiozmq.create_zmq_stream(zmq.SUB)
+                stream.transport.subscribe(node_topic(node_id))
+                await stream.transport.connect(address)
+                streams[node_id] = stream
+            # Subscriptions reach the publisher asynchronously
+            await asyncio.sleep(0.3)
+
+            for node_id in (2, 1):
+                publish.write([node_topic(node_id), b'for %d' % node_id])
+            received = {}
+            for node_id, stream in streams.items():
+                try:
+                    frames = await asyncio.wait_for(stream.read(), 0.5)
+                except asyncio.TimeoutError:
+                    frames = None
+                received[node_id] = frames
+                stream.close()
+            publish.close()
+            return received
+        received = asyncio.run(run())
+        self.assertEqual(received, {
+            1: [node_topic(1), b'for 1'],
+            2: [node_topic(2), b'for 2'],
+            0x01000000: None
+        })
+
+    def test_topics_do_not_prefix_each_other(self):
+        # zmq matches subscriptions by prefix
+        topics = [node_topic(node_id)
+                  for node_id in (0, 1, 0xff, 0x100, 0xffffffff)]
+        for topic in topics:
+            self.assertEqual(len(topic), 4)
+        self.assertEqual(len(set(topics)), len(topics))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import darkwiki
+import unittest
+from seed import SeedNode
+
+class SeedNodeTest(unittest.TestCase):
+
+    def make_seed(self, count, **kwargs):
+        seed_node = SeedNode(**kwargs)
+        for index in range(count):
+            seed_node.register('10.0.0.%d:5000' % index, bytes([index]) * 32,
+                               now=index)
+        return seed_node
+
+    def test_register_again_refreshes(self):
+        seed_node = self.make_seed(3, ttl=10)
+        seed_node.register('10.0.0.0:5000', b'k' * 32, now=20)
+        self.assertEqual(len(seed_node), 3)
+        self.assertEqual(seed_node.expire(now=21), 2)
+        self.assertEqual(seed_node.sample(), [('10.0.0.0:5000', b'k' * 32)])
+
+    def test_ttl(self):
+        seed_node = self.make_seed(10, ttl=5)
+        self.assertEqual(seed_node.expire(now=5), 0)
+        # Peers seen at 0..3 are older than the ttl at 9
+        self.assertEqual(seed_node.expire(now=9), 4)
+        self.assertEqual(len(seed_node), 6)
+        addresses = sorted(address for address, _ in seed_node.sample())
+        self.assertEqual(addresses,
+                         ['10.0.0.%d:5000' % index for index in range(4, 10)])
+
+    def test_forget_keeps_positions(self):
+        seed_node = self.make_seed(5)
+        seed_node.forget('10.0.0.1:5000')
+        seed_node.forget('10.0.0.4:5000')
+        for address, position in seed_node._addr_positions.items():
+            self.assertEqual(seed_node._addr_list[position], address)
+        self.assertEqual(len(seed_node), 3)
+
+    def test_sample_size(self):
+        seed_node = self.make_seed(200, sample_size=64)
+        sample = seed_node.sample(exclude='10.0.0.7:5000')
+        addresses = [address for address, _ in sample]
+        self.assertEqual(len(sample), 64)
+        self.assertEqual(len(set(addresses)), 64)
+        self.assertNotIn('10.0.0.7:5000', addresses)
+
+    def test_sample_excludes_caller(self):
+        seed_node = self.make_seed(3, sample_size=2)
+        for _ in range(20):
+            sample = seed_node.sample(exclude='10.0.0.1:5000')
+            self.assertEqual(len(sample), 2)
+            self.assertNotIn('10.0.0.1:5000',
+                             [address for address, _ in sample])
+
+    def test_reply_data(self):
+        peers = [('10.0.0.1:5000', b'a' * 32), ('10.0.0.2:5000', b'b' * 32)]
+        data = SeedNode().reply_data(peers)
+        deserial = darkwiki.Deserializer(data)
+        count = deserial.read_2_bytes()
+        self.assertEqual([(deserial.read_string(),
+                           bytes(deserial.read_data()))
+                          for _ in range(count)], peers)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+from darkwiki.serialize import DeserialError, Deserializer, Serializer
+
+class SerializeTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        serial = Serializer()
+        serial.write_string('hello')
+        serial.write_fixed_string('abc', 8)
+        serial.write_byte(7)
+        serial.write_2_bytes(0xbeef)
+        serial.write_4_bytes(0xdeadbeef)
+        serial.write_data(b'payload')
+        serial.append(b'rest')
+
+        deserial = Deserializer(serial.result())
+        self.assertEqual(deserial.read_string(), 'hello')
+        self.assertEqual(deserial.read_fixed_string(8), 'abc')
+        self.assertEqual(deserial.read_byte(), 7)
+        self.assertEqual(deserial.read_2_bytes(), 0xbeef)
+        self.assertEqual(deserial.read_4_bytes(), 0xdeadbeef)
+        self.assertEqual(bytes(deserial.read_data()), b'payload')
+        self.assertTrue(deserial)
+        self.assertEqual(bytes(deserial.remaining_data()), b'rest')
+        self.assertEqual(bytes(deserial.read_fixed_data(4)), b'rest')
+        self.assertFalse(deserial)
+
+    def test_reads_are_views(self):
+        data = bytearray(b'\x00\x03abc')
+        deserial = Deserializer(data)
+        view = deserial.read_data()
+        self.assertIsInstance(view, memoryview)
+        data[2:5] = b'xyz'
+        self.assertEqual(bytes(view), b'xyz')
+
+    def test_truncated(self):
+        serial = Serializer()
+        serial.write_data(b'payload')
+        data = serial.result()
+        for size in range(len(data)):
+            deserial = Deserializer(data[:size])
+            with self.assertRaises(DeserialError):
+                deserial.read_data()
+        with self.assertRaises(DeserialError):
+            Deserializer(b'\x01').read_4_bytes()
+        with self.assertRaises(DeserialError):
+            Deserializer(b'\x05abc').read_string()
+
+if __name__ == '__main__':
+    unittest.main()
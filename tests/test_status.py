@@ -0,0 +1,76 @@
+import darkwiki
+import os
+import tempfile
+import unittest
+from fakes import make_db
+
+class StatusTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp = tempfile.TemporaryDirectory()
+        self.root = self._temp.name
+        self.db = make_db(self.root)
+        self.interface = darkwiki.Interface(self.db)
+
+        for filename in ('kept.md', 'changed.md', 'removed.md',
+                         'deleted.md', 'sub/page.md'):
+            # Identical blobs in one directory are not supported
+            self.write(filename, filename)
+            self.db.add_file(filename)
+        self.db.commit()
+
+    def tearDown(self):
+        self._temp.cleanup()
+
+    def write(self, filename, text):
+        path = os.path.join(self.root, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file_handle:
+            file_handle.write(text)
+
+    def test_clean(self):
+        self.assertEqual(self.interface.status(), ([], [], []))
+
+    def test_classification(self):
+        # Staged
+        self.write('changed.md', 'new text')
+        self.db.add_file('changed.md')
+        self.write('added.md', 'added')
+        self.db.add_file('added.md')
+        self.db.remove_from_index('removed.md')
+        # Not staged
+        self.write('sub/page.md', 'new text')
+        os.remove(os.path.join(self.root, 'deleted.md'))
+        # Staged and then changed again
+        self.write('changed.md', 'newer text')
+        # Untracked
+        self.write('notes.txt', 'text')
+        self.write('.darkwikiignore', '*.swp\n')
+        self.write('page.swp', 'text')
+
+        staged, unstaged, untracked = self.interface.status()
+        self.assertEqual(staged, [('new file', 'added.md'),
+                                  ('modified', 'changed.md'),
+                                  ('deleted', 'removed.md')])
+        self.assertEqual(unstaged, [('modified', 'changed.md'),
+                                    ('deleted', 'deleted.md'),
+                                    ('modified', 'sub/page.md')])
+        self.assertEqual(untracked, ['.darkwikiignore', 'notes.txt',
+                                     'removed.md'])
+
+    def test_dirty_paths(self):
+        # Only the paths the watcher reports are hashed
+        self.write('changed.md', 'new text')
+        self.write('sub/page.md', 'new text')
+        _, unstaged, _ = self.interface.status({'changed.md'})
+        self.assertEqual(unstaged, [('modified', 'changed.md')])
+        self.assertEqual(self.interface.status(set()), ([], [], []))
+
+    def test_before_first_commit(self):
+        os.remove(os.path.join(self.db.dot_path, 'refs', 'heads', 'master'))
+        staged, _, _ = self.interface.status()
+        self.assertEqual([change for change, _ in staged],
+                         ['new file'] * 5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+import io
+import os
+import pstats
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from darkwiki import timing
+from unittest import mock
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'darkwiki.py')
+
+class SpanTest(unittest.TestCase):
+
+    def setUp(self):
+        timing.reset()
+        timing.enable()
+        # Every reading of the clock is one second later
+        self._clock = mock.patch(
+            'time.perf_counter',
+            side_effect=[float(tick) for tick in range(100)])
+        self._clock.start()
+
+    def tearDown(self):
+        self._clock.stop()
+        timing.disable()
+        timing.reset()
+
+    def spans(self):
+        return {name: (calls, total, longest)
+                for name, calls, total, _, longest in timing.summary()}
+
+    def test_nesting(self):
+        with timing.span('outer'):
+            with timing.span('inner'):
+                pass
+            with timing.span('inner'):
+                pass
+        self.assertEqual(self.spans(), {
+            # Started at 0, ended at 5
+            'outer': (1, 5.0, 5.0),
+            'inner': (2, 2.0, 1.0)
+        })
+
+    def test_recursion_timed_once(self):
+        @timing.timed
+        def countdown(count):
+            if count:
+                countdown(count - 1)
+        countdown(3)
+        name = countdown.__qualname__
+        # Four calls, but the time is only that of the outermost,
+        # from 0 to 4, and not the sum of every call
+        self.assertEqual(self.spans(), {name: (4, 4.0, 4.0)})
+
+    def test_longest_and_sorted(self):
+        for _ in range(2):
+            with timing.span('short'):
+                pass
+        with timing.span('long'):
+            for _ in range(2):
+                with timing.span('short'):
+                    pass
+        self.assertEqual([row[0] for row in timing.summary()],
+                         ['long', 'short'])
+        self.assertEqual(self.spans()['short'], (4, 4.0, 1.0))
+        self.assertEqual(self.spans()['long'], (1, 5.0, 5.0))
+
+    def test_disabled(self):
+        timing.disable()
+        with timing.span('outer'):
+            pass
+        self.assertEqual(timing.summary(), [])
+
+    def test_print_summary(self):
+        with timing.span('outer'):
+            with timing.span('inner'):
+                pass
+        output = io.StringIO()
+        timing.print_summary(output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(lines[0].split(),
+                         ['span', 'calls', 'total', 'ms', 'mean', 'ms',
+                          'max', 'ms'])
+        self.assertEqual([line.split() for line in lines[1:]], [
+            ['outer', '1', '3000.00', '3000.000', '3000.000'],
+            ['inner', '1', '1000.00', '1000.000', '1000.000']
+        ])
+
+def busy(seconds):
+    end = time.process_time() + seconds
+    while time.process_time() < end:
+        pass
+
+class ProfileTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._temp.cleanup()
+
+    def test_collapsed_stacks(self):
+        filename = os.path.join(self._temp.name, 'run.folded')
+        with timing.profile(filename):
+            busy(0.2)
+        with open(filename) as file_handle:
+            lines = file_handle.read().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            self.assertGreater(int(count), 0)
+            # Outermost frame first, this test within
+            frames = stack.split(';')
+            self.assertTrue(re.match(r'.+ \(.+:\d+\)$', frames[0]))
+        self.assertTrue(any('busy (' in line for line in lines))
+
+    def test_sampler_counts_stacks(self):
+        sampler = timing.StackSampler()
+        frame = sys._getframe()
+        sampler._sample(None, frame)
+        sampler._sample(None, frame)
+        filename = os.path.join(self._temp.name, 'run.collapsed')
+        sampler.dump(filename)
+        with open(filename) as file_handle:
+            stack, count = file_handle.read().rstrip('\n').rsplit(' ', 1)
+        self.assertEqual(count, '2')
+        self.assertTrue(stack.split(';')[-1].startswith(
+            'test_sampler_counts_stacks ('))
+
+    def test_cprofile_stats(self):
+        filename = os.path.join(self._temp.name, 'run.prof')
+        with timing.profile(filename):
+            busy(0.01)
+        functions = [function for _, _, function
+                     in pstats.Stats(filename).stats]
+        self.assertIn('busy', functions)
+
+class TimingsOptionTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp = tempfile.TemporaryDirectory()
+        self.root = self._temp.name
+
+    def tearDown(self):
+        self._temp.cleanup()
+
+    def run_command(self, *args):
+        environ = dict(os.environ, DARKWIKI_NO_DAEMON='1')
+        return subprocess.run([sys.executable, SCRIPT] + list(args),
+                              cwd=self.root, env=environ,
+                              capture_output=True, text=True)
+
+    def test_timings(self):
+        self.run_command('init')
+        with open(os.path.join(self.root, 'page.md'), 'w') as file_handle:
+            file_handle.write('page')
+        self.run_command('add', 'page.md')
+
+        result = self.run_command('--timings', 'commit')
+        self.assertEqual(result.returncode, 0)
+        lines = result.stderr.splitlines()
+        self.assertEqual(lines[0].split()[:2], ['span', 'calls'])
+        names = [line.split()[0] for line in lines[1:]]
+        self.assertIn('DiskDatabase.write_dirtree', names)
+
+        # Nothing is printed without it
+        self.run_command('add', 'page.md')
+        self.assertEqual(self.run_command('commit').stderr, '')
+
+if __name__ == '__main__':
+    unittest.main()
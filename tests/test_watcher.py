@@ -0,0 +1,78 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from darkwiki.watcher import Watcher, dirty_paths
+from fakes import make_db
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'needs inotify')
+class WatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp = tempfile.TemporaryDirectory()
+        self.root = self._temp.name
+        self.db = make_db(self.root)
+        for filename in ('a.md', 'sub/b.md', 'sub/c.md'):
+            self.write(filename, 'text')
+            self.db.add_file(filename)
+
+        self.watcher = Watcher(self.db)
+        self.watcher.start()
+        deadline = time.monotonic() + 5
+        while not os.path.exists(self.watcher.dirty_filename):
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.watcher.stop()
+        self._temp.cleanup()
+
+    def write(self, filename, text):
+        path = os.path.join(self.root, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file_handle:
+            file_handle.write(text)
+
+    def test_clean(self):
+        self.assertEqual(dirty_paths(self.db), set())
+
+    def test_modified_file(self):
+        self.write('sub/b.md', 'changed')
+        self.assertEqual(dirty_paths(self.db), {'sub/b.md'})
+
+    def test_untracked_file(self):
+        # May be reported, callers only look at indexed paths
+        self.write('new.md', 'text')
+        self.assertLessEqual(dirty_paths(self.db), {'new.md'})
+
+    def test_index_update_clears(self):
+        self.write('a.md', 'changed')
+        self.assertEqual(dirty_paths(self.db), {'a.md'})
+        self.db.add_file('a.md')
+        self.assertEqual(dirty_paths(self.db), set())
+
+    def test_changed_back(self):
+        self.write('a.md', 'changed')
+        self.write('a.md', 'text')
+        # Reported until the watcher rehashes it after an index change
+        self.assertLessEqual(dirty_paths(self.db), {'a.md'})
+
+    def test_removed_directory(self):
+        shutil.rmtree(os.path.join(self.root, 'sub'))
+        self.assertEqual(dirty_paths(self.db), {'sub/b.md', 'sub/c.md'})
+
+    def test_new_directory(self):
+        self.write('other/d.md', 'text')
+        self.db.add_file('other/d.md')
+        self.assertEqual(dirty_paths(self.db), set())
+        self.write('other/d.md', 'changed')
+        self.assertEqual(dirty_paths(self.db), {'other/d.md'})
+
+    def test_no_watcher(self):
+        self.watcher.stop()
+        self.assertIsNone(dirty_paths(self.db))
+
+if __name__ == '__main__':
+    unittest.main()